@@ -1,67 +1,806 @@
 import os
 import json
-from threading import Lock
+import heapq
+import itertools
+import asyncio
+from threading import Lock, RLock
 from datetime import datetime
 import threading
 import time
+import atexit
 import logging
+import shutil
 import requests
 from dotenv import load_dotenv
+from lib.fileio import atomic_write_bytes, rotate_backups, list_backups
+from lib import jsoncodec
+from lib.sqlitestore import (SQLiteStore, ROOT_BUCKET, CUSTOM_BUCKET_PREFIX, custom_bucket,
+                             import_db_dict, export_db_dict)
+from lib.shardstore import ShardStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("dbsync")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(BASE_DIR, "database.json")
-DB_BACKUP_FILE = os.path.join(BASE_DIR, "database.json.bak")
-_db_lock = Lock()
+# 世代バックアップ（database.json.bak.1 が最新）
+DEFAULT_DB_BACKUP_GENERATIONS = 3
+DEFAULT_DB_BACKUP_INTERVAL = 600  # 秒。これより短い間隔の保存ではバックアップを取らない
+# キャッシュの変更・シリアライズを保護するロック（同一スレッドからの再入を許可）
+_db_lock = RLock()
+# ファイル書き込みの直列化用ロック（シリアライズ後のディスクI/Oのみを保護）
+_db_write_lock = Lock()
 
 # --- グローバルDBキャッシュ管理 ---
 global_db_cache = None
 
+_last_db_backup_at = 0.0
+
+def _get_env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _read_json_file(path):
+    """JSONファイルを読み込む。空ファイルは空のDBとして扱う"""
+    with open(path, "rb") as f:
+        content = f.read()
+    if not content.strip():
+        return {}
+    return jsoncodec.loads(content)
+
+def _load_db_file():
+    """database.jsonを読み込む。破損している場合は新しい世代のバックアップから順に復旧を試みる"""
+    if not os.path.exists(DB_FILE):
+        candidates = list_backups(DB_FILE)
+        if not candidates:
+            return {}
+        logger.warning("database.jsonが見つかりません。バックアップから復旧します。")
+    else:
+        try:
+            return _read_json_file(DB_FILE)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            logger.error(f"database.jsonの読み込みに失敗しました: {e}")
+            # 破損ファイルは上書きされないよう退避しておく
+            shutil.copy2(DB_FILE, f"{DB_FILE}.corrupt")
+        candidates = list_backups(DB_FILE)
+    for backup in candidates:
+        try:
+            data = _read_json_file(backup)
+            logger.warning(f"バックアップ {os.path.basename(backup)} から復旧しました")
+            return data
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            logger.error(f"バックアップ {os.path.basename(backup)} の読み込みに失敗しました: {e}")
+    logger.error("利用可能なバックアップがありません。空のDBとして起動します。")
+    return {}
+
 def load_db_cache():
     global global_db_cache
+    store = _get_sqlite_store()
+    if store is not None:
+        # SQLiteバックエンドではメモリ上に全体を保持しないため、その都度database.json形式に組み立てる
+        return export_db_dict(store, _nested_buckets())
+    shards = _get_shard_store()
+    if shards is not None:
+        return shards.read_all()
     if global_db_cache is None:
-        if os.path.exists(DB_FILE):
-            with _db_lock, open(DB_FILE, "r", encoding="utf-8") as f:
-                global_db_cache = json.load(f)
-        else:
-            global_db_cache = {}
+        with _db_lock:
+            if global_db_cache is None:
+                db = _load_db_file()
+                _replay_db_journal(db)
+                global_db_cache = db
+                if _journal_files() and not _journal_enabled():
+                    # ジャーナル無効で起動した場合は残っていたジャーナルをスナップショットへ畳み込む
+                    compact_db_journal()
     return global_db_cache
 
+def _serialize_db():
+    """キャッシュをdatabase.json形式のバイト列にする（_db_lockを保持して呼ぶこと）"""
+    return jsoncodec.dumps(global_db_cache)
+
+def _write_db_file(payload):
+    """シリアライズ済みのDBをdatabase.jsonへアトミックに書き込む"""
+    global _last_db_backup_at
+    with _db_write_lock:
+        # バックアップはDB_BACKUP_INTERVAL秒に1回だけ世代を進める
+        backups = 0
+        now = time.time()
+        if now - _last_db_backup_at >= _get_env_int("DB_BACKUP_INTERVAL", DEFAULT_DB_BACKUP_INTERVAL):
+            backups = _get_env_int("DB_BACKUP_GENERATIONS", DEFAULT_DB_BACKUP_GENERATIONS)
+            _last_db_backup_at = now
+        atomic_write_bytes(DB_FILE, payload, backups=backups)
+
 def save_db_cache():
     global global_db_cache
     if global_db_cache is not None:
-        with _db_lock, open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(global_db_cache, f, ensure_ascii=False, indent=2)
+        # シリアライズ中の変更を防ぐためロック内で文字列化し、書き込みはロック外で行う
+        with _db_lock:
+            payload = _serialize_db()
+            version = _db_version
+        _write_db_file(payload)
+        _publish_db_snapshot(version, payload)
 
 # --- 既存の_get/_save_dbをキャッシュ対応に書き換え ---
 def _load_db():
     return load_db_cache()
 
 def _save_db(data):
+    """DB全体を保存する（変更箇所が分からない場合のフォールバック。ジャーナル有効時はスナップショットを作り直す）"""
     global global_db_cache
+    _bump_db_version()
+    store = _get_sqlite_store()
+    if store is not None:
+        with store.transaction():
+            for bucket in (ROOT_BUCKET,) + _nested_buckets():
+                store.delete_bucket(bucket)
+            import_db_dict(store, data, _nested_buckets())
+        return
+    shards = _get_shard_store()
+    if shards is not None:
+        with _db_lock:
+            for name in set(shards.names()) - set(data):
+                shards.delete(name)
+            for name, value in data.items():
+                shards.put(name, value, write=False)
+                _persist_shard(shards, name)
+        return
     global_db_cache = data
-    save_db_cache()
+    if _db_flush_interval > 0:
+        # write-behind中は変更をマークするだけで、書き込みはフラッシャーがまとめて行う
+        _mark_db_dirty()
+    elif _journal_enabled():
+        compact_db_journal()
+    else:
+        save_db_cache()
+
+# --- パス単位の変更操作 ---
+# path はルートからのキーのタプル（例: ("123", "AntiCheat") / ("userData", "456")）
+
+def _set_path(root, path, value):
+    """rootのpath位置にvalueを設定する（途中の辞書は自動作成）。リスト要素は添字で指定できる"""
+    parent = root
+    for key in path[:-1]:
+        if isinstance(parent, list):
+            parent = parent[key]
+            continue
+        child = parent.get(key)
+        if not isinstance(child, (dict, list)):
+            child = {}
+            parent[key] = child
+        parent = child
+    last = path[-1]
+    if isinstance(parent, list):
+        if last < len(parent):
+            parent[last] = value
+        else:
+            parent.append(value)
+    else:
+        parent[last] = value
+
+def _delete_path(root, path):
+    """rootのpath位置の値を削除する。存在しなければFalse"""
+    parent = root
+    for key in path[:-1]:
+        if isinstance(parent, list):
+            if not isinstance(key, int) or key >= len(parent):
+                return False
+            parent = parent[key]
+        elif isinstance(parent, dict) and key in parent:
+            parent = parent[key]
+        else:
+            return False
+    last = path[-1]
+    if isinstance(parent, list):
+        if isinstance(last, int) and last < len(parent):
+            del parent[last]
+            return True
+        return False
+    if isinstance(parent, dict) and last in parent:
+        del parent[last]
+        return True
+    return False
+
+_MISSING = object()
+
+def _db_get(path, default=None):
+    """DBのpath位置の値を取得する（JSONバックエンドではキャッシュ上のオブジェクトそのものを返す）"""
+    store = _get_sqlite_store()
+    shards = _get_shard_store()
+    if shards is not None:
+        node = shards.get(str(path[0]), _MISSING)
+        if node is _MISSING:
+            return default
+        rest = path[1:]
+    elif store is None:
+        node = _load_db()
+        rest = path
+    elif len(path) == 1 and path[0] in _nested_buckets():
+        return store.items(path[0]) if store.count(path[0]) else default
+    else:
+        bucket, key, rest = _sqlite_locate(path)
+        node = store.get(bucket, key, _MISSING)
+        if node is _MISSING:
+            return default
+    for key in rest:
+        if not isinstance(node, dict) or key not in node:
+            return default
+        node = node[key]
+    return node
+
+def _db_has(path):
+    """DBのpath位置に値が存在するか"""
+    return _db_get(path, _MISSING) is not _MISSING
+
+def _db_set(path, value):
+    """DBのpath位置に値を設定して永続化する"""
+    store = _get_sqlite_store()
+    if store is not None:
+        _sqlite_set(store, path, value)
+        return
+    shards = _get_shard_store()
+    if shards is not None:
+        _shard_set(shards, path, value)
+        return
+    with _db_lock:
+        db = _load_db()
+        _set_path(db, path, value)
+        _persist("s", path, value)
+
+def _db_delete(path):
+    """DBのpath位置の値を削除して永続化する。削除した場合はTrue"""
+    store = _get_sqlite_store()
+    if store is not None:
+        return _sqlite_delete(store, path)
+    shards = _get_shard_store()
+    if shards is not None:
+        return _shard_delete(shards, path)
+    with _db_lock:
+        db = _load_db()
+        if not _delete_path(db, path):
+            return False
+        _persist("d", path)
+        return True
+
+def _persist(op, path, value=None):
+    """メモリ上で適用済みの変更を永続化する（ジャーナル追記 / write-behind / 即時保存）"""
+    _bump_db_version()
+    if _journal_enabled():
+        _journal_append(op, path, value)
+    elif _db_flush_interval > 0:
+        _mark_db_dirty()
+    else:
+        save_db_cache()
+
+# --- SQLiteバックエンド ---
+# 環境変数 DB_BACKEND=sqlite の場合、database.jsonの代わりにdatabase.sqlite3へ行単位で保存する。
+# ギルド・タイムスタンプ等のトップレベルキーは"root"バケットの1行、userData/api_keysは子キー毎に1行、
+# カスタムDBは"custom:<名前>"バケットに入る。変更は触れた行だけを読み書きする。
+DB_SQLITE_FILE = os.path.join(BASE_DIR, "database.sqlite3")
+_sqlite_store = None
+_sqlite_exported_writes = 0  # 最後にdatabase.jsonへ書き出した時点の書き込み回数
+
+def _db_backend():
+    """環境変数 DB_BACKEND（json / sqlite / sharded、デフォルトjson）"""
+    return os.environ.get("DB_BACKEND", "json").lower()
+
+def _nested_buckets():
+    """子キー単位で行を分けるトップレベルキー"""
+    return (USER_DB_KEY, API_KEY_DB_KEY)
+
+def _get_sqlite_store():
+    """SQLiteバックエンドが有効ならストアを返す。初回オープン時に空であればdatabase.jsonから移行する"""
+    global _sqlite_store
+    if _sqlite_store is not None:
+        return _sqlite_store
+    if _db_backend() != "sqlite":
+        return None
+    with _db_lock:
+        if _sqlite_store is None:
+            store = SQLiteStore(os.environ.get("DB_SQLITE_PATH", DB_SQLITE_FILE))
+            if store.is_empty() and (os.path.exists(DB_FILE) or _journal_files()):
+                data = _load_db_file()
+                _replay_db_journal(data)
+                count = import_db_dict(store, data, _nested_buckets())
+                logger.info(f"database.jsonをSQLiteへ移行しました（{count}行）")
+            _sqlite_store = store
+    return _sqlite_store
+
+def _sqlite_locate(path):
+    """DBのパスを (バケット, 行キー, 行内のパス) に分解する"""
+    if path[0] in _nested_buckets() and len(path) > 1:
+        return path[0], str(path[1]), tuple(path[2:])
+    return ROOT_BUCKET, str(path[0]), tuple(path[1:])
+
+def _sqlite_set(store, path, value):
+    if len(path) == 1 and path[0] in _nested_buckets() and isinstance(value, dict):
+        store.replace_bucket(path[0], value)
+        _bump_db_version()
+        return
+    bucket, key, rest = _sqlite_locate(path)
+    if not rest:
+        store.put(bucket, key, value)
+        _bump_db_version()
+        return
+    # 行内の一部だけを変更する場合は同じトランザクション内で読み込み→書き戻しを行う
+    with store.transaction():
+        row = store.get(bucket, key)
+        if not isinstance(row, (dict, list)):
+            row = {}
+        _set_path(row, rest, value)
+        store.put(bucket, key, row)
+    _bump_db_version()
+
+def _sqlite_delete(store, path):
+    if len(path) == 1 and path[0] in _nested_buckets():
+        deleted = store.delete_bucket(path[0]) > 0
+    else:
+        bucket, key, rest = _sqlite_locate(path)
+        if not rest:
+            deleted = store.delete(bucket, key)
+        else:
+            with store.transaction():
+                row = store.get(bucket, key)
+                deleted = row is not None and _delete_path(row, rest)
+                if deleted:
+                    store.put(bucket, key, row)
+    if deleted:
+        _bump_db_version()
+    return deleted
+
+def _sqlite_checkpoint(store):
+    """WALを本体へ書き戻し、前回以降に変更があればdatabase.jsonへも書き出す（プッシュ・バックアップ用）"""
+    global _sqlite_exported_writes
+    store.checkpoint()
+    writes = store.stats["writes"]
+    if writes == _sqlite_exported_writes:
+        return False
+    version = _db_version
+    payload = jsoncodec.dumps(export_db_dict(store, _nested_buckets()))
+    _write_db_file(payload)
+    _publish_db_snapshot(version, payload)
+    _sqlite_exported_writes = writes
+    return True
+
+# --- シャード分割バックエンド ---
+# 環境変数 DB_BACKEND=sharded の場合、トップレベルキー（ギルドID・userData・api_keys等）ごとに
+# database.d/<キー>.json へ分割して保存する。シャードはアクセス時に読み込み、
+# DB_SHARD_CACHE_BYTES を超えたら使われていないものから追い出す。書き戻すのは変更したシャードのみ。
+DB_SHARD_DIR = os.path.join(BASE_DIR, "database.d")
+DEFAULT_DB_SHARD_CACHE_BYTES = 32 * 1024 * 1024
+_shard_store = None
+_shard_exported_version = 0  # 最後にdatabase.jsonへ書き出した時点のシャード更新回数
+
+def _get_shard_store():
+    """シャード分割バックエンドが有効ならストアを返す。初回オープン時に空であればdatabase.jsonから分割する"""
+    global _shard_store
+    if _shard_store is not None:
+        return _shard_store
+    if _db_backend() != "sharded":
+        return None
+    with _db_lock:
+        if _shard_store is None:
+            store = ShardStore(os.environ.get("DB_SHARD_DIR", DB_SHARD_DIR),
+                               _get_env_int("DB_SHARD_CACHE_BYTES", DEFAULT_DB_SHARD_CACHE_BYTES))
+            if not store.names() and (os.path.exists(DB_FILE) or _journal_files()):
+                data = _load_db_file()
+                _replay_db_journal(data)
+                for name, value in data.items():
+                    store.put(name, value)
+                logger.info(f"database.jsonを{len(data)}個のシャードへ分割しました")
+            _shard_store = store
+    return _shard_store
+
+def _persist_shard(shards, name):
+    """変更したシャードを書き戻す。write-behind中はdirtyのままにしてフラッシャーに任せる（_db_lockを保持して呼ぶこと）"""
+    _bump_db_version()
+    if _db_flush_interval > 0:
+        _db_write_stats["mutations"] += 1
+        _db_write_stats["pending_writes"] += 1
+    else:
+        shards.write(name)
+
+def _shard_set(shards, path, value):
+    name = str(path[0])
+    with _db_lock:
+        if len(path) == 1:
+            shards.put(name, value, write=False)
+        else:
+            shard = shards.get(name)
+            if not isinstance(shard, (dict, list)):
+                shard = {}
+            _set_path(shard, path[1:], value)
+            shards.put(name, shard, write=False)
+        _persist_shard(shards, name)
+
+def _shard_delete(shards, path):
+    name = str(path[0])
+    with _db_lock:
+        if len(path) == 1:
+            deleted = shards.delete(name)
+            if deleted:
+                _bump_db_version()
+            return deleted
+        shard = shards.get(name)
+        if shard is None or not _delete_path(shard, path[1:]):
+            return False
+        shards.mark_dirty(name)
+        _persist_shard(shards, name)
+        return True
+
+def _flush_shards(shards, checkpoint):
+    """dirtyなシャードを書き戻す。checkpoint時は前回以降に変更があればdatabase.jsonも書き出す"""
+    global _shard_exported_version
+    started = time.perf_counter()
+    with _db_lock:
+        pending = _db_write_stats["pending_writes"]
+        _db_write_stats["pending_writes"] = 0
+        written = shards.flush()
+        payload = None
+        version = shards.stats["writes"] + shards.stats["deletes"]
+        if checkpoint and version != _shard_exported_version:
+            payload = jsoncodec.dumps(shards.read_all())
+            snapshot_version = _db_version
+            _shard_exported_version = version
+    if payload is not None:
+        _write_db_file(payload)
+        _publish_db_snapshot(snapshot_version, payload)
+    if not written and payload is None:
+        return False
+    with _db_lock:
+        _db_write_stats["flushes"] += 1
+        _db_write_stats["coalesced_writes"] += max(0, pending - written)
+        _db_write_stats["last_flush"] = datetime.now().isoformat()
+        _db_write_stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return True
+
+# --- 追記型ジャーナル（WAL） ---
+# 変更を1行1レコード（["s", path, value] / ["d", path]）でdatabase.journal.<世代>へ追記し、
+# 起動時にスナップショット(database.json)へ再生する。サイズが閾値を超えたらスナップショットへ畳み込む。
+# レコードはすべて絶対値の設定/削除なので、スナップショットに反映済みのレコードを再生しても結果は変わらない。
+DB_JOURNAL_PREFIX = os.path.join(BASE_DIR, "database.journal")
+DEFAULT_DB_JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+_journal_mode = None
+_journal_generation = 0
+_journal_fp = None
+_journal_buffer = []  # write-behind中にまだファイルへ書いていないレコード
+_compaction_lock = Lock()
+_journal_stats = {
+    "records": 0,           # 現在のジャーナルに含まれるレコード数
+    "bytes": 0,             # 現在のジャーナルのサイズ
+    "appended": 0,          # 起動後に追記したレコード数
+    "compactions": 0,
+    "last_compaction": None,
+    "replayed_records": 0,  # 起動時に再生したレコード数
+    "replay_ms": 0.0,
+}
+
+def _journal_enabled():
+    """環境変数 DB_JOURNAL が有効ならジャーナルモード"""
+    global _journal_mode
+    if _journal_mode is None:
+        _journal_mode = os.environ.get("DB_JOURNAL", "").lower() in ("1", "true", "yes")
+    return _journal_mode
+
+def _journal_files():
+    """存在するジャーナルファイルを世代順に返す: [(世代, パス), ...]"""
+    directory = os.path.dirname(DB_JOURNAL_PREFIX)
+    prefix = os.path.basename(DB_JOURNAL_PREFIX) + "."
+    files = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            files.append((int(name[len(prefix):]), os.path.join(directory, name)))
+    return sorted(files)
+
+def _replay_db_journal(db):
+    """ジャーナルをスナップショットへ再生する（末尾の書きかけレコードは無視）"""
+    global _journal_generation
+    started = time.perf_counter()
+    replayed = 0
+    total_bytes = 0
+    files = _journal_files()
+    for generation, path in files:
+        with open(path, "rb") as f:
+            for line in f:
+                total_bytes += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = jsoncodec.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logger.warning(f"{os.path.basename(path)} の不完全なレコードをスキップしました")
+                    continue
+                if record[0] == "s":
+                    _set_path(db, record[1], record[2])
+                elif record[0] == "d":
+                    _delete_path(db, record[1])
+                replayed += 1
+        _journal_generation = max(_journal_generation, generation)
+    elapsed = round((time.perf_counter() - started) * 1000, 2)
+    _journal_stats["replayed_records"] = replayed
+    _journal_stats["replay_ms"] = elapsed
+    _journal_stats["records"] = replayed
+    _journal_stats["bytes"] = total_bytes
+    if files:
+        logger.info(f"DBジャーナルを再生しました: {replayed}件 / {total_bytes}バイト / {elapsed}ms")
+
+def _journal_path():
+    return f"{DB_JOURNAL_PREFIX}.{_journal_generation}"
+
+def _journal_write(lines, fsync=False):
+    """レコード行を現在の世代のジャーナルへ追記する（_db_lockを保持して呼ぶこと）"""
+    global _journal_fp
+    if _journal_fp is None:
+        _journal_fp = open(_journal_path(), "ab")
+    data = b"".join(lines)
+    _journal_fp.write(data)
+    _journal_fp.flush()
+    if fsync:
+        os.fsync(_journal_fp.fileno())
+    _journal_stats["records"] += len(lines)
+    _journal_stats["bytes"] += len(data)
+
+def _journal_append(op, path, value=None):
+    """変更レコードを追記する。write-behind中はバッファし、フラッシャーがまとめて書き込む"""
+    record = [op, list(path)] if op == "d" else [op, list(path), value]
+    line = jsoncodec.dumps(record, compact=True) + b"\n"
+    with _db_lock:
+        _journal_stats["appended"] += 1
+        if _db_flush_interval > 0:
+            _journal_buffer.append(line)
+            _db_write_stats["mutations"] += 1
+            _db_write_stats["pending_writes"] += 1
+            return
+        _journal_write([line])
+    if _journal_stats["bytes"] >= _get_env_int("DB_JOURNAL_COMPACT_BYTES", DEFAULT_DB_JOURNAL_COMPACT_BYTES):
+        compact_db_journal()
+
+def compact_db_journal():
+    """
+    ジャーナルをスナップショット(database.json)へ畳み込む。
+    ロック内でDBをシリアライズして世代を進め、スナップショットが書けた後に古い世代のジャーナルを削除する。
+    """
+    global _journal_generation, _journal_fp, _db_dirty
+    if not _compaction_lock.acquire(blocking=False):
+        return False  # 他スレッドで実行中
+    try:
+        with _db_lock:
+            if global_db_cache is None:
+                return False
+            payload = _serialize_db()
+            version = _db_version
+            # バッファ中のレコードはメモリに反映済みなのでスナップショットに含まれる
+            _journal_buffer.clear()
+            _db_dirty = False
+            if _journal_fp is not None:
+                _journal_fp.close()
+                _journal_fp = None
+            folded = [path for generation, path in _journal_files() if generation <= _journal_generation]
+            _journal_generation += 1
+            _journal_stats["records"] = 0
+            _journal_stats["bytes"] = 0
+        _write_db_file(payload)
+        _publish_db_snapshot(version, payload)
+        for path in folded:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"{os.path.basename(path)} の削除に失敗しました: {e}")
+        _journal_stats["compactions"] += 1
+        _journal_stats["last_compaction"] = datetime.now().isoformat()
+        return True
+    finally:
+        _compaction_lock.release()
+
+# --- 読み取り用スナップショット ---
+# 書き込み側はDBを保存するたびにシリアライズ済みのバイト列を (バージョン, バイト列, 作成時刻) のタプルとして公開する。
+# タプルは作成後に変更せず、参照の差し替えだけで更新するため、読み取り側（Flaskスレッド）は_db_lockを取らずに読める。
+DEFAULT_DB_SNAPSHOT_MAX_AGE = 5.0  # 秒。公開済みスナップショットが古い場合に作り直すまでの猶予
+_db_version_counter = itertools.count(1)
+_db_version = 0      # 変更のたびに増えるDBのバージョン
+_db_snapshot = None  # (バージョン, シリアライズ済みバイト列, 作成時刻)
+_snapshot_build_lock = Lock()
+_snapshot_stats = {"published": 0, "rebuilt": 0}
+
+def _bump_db_version():
+    global _db_version
+    _db_version = next(_db_version_counter)
+
+def _publish_db_snapshot(version, payload):
+    """保存時にシリアライズしたバイト列をスナップショットとして公開する（古いバージョンでは上書きしない）"""
+    global _db_snapshot
+    current = _db_snapshot
+    if current is None or version >= current[0]:
+        _db_snapshot = (version, payload, time.time())
+        _snapshot_stats["published"] += 1
+
+def _build_db_snapshot():
+    """現在のDBをシリアライズしてスナップショットを作る"""
+    store = _get_sqlite_store()
+    if store is not None:
+        version = _db_version
+        return version, jsoncodec.dumps(export_db_dict(store, _nested_buckets()), compact=True)
+    with _db_lock:
+        version = _db_version
+        shards = _get_shard_store()
+        data = shards.read_all() if shards is not None else load_db_cache()
+        return version, jsoncodec.dumps(data, compact=True)
+
+def get_db_snapshot(max_age=None):
+    """
+    最新のスナップショット (バージョン, バイト列, 作成時刻) を返す。
+    公開済みのものが最新でなく、かつmax_age秒（デフォルト DB_SNAPSHOT_MAX_AGE）より古い場合だけ作り直す。
+    作り直しは同時に1スレッドのみで、その間の他の読み取りには公開済みのものを返す。
+    """
+    if max_age is None:
+        try:
+            max_age = float(os.environ.get("DB_SNAPSHOT_MAX_AGE", DEFAULT_DB_SNAPSHOT_MAX_AGE))
+        except ValueError:
+            max_age = DEFAULT_DB_SNAPSHOT_MAX_AGE
+    snapshot = _db_snapshot
+    if snapshot is not None and (snapshot[0] == _db_version or time.time() - snapshot[2] < max_age):
+        return snapshot
+    if not _snapshot_build_lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        snapshot = _db_snapshot
+        if snapshot is None or snapshot[0] != _db_version:
+            version, payload = _build_db_snapshot()
+            _publish_db_snapshot(version, payload)
+            _snapshot_stats["rebuilt"] += 1
+        return _db_snapshot
+    finally:
+        _snapshot_build_lock.release()
+
+# --- write-behind（遅延書き込み）管理 ---
+DEFAULT_DB_FLUSH_INTERVAL = 5.0  # 秒
+_db_flush_interval = 0.0  # 0以下なら従来通り変更毎に即時書き込み
+_db_dirty = False
+_db_flusher_thread = None
+_db_flusher_stop = threading.Event()
+_db_write_stats = {
+    "mutations": 0,          # 永続化が要求された変更の回数
+    "flushes": 0,            # 実際にファイルへ書き込んだ回数
+    "coalesced_writes": 0,   # 1回のフラッシュにまとめられて省略された書き込み回数
+    "pending_writes": 0,     # 次回フラッシュ待ちの変更数
+    "last_flush": None,
+    "last_flush_ms": 0.0,
+}
+
+def _mark_db_dirty():
+    """キャッシュを変更済みとしてマーク（write-behind用）"""
+    global _db_dirty
+    with _db_lock:
+        _db_dirty = True
+        _db_write_stats["mutations"] += 1
+        _db_write_stats["pending_writes"] += 1
+
+def flush_db(checkpoint=False):
+    """
+    保留中の変更を書き出す。書き込んだ場合はTrueを返す。
+    checkpoint=Trueの場合、ジャーナルモードでもdatabase.jsonへ畳み込む（プッシュ前・終了時用）。
+    """
+    global _db_dirty
+    if _sqlite_store is not None:
+        # SQLiteは変更毎にコミット済み。チェックポイント時のみdatabase.jsonを書き出す
+        return _sqlite_checkpoint(_sqlite_store) if checkpoint else False
+    if _shard_store is not None:
+        return _flush_shards(_shard_store, checkpoint)
+    journal = _journal_enabled()
+    with _db_lock:
+        lines = list(_journal_buffer)
+        _journal_buffer.clear()
+        snapshot = _db_dirty or (checkpoint and journal and (lines or _journal_stats["records"] > 0))
+        _db_dirty = False
+        pending = _db_write_stats["pending_writes"]
+        _db_write_stats["pending_writes"] = 0
+        if lines and not snapshot:
+            # ジャーナルへの追記はロック内で行い、レコードの順序を保証する
+            _journal_write(lines, fsync=True)
+    if not lines and not snapshot:
+        return False
+    started = time.perf_counter()
+    try:
+        if snapshot:
+            if journal:
+                compact_db_journal()
+            else:
+                save_db_cache()
+        elif _journal_stats["bytes"] >= _get_env_int("DB_JOURNAL_COMPACT_BYTES", DEFAULT_DB_JOURNAL_COMPACT_BYTES):
+            compact_db_journal()
+    except Exception:
+        # 失敗した変更は次回のフラッシュで再試行する
+        with _db_lock:
+            _db_dirty = True
+            _db_write_stats["pending_writes"] += pending
+        raise
+    with _db_lock:
+        _db_write_stats["flushes"] += 1
+        _db_write_stats["coalesced_writes"] += max(0, pending - 1)
+        _db_write_stats["last_flush"] = datetime.now().isoformat()
+        _db_write_stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return True
+
+def start_db_flusher(interval_sec=None):
+    """
+    write-behindモードを開始する。
+    変更は即時書き込みされず、interval_sec秒ごとに1回の書き込みへまとめられる。
+    interval_secを省略した場合は環境変数 DB_FLUSH_INTERVAL（デフォルト5秒）を使用し、0以下なら何もしない。
+    """
+    global _db_flusher_thread, _db_flush_interval
+    if interval_sec is None:
+        try:
+            interval_sec = float(os.environ.get("DB_FLUSH_INTERVAL", DEFAULT_DB_FLUSH_INTERVAL))
+        except ValueError:
+            interval_sec = DEFAULT_DB_FLUSH_INTERVAL
+    if interval_sec <= 0:
+        return
+    if _db_backend() == "sqlite":
+        logger.info("SQLiteバックエンドでは変更毎にコミットするため、write-behindは使用しません")
+        return
+    _db_flush_interval = interval_sec
+    if _db_flusher_thread and _db_flusher_thread.is_alive():
+        return  # すでに動作中（間隔のみ更新）
+    _db_flusher_stop.clear()
+    def flush_loop():
+        while not _db_flusher_stop.wait(_db_flush_interval):
+            try:
+                flush_db()
+            except Exception as e:
+                logger.error(f"database.jsonのフラッシュに失敗しました: {e}")
+    _db_flusher_thread = threading.Thread(target=flush_loop, daemon=True, name="db-flusher")
+    _db_flusher_thread.start()
+    logger.info(f"DB write-behindを開始しました（{interval_sec}秒間隔）")
+
+def stop_db_flusher():
+    """write-behindモードを終了し、保留中の変更を書き出して即時書き込みに戻す"""
+    global _db_flusher_thread, _db_flush_interval
+    _db_flusher_stop.set()
+    if _db_flusher_thread and _db_flusher_thread.is_alive() and _db_flusher_thread is not threading.current_thread():
+        _db_flusher_thread.join(timeout=_db_flush_interval + 1)
+    _db_flusher_thread = None
+    _db_flush_interval = 0.0
+    flush_db()
+
+def get_db_write_stats():
+    """書き込み統計（監視用）を取得"""
+    with _db_lock:
+        stats = dict(_db_write_stats)
+        stats["journal"] = dict(_journal_stats, enabled=_journal_enabled())
+    stats["backend"] = _db_backend()
+    snapshot = _db_snapshot
+    stats["snapshot"] = dict(_snapshot_stats, version=_db_version,
+                             snapshot_version=snapshot[0] if snapshot else None,
+                             snapshot_bytes=len(snapshot[1]) if snapshot else 0)
+    if _sqlite_store is not None:
+        stats["sqlite"] = dict(_sqlite_store.stats, path=_sqlite_store.path)
+    if _shard_store is not None:
+        stats["shards"] = _shard_store.cache_info()
+    stats["write_behind"] = _db_flush_interval > 0
+    stats["flush_interval"] = _db_flush_interval
+    return stats
+
+def _flush_on_exit():
+    try:
+        flush_db(checkpoint=True)
+    except Exception as e:
+        logger.error(f"終了時のDBフラッシュに失敗しました: {e}")
+
+# プロセス終了時に保留中の変更を書き出す（os._exit時は呼ばれないため明示的なflush_dbも併用する）
+atexit.register(_flush_on_exit)
 
 # ギルド毎のデータ管理機能
 def get_guild_data(guild_id):
     """指定されたギルドのデータを取得"""
-    db = _load_db()
-    return db.get(str(guild_id), {})
+    return _db_get((str(guild_id),), {})
 
 def set_guild_data(guild_id, data):
     """指定されたギルドのデータを保存"""
-    db = _load_db()
-    db[str(guild_id)] = data
-    _save_db(db)
+    _db_set((str(guild_id),), data)
 
 def update_guild_data(guild_id, key, value):
     """指定されたギルドの特定のキーのデータを更新"""
-    db = _load_db()
-    guild_data = db.setdefault(str(guild_id), {})
-    guild_data[key] = value
-    _save_db(db)
+    _db_set((str(guild_id), key), value)
 
 def get_guild_value(guild_id, key, default=None):
     """指定されたギルドの特定のキーの値を取得"""
@@ -70,44 +809,38 @@ def get_guild_value(guild_id, key, default=None):
 
 def delete_guild_data(guild_id):
     """指定されたギルドのデータを削除"""
-    db = _load_db()
-    if str(guild_id) in db:
-        del db[str(guild_id)]
-        _save_db(db)
+    _db_delete((str(guild_id),))
 
 def get_all_guilds():
     """全てのギルドIDのリストを取得"""
+    store = _get_sqlite_store()
+    if store is not None:
+        return store.keys(ROOT_BUCKET) + [bucket for bucket in _nested_buckets() if store.count(bucket)]
+    shards = _get_shard_store()
+    if shards is not None:
+        # シャード名の索引から返すため、各ギルドのシャードは読み込まない
+        return shards.names()
     db = _load_db()
     return list(db.keys())
 
 def has_guild_data(guild_id):
     """指定されたギルドのデータが存在するかチェック"""
-    db = _load_db()
-    return str(guild_id) in db
+    return _db_has((str(guild_id),))
 
 # ユーザー毎のデータ管理機能
 USER_DB_KEY = "userData"
 
 def get_user_data(user_id):
     """指定されたユーザーのデータを取得"""
-    db = _load_db()
-    user_db = db.setdefault(USER_DB_KEY, {})
-    return user_db.get(str(user_id), {})
+    return _db_get((USER_DB_KEY, str(user_id)), {})
 
 def set_user_data(user_id, data):
     """指定されたユーザーのデータを保存"""
-    db = _load_db()
-    user_db = db.setdefault(USER_DB_KEY, {})
-    user_db[str(user_id)] = data
-    _save_db(db)
+    _db_set((USER_DB_KEY, str(user_id)), data)
 
 def update_user_data(user_id, key, value):
     """指定されたユーザーの特定のキーのデータを更新"""
-    db = _load_db()
-    user_db = db.setdefault(USER_DB_KEY, {})
-    user_data = user_db.setdefault(str(user_id), {})
-    user_data[key] = value
-    _save_db(db)
+    _db_set((USER_DB_KEY, str(user_id), key), value)
 
 def get_user_value(user_id, key, default=None):
     """指定されたユーザーの特定のキーの値を取得"""
@@ -116,23 +849,18 @@ def get_user_value(user_id, key, default=None):
 
 def delete_user_data(user_id):
     """指定されたユーザーのデータを削除"""
-    db = _load_db()
-    user_db = db.setdefault(USER_DB_KEY, {})
-    if str(user_id) in user_db:
-        del user_db[str(user_id)]
-        _save_db(db)
+    _db_delete((USER_DB_KEY, str(user_id)))
 
 def has_user_data(user_id):
     """指定されたユーザーのデータが存在するかチェック"""
-    db = _load_db()
-    user_db = db.setdefault(USER_DB_KEY, {})
-    return str(user_id) in user_db
+    return _db_has((USER_DB_KEY, str(user_id)))
 
 def get_all_users():
     """全てのユーザーIDのリストを取得"""
-    db = _load_db()
-    user_db = db.setdefault(USER_DB_KEY, {})
-    return list(user_db.keys())
+    store = _get_sqlite_store()
+    if store is not None:
+        return store.keys(USER_DB_KEY)
+    return list(_db_get((USER_DB_KEY,), {}).keys())
 
 # チャンネル設定管理機能
 def get_channel_config(guild_id, channel_id):
@@ -143,11 +871,7 @@ def get_channel_config(guild_id, channel_id):
 
 def set_channel_config(guild_id, channel_id, config):
     """指定されたチャンネルの設定を保存"""
-    db = _load_db()
-    guild_data = db.setdefault(str(guild_id), {})
-    channels = guild_data.setdefault("channels", {})
-    channels[str(channel_id)] = config
-    _save_db(db)
+    _db_set((str(guild_id), "channels", str(channel_id)), config)
 
 def update_channel_config(guild_id, channel_id, key, value):
     """指定されたチャンネルの特定の設定を更新"""
@@ -162,79 +886,220 @@ def get_channel_value(guild_id, channel_id, key, default=None):
 
 def delete_channel_config(guild_id, channel_id):
     """指定されたチャンネルの設定を削除"""
-    db = _load_db()
-    guild_data = db.get(str(guild_id), {})
-    channels = guild_data.get("channels", {})
-    if str(channel_id) in channels:
-        del channels[str(channel_id)]
-        _save_db(db)
+    _db_delete((str(guild_id), "channels", str(channel_id)))
+
+# --- パス指定の部分更新API ---
+# ギルド・ユーザーのデータ全体を読み込んで書き戻す代わりに、変更したい位置だけを更新する。
+# path の先頭は "guild" / "user" で、例: ("guild", guild_id, "AntiCheat", "detection_settings", "text_spam")
+# それ以外の先頭キーはdatabase.jsonのトップレベルキーとしてそのまま扱う。
+# ジャーナル・シャード・SQLiteの各バックエンドでは、変更した位置（を含む行/シャード）だけが永続化される。
+
+def _resolve_path(path):
+    """部分更新API用のパスをDB内部のパス（文字列キーのタプル）に変換する"""
+    if isinstance(path, (str, int)):
+        path = (path,)
+    head, rest = path[0], tuple(path[1:])
+    if head == "guild":
+        if not rest:
+            raise ValueError("ギルドIDが指定されていません")
+        return (str(rest[0]),) + rest[1:]
+    if head == "user":
+        if not rest:
+            raise ValueError("ユーザーIDが指定されていません")
+        return (USER_DB_KEY, str(rest[0])) + rest[1:]
+    return (str(head),) + rest
+
+def get_path(path, default=None):
+    """指定位置の値を取得"""
+    return _db_get(_resolve_path(path), default)
+
+def patch(path, value):
+    """指定位置に値を設定（途中の辞書は自動作成）"""
+    _db_set(_resolve_path(path), value)
+
+def remove_path(path):
+    """指定位置の値を削除。削除した場合はTrue"""
+    return _db_delete(_resolve_path(path))
+
+def increment(path, amount=1, minimum=None, maximum=None):
+    """指定位置の数値に amount を加算し、加算後の値を返す（値がなければ0から。minimum/maximumで範囲を制限）"""
+    resolved = _resolve_path(path)
+    with _db_lock:
+        current = _db_get(resolved, 0)
+        if not isinstance(current, (int, float)) or isinstance(current, bool):
+            current = 0
+        value = current + amount
+        if minimum is not None:
+            value = max(minimum, value)
+        if maximum is not None:
+            value = min(maximum, value)
+        _db_set(resolved, value)
+    return value
+
+def append_to_list(path, value, max_length=None, unique=False):
+    """
+    指定位置のリストに値を追加（リストがなければ作成）。
+    max_lengthを超えた分は古い要素から削除し、unique=Trueなら既に含まれる値は追加しない。
+    追加した場合はTrueを返す。
+    """
+    resolved = _resolve_path(path)
+    with _db_lock:
+        current = _db_get(resolved)
+        items = list(current) if isinstance(current, list) else []
+        if unique and value in items:
+            return False
+        items.append(value)
+        if max_length is not None and len(items) > max_length:
+            del items[:len(items) - max_length]
+        # ジャーナルの再生が冪等になるよう、添字単位ではなくリスト全体を記録する
+        _db_set(resolved, items)
+    return True
+
+def remove_from_list(path, value):
+    """指定位置のリストから値を（最初の1つ）削除。削除した場合はTrue"""
+    resolved = _resolve_path(path)
+    with _db_lock:
+        current = _db_get(resolved)
+        if not isinstance(current, list) or value not in current:
+            return False
+        items = list(current)
+        items.remove(value)
+        _db_set(resolved, items)
+    return True
 
 # --- GuildDatabaseカテゴリ管理 ---
 # GuildDatabaseクラスは廃止
 
 # === APIキー管理 ===
 API_KEY_DB_KEY = "api_keys"
-_db_lock = Lock()
-
-# APIキーの期限切れ自動削除ループ
-_cleanup_thread = None
-def start_api_key_cleanup_loop(interval_sec=60):
-    global _cleanup_thread
-    if _cleanup_thread and _cleanup_thread.is_alive():
-        return  # すでに動作中
-    def cleanup_loop():
-        while True:
+API_KEY_EXPIRE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# 期限切れ管理用のインデックス（初回アクセス時に1度だけ構築し、save/deleteで更新する）
+# ヒープには (期限のUNIX時刻, キー) を積み、_api_key_expiry と一致しないエントリは削除・更新済みとして読み飛ばす
+_api_key_heap = []
+_api_key_expiry = {}  # {api_key: 期限のUNIX時刻}
+_api_key_index_lock = Lock()
+_api_key_index_loaded = False
+_api_key_loop = None
+_api_key_wakeup = None
+_api_key_task = None
+
+def _parse_api_key_expire(expire):
+    if isinstance(expire, str):
+        expire = datetime.strptime(expire, API_KEY_EXPIRE_FORMAT)
+    return expire.timestamp()
+
+def _ensure_api_key_index():
+    """DB上のAPIキーから期限のヒープを構築する（初回のみ）"""
+    global _api_key_index_loaded
+    if _api_key_index_loaded:
+        return
+    api_keys = _db_get((API_KEY_DB_KEY,), {})
+    with _api_key_index_lock:
+        if _api_key_index_loaded:
+            return
+        for key, info in list(api_keys.items()):
             try:
-                db = _load_db()
-                api_keys = db.get(API_KEY_DB_KEY, {})
-                now = datetime.now()
-                to_delete = []
-                for k, v in list(api_keys.items()):
-                    try:
-                        expire = v["expire"]
-                        if isinstance(expire, str):
-                            expire = datetime.strptime(expire, "%Y-%m-%dT%H:%M:%S")
-                        if now > expire:
-                            to_delete.append(k)
-                    except Exception:
-                        continue
-                for k in to_delete:
-                    del api_keys[k]
-                if to_delete:
-                    db[API_KEY_DB_KEY] = api_keys
-                    _save_db(db)
+                _api_key_expiry[key] = _parse_api_key_expire(info["expire"])
             except Exception:
-                pass
-            time.sleep(interval_sec)
-    _cleanup_thread = threading.Thread(target=cleanup_loop, daemon=True)
-    _cleanup_thread.start()
+                continue
+        _api_key_heap[:] = [(expire, key) for key, expire in _api_key_expiry.items()]
+        heapq.heapify(_api_key_heap)
+        _api_key_index_loaded = True
+
+def _wake_api_key_timer():
+    """期限切れタイマーを起こして次の期限を再計算させる（どのスレッドからでも呼べる）"""
+    if _api_key_loop is not None and _api_key_wakeup is not None and not _api_key_loop.is_closed():
+        _api_key_loop.call_soon_threadsafe(_api_key_wakeup.set)
+
+def _index_api_key(api_key, expire_ts):
+    with _api_key_index_lock:
+        _api_key_expiry[api_key] = expire_ts
+        heapq.heappush(_api_key_heap, (expire_ts, api_key))
+        earliest = _api_key_heap[0] == (expire_ts, api_key)
+    if earliest:
+        _wake_api_key_timer()
+
+def _pop_expired_api_keys(now):
+    """期限切れのキーをヒープから取り出す。O(期限切れ件数 × log n)"""
+    expired = []
+    with _api_key_index_lock:
+        while _api_key_heap and _api_key_heap[0][0] <= now:
+            expire_ts, key = heapq.heappop(_api_key_heap)
+            if _api_key_expiry.get(key) == expire_ts:
+                del _api_key_expiry[key]
+                expired.append(key)
+    return expired
+
+def _next_api_key_expiry():
+    """次に期限切れになるキーの期限（なければNone）"""
+    with _api_key_index_lock:
+        while _api_key_heap and _api_key_expiry.get(_api_key_heap[0][1]) != _api_key_heap[0][0]:
+            heapq.heappop(_api_key_heap)
+        return _api_key_heap[0][0] if _api_key_heap else None
+
+async def _api_key_expiry_loop():
+    """次の期限までスリープし、期限切れのキーだけを削除する"""
+    while True:
+        _api_key_wakeup.clear()
+        try:
+            for key in _pop_expired_api_keys(time.time()):
+                _db_delete((API_KEY_DB_KEY, key))
+        except Exception as e:
+            logger.error(f"期限切れAPIキーの削除に失敗しました: {e}")
+        next_expiry = _next_api_key_expiry()
+        timeout = None if next_expiry is None else max(0.0, next_expiry - time.time())
+        try:
+            await asyncio.wait_for(_api_key_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def start_api_key_cleanup_loop(interval_sec=None):
+    """
+    APIキーの期限切れ自動削除を開始する（実行中のイベントループ上で呼ぶこと）。
+    全件を定期的に走査する代わりに、期限のヒープを見て次の期限までスリープする。
+    interval_secは旧実装との互換のために残している（未使用）。
+    """
+    global _api_key_loop, _api_key_wakeup, _api_key_task
+    if _api_key_task and not _api_key_task.done():
+        return  # すでに動作中
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        logger.warning("イベントループ外で呼ばれたため、APIキーの自動削除は開始しません（期限切れキーは参照時に無効化されます）")
+        return
+    _ensure_api_key_index()
+    _api_key_loop = loop
+    _api_key_wakeup = asyncio.Event()
+    _api_key_task = loop.create_task(_api_key_expiry_loop())
 
 def save_api_key(user_id, api_key, expire):
-    db = _load_db()
-    api_keys = db.setdefault(API_KEY_DB_KEY, {})
-    api_keys[api_key] = {
+    _ensure_api_key_index()
+    _db_set((API_KEY_DB_KEY, api_key), {
         "user_id": user_id,
-        "expire": expire.strftime("%Y-%m-%dT%H:%M:%S")
-    }
-    _save_db(db)
+        "expire": expire.strftime(API_KEY_EXPIRE_FORMAT)
+    })
+    # 保存時の文字列は秒未満を切り捨てるため、期限も同じ精度にそろえる
+    _index_api_key(api_key, _parse_api_key_expire(expire.replace(microsecond=0)))
 
 def get_api_key(api_key):
-    db = _load_db()
-    api_keys = db.get(API_KEY_DB_KEY, {})
-    info = api_keys.get(api_key)
+    """APIキーの情報を取得。存在しない・期限切れの場合はNone（期限切れのキーはその場で削除する）"""
+    info = _db_get((API_KEY_DB_KEY, api_key))
     if not info:
         return None
     # 期限をdatetime型で返す
     info = info.copy()
-    info["expire"] = datetime.strptime(info["expire"], "%Y-%m-%dT%H:%M:%S")
+    info["expire"] = datetime.strptime(info["expire"], API_KEY_EXPIRE_FORMAT)
+    if datetime.now() > info["expire"]:
+        delete_api_key(api_key)
+        return None
     return info
 
 def delete_api_key(api_key):
-    db = _load_db()
-    api_keys = db.get(API_KEY_DB_KEY, {})
-    if api_key in api_keys:
-        del api_keys[api_key]
-        _save_db(db)
+    _db_delete((API_KEY_DB_KEY, api_key))
+    with _api_key_index_lock:
+        # ヒープ内のエントリは次に先頭へ来たときに読み飛ばされる
+        _api_key_expiry.pop(api_key, None)
 
 # --- タイムスタンプ記録 ---
 load_dotenv(os.path.join(BASE_DIR, ".env"))
@@ -245,15 +1110,12 @@ TIMESTAMP_SAVED_KEY = "db_last_saved"
 
 def record_db_timestamp(key: str):
     """database.jsonに現在時刻のタイムスタンプを記録する"""
-    db = _load_db()
-    db[key] = datetime.utcnow().isoformat()
-    _save_db(db)
+    _db_set((key,), datetime.utcnow().isoformat())
 
 
 def get_db_timestamp(key: str):
     """database.jsonから指定キーのタイムスタンプを取得"""
-    db = _load_db()
-    return db.get(key)
+    return _db_get((key,))
 
 # --- カスタムJSONデータベース管理 ---
 custom_db_caches = {}  # {db_name: cache_data}
@@ -263,6 +1125,25 @@ def get_custom_db_path(db_name):
     """カスタムデータベースのファイルパスを取得"""
     return os.path.join(BASE_DIR, f"{db_name}.json")
 
+def _custom_store(db_name):
+    """SQLiteバックエンドならストアを返す。カスタムDBファイルが残っていれば初回アクセス時に取り込む"""
+    store = _get_sqlite_store()
+    if store is None:
+        return None
+    if db_name not in custom_db_caches:
+        bucket = custom_bucket(db_name)
+        db_file = get_custom_db_path(db_name)
+        if not store.count(bucket) and os.path.exists(db_file):
+            try:
+                data = _read_json_file(db_file)
+                store.replace_bucket(bucket, data)
+                logger.info(f"カスタムDB {db_name} をSQLiteへ移行しました（{len(data)}件）")
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                logger.warning(f"カスタムDB {db_name} のJSONが破損しているため移行しませんでした。")
+        # SQLiteモードではキャッシュを持たず、移行済みの印としてのみ使う
+        custom_db_caches[db_name] = None
+    return store
+
 def get_custom_db_lock(db_name):
     """カスタムデータベース用のロックを取得（なければ作成）"""
     if db_name not in custom_db_locks:
@@ -272,13 +1153,16 @@ def get_custom_db_lock(db_name):
 def load_custom_db_cache(db_name):
     """カスタムデータベースのキャッシュを読み込み"""
     global custom_db_caches
+    store = _custom_store(db_name)
+    if store is not None:
+        return store.items(custom_bucket(db_name))
     if db_name not in custom_db_caches:
         db_file = get_custom_db_path(db_name)
         lock = get_custom_db_lock(db_name)
         if os.path.exists(db_file):
-            with lock, open(db_file, "r", encoding="utf-8") as f:
+            with lock, open(db_file, "rb") as f:
                 try:
-                    custom_db_caches[db_name] = json.load(f)
+                    custom_db_caches[db_name] = jsoncodec.loads(f.read())
                 except json.JSONDecodeError:
                     logger.warning(f"カスタムDB {db_name} のJSONが破損しています。空のDBとして初期化します。")
                     custom_db_caches[db_name] = {}
@@ -289,11 +1173,12 @@ def load_custom_db_cache(db_name):
 def save_custom_db_cache(db_name):
     """カスタムデータベースのキャッシュを保存"""
     global custom_db_caches
-    if db_name in custom_db_caches:
+    if custom_db_caches.get(db_name) is not None:
         db_file = get_custom_db_path(db_name)
         lock = get_custom_db_lock(db_name)
-        with lock, open(db_file, "w", encoding="utf-8") as f:
-            json.dump(custom_db_caches[db_name], f, ensure_ascii=False, indent=2)
+        with lock:
+            payload = jsoncodec.dumps(custom_db_caches[db_name])
+            atomic_write_bytes(db_file, payload)
 
 def _load_custom_db(db_name):
     """カスタムデータベースを読み込み"""
@@ -302,6 +1187,10 @@ def _load_custom_db(db_name):
 def _save_custom_db(db_name, data):
     """カスタムデータベースを保存"""
     global custom_db_caches
+    store = _custom_store(db_name)
+    if store is not None:
+        store.replace_bucket(custom_bucket(db_name), data)
+        return
     custom_db_caches[db_name] = data
     save_custom_db_cache(db_name)
 
@@ -309,6 +1198,9 @@ def _save_custom_db(db_name, data):
 
 def get_custom_data(db_name, key=None):
     """カスタムデータベースからデータを取得"""
+    store = _custom_store(db_name)
+    if store is not None and key is not None:
+        return store.get(custom_bucket(db_name), str(key), {})
     db = _load_custom_db(db_name)
     if key is None:
         return db
@@ -316,12 +1208,26 @@ def get_custom_data(db_name, key=None):
 
 def set_custom_data(db_name, key, value):
     """カスタムデータベースにデータを保存"""
+    store = _custom_store(db_name)
+    if store is not None:
+        store.put(custom_bucket(db_name), str(key), value)
+        return
     db = _load_custom_db(db_name)
     db[str(key)] = value
     _save_custom_db(db_name, db)
 
 def update_custom_data(db_name, key, sub_key, value):
     """カスタムデータベースの特定のキーの中のサブキーを更新"""
+    store = _custom_store(db_name)
+    if store is not None:
+        bucket = custom_bucket(db_name)
+        with store.transaction():
+            data = store.get(bucket, str(key))
+            if not isinstance(data, dict):
+                data = {}
+            data[sub_key] = value
+            store.put(bucket, str(key), data)
+        return
     db = _load_custom_db(db_name)
     data = db.setdefault(str(key), {})
     data[sub_key] = value
@@ -336,6 +1242,10 @@ def get_custom_value(db_name, key, sub_key=None, default=None):
 
 def delete_custom_data(db_name, key):
     """カスタムデータベースから特定のキーのデータを削除"""
+    store = _custom_store(db_name)
+    if store is not None:
+        store.delete(custom_bucket(db_name), str(key))
+        return
     db = _load_custom_db(db_name)
     if str(key) in db:
         del db[str(key)]
@@ -343,11 +1253,17 @@ def delete_custom_data(db_name, key):
 
 def get_all_custom_keys(db_name):
     """カスタムデータベースの全てのキーを取得"""
+    store = _custom_store(db_name)
+    if store is not None:
+        return store.keys(custom_bucket(db_name))
     db = _load_custom_db(db_name)
     return list(db.keys())
 
 def has_custom_data(db_name, key):
     """カスタムデータベースに指定のキーが存在するかチェック"""
+    store = _custom_store(db_name)
+    if store is not None:
+        return store.has(custom_bucket(db_name), str(key))
     db = _load_custom_db(db_name)
     return str(key) in db
 
@@ -359,6 +1275,10 @@ def delete_custom_db(db_name):
     """カスタムデータベースファイルを削除"""
     global custom_db_caches, custom_db_locks
     
+    store = _get_sqlite_store()
+    if store is not None:
+        store.delete_bucket(custom_bucket(db_name))
+    
     # キャッシュから削除
     if db_name in custom_db_caches:
         del custom_db_caches[db_name]
@@ -379,6 +1299,11 @@ def list_custom_databases():
         if file.endswith('.json') and file != 'database.json' and file != 'database.json.bak':
             db_name = file[:-5]  # .jsonを除去
             databases.append(db_name)
+    store = _get_sqlite_store()
+    if store is not None:
+        for bucket in store.buckets():
+            if bucket.startswith(CUSTOM_BUCKET_PREFIX) and bucket[len(CUSTOM_BUCKET_PREFIX):] not in databases:
+                databases.append(bucket[len(CUSTOM_BUCKET_PREFIX):])
     return databases
 
 
@@ -386,23 +1311,25 @@ def list_custom_databases():
 # === カスタムデータベースのバックアップ機能 ===
 
 def backup_custom_db(db_name):
-    """カスタムデータベースのバックアップを作成"""
+    """カスタムデータベースのバックアップを作成（世代ローテーション）"""
     db_file = get_custom_db_path(db_name)
-    backup_file = f"{db_file}.bak"
     
     if os.path.exists(db_file):
-        import shutil
-        shutil.copy2(db_file, backup_file)
-        logger.info(f"カスタムDB {db_name} のバックアップを作成しました: {backup_file}")
+        generations = _get_env_int("DB_BACKUP_GENERATIONS", DEFAULT_DB_BACKUP_GENERATIONS)
+        with get_custom_db_lock(db_name):
+            rotate_backups(db_file, max(1, generations))
+        logger.info(f"カスタムDB {db_name} のバックアップを作成しました: {db_file}.bak.1")
 
 def restore_custom_db_from_backup(db_name):
-    """カスタムデータベースをバックアップから復元"""
+    """カスタムデータベースを最新世代のバックアップから復元"""
     db_file = get_custom_db_path(db_name)
-    backup_file = f"{db_file}.bak"
+    backups = list_backups(db_file)
+    # 旧形式（単一の.bak）にも対応
+    backup_file = backups[0] if backups else f"{db_file}.bak"
     
     if os.path.exists(backup_file):
-        import shutil
-        shutil.copy2(backup_file, db_file)
+        with open(backup_file, "rb") as f:
+            atomic_write_bytes(db_file, f.read())
         
         # キャッシュを再読み込み
         global custom_db_caches
@@ -420,12 +1347,13 @@ def restore_custom_db_from_backup(db_name):
 
 def get_custom_db_stats(db_name):
     """カスタムデータベースの統計情報を取得"""
-    db = _load_custom_db(db_name)
+    store = _custom_store(db_name)
+    keys_count = store.count(custom_bucket(db_name)) if store is not None else len(_load_custom_db(db_name))
     db_file = get_custom_db_path(db_name)
     
     stats = {
         "name": db_name,
-        "keys_count": len(db),
+        "keys_count": keys_count,
         "file_exists": os.path.exists(db_file),
         "file_size": 0,
         "last_modified": None
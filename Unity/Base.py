@@ -7,24 +7,276 @@ Unityの型・基盤・登録関数群 (Base)
 """
 import threading
 import asyncio
+import inspect
+from collections import deque
 from typing import Callable, Dict, Any, List, Optional, Type
 import time
 
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
 # --- 型定義 ---
+class _Shard:
+    """非同期購読のワーカー1つ分のキュー"""
+    __slots__ = ("items", "ready", "pending", "waiters", "reserved")
+    def __init__(self):
+        self.items = deque()       # [args, kwargs, 投入時刻, coalesceのキー]（古い順）
+        self.ready = asyncio.Event()
+        self.pending: Dict[Any, list] = {}  # coalesceのキー -> 待機中のイベント
+        self.waiters = deque()     # 空きを待っているpublish（待ち始めた順）のFuture
+        self.reserved = 0          # 空きを譲られたが、まだ投入していないpublishの数
+
+class AsyncSubscription:
+    """
+    非同期の購読者。イベントをワーカー毎の上限つきキューに入れ、workers個のワーカーで実行する
+    - key(*args, **kwargs) が同じイベントは同じワーカーで順番に実行する（キーが違えば並列に実行される）
+    - coalesce(*args, **kwargs) が同じイベントが待機中なら、後から来た内容で置き換える
+    - キューが満杯の場合: drop_oldest=最も古いものを捨てる / drop_newest=新しいものを捨てる /
+      block=publishで空きを待つ（同期のfireからは待てないのでdrop_newestと同じ）
+      空きは待ち始めた順に譲る（後から来たpublishが先に入らないので、同じキーのイベントの順序が保たれる）
+    """
+    def __init__(self, callback: Callable, workers: int = 1, max_queue: int = 1000,
+                 key: Optional[Callable] = None, coalesce: Optional[Callable] = None,
+                 overflow: str = "drop_oldest", name: Optional[str] = None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}: {overflow}")
+        self.callback = callback
+        self.workers = max(1, workers)
+        self.capacity = max(1, -(-max_queue // self.workers))  # ワーカー毎の上限
+        self.key = key
+        self.coalesce = coalesce
+        self.overflow = overflow
+        self.name = name or getattr(callback, "__qualname__", repr(callback))
+        self._shards = [_Shard() for _ in range(self.workers)]
+        self._tasks: Dict[int, asyncio.Task] = {}  # ワーカーの番号 -> タスク
+        self._next = 0
+        self._closed = False
+        self.stats = {"published": 0, "processed": 0, "failed": 0, "dropped": 0, "coalesced": 0,
+                      "blocked": 0, "max_depth": 0, "lag_total_ms": 0.0, "lag_max_ms": 0.0, "last_lag_ms": 0.0}
+
+    def _shard(self, args, kwargs) -> _Shard:
+        if self.key is not None:
+            return self._shards[hash(self.key(*args, **kwargs)) % self.workers]
+        # キーなしは順番に振り分ける
+        self._next = (self._next + 1) % self.workers
+        return self._shards[self._next]
+
+    def _ensure_workers(self) -> bool:
+        """ワーカーを起動する（止まっているものは起動し直す）。イベントループ外ならFalse"""
+        if len(self._tasks) == self.workers and not any(task.done() for task in self._tasks.values()):
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        for index, shard in enumerate(self._shards):
+            task = self._tasks.get(index)
+            if task is None or task.done():
+                self._tasks[index] = loop.create_task(self._worker(shard))
+        return True
+
+    def _enqueue(self, shard: _Shard, args, kwargs, ckey):
+        item = [args, kwargs, time.perf_counter(), ckey]
+        shard.items.append(item)
+        if ckey is not None:
+            shard.pending[ckey] = item
+        shard.ready.set()
+        depth = len(shard.items)
+        if depth > self.stats["max_depth"]:
+            self.stats["max_depth"] = depth
+
+    def _try_coalesce(self, shard: _Shard, args, kwargs):
+        """coalesceのキーが同じイベントが待機中なら置き換える。(置き換えたか, キー)"""
+        if self.coalesce is None:
+            return False, None
+        ckey = self.coalesce(*args, **kwargs)
+        item = shard.pending.get(ckey)
+        if item is None:
+            return False, ckey
+        item[0], item[1] = args, kwargs
+        self.stats["coalesced"] += 1
+        return True, ckey
+
+    def _new_coalesce_key(self, shard: _Shard, ckey, args, kwargs):
+        """置き換えずに投入するイベントのcoalesceのキー（同じキーのイベントが既に待機中ならNone）"""
+        if self.coalesce is None:
+            return None
+        if ckey is None:
+            ckey = self.coalesce(*args, **kwargs)
+        return None if ckey in shard.pending else ckey
+
+    def _has_room(self, shard: _Shard) -> bool:
+        """今すぐ投入できるか（空きを待っているpublishがいれば、そちらが先）"""
+        return not shard.waiters and len(shard.items) + shard.reserved < self.capacity
+
+    def _release(self, shard: _Shard):
+        """空きが1つできたとき、最も長く待っているpublishに譲る"""
+        while shard.waiters:
+            waiter = shard.waiters.popleft()
+            if not waiter.done():
+                shard.reserved += 1
+                waiter.set_result(None)
+                return
+
+    def _drop_oldest(self, shard: _Shard):
+        item = shard.items.popleft()
+        if item[3] is not None and shard.pending.get(item[3]) is item:
+            del shard.pending[item[3]]
+        self.stats["dropped"] += 1
+
+    def offer(self, *args, **kwargs) -> bool:
+        """イベントを待たずに投入する（満杯時はoverflowに従う）。投入・置き換えできればTrue"""
+        self.stats["published"] += 1
+        if self._closed:
+            self.stats["dropped"] += 1
+            return False
+        if not self._ensure_workers():
+            self.stats["dropped"] += 1
+            print(f"[Unity] {self.name}: イベントループ外のイベントを破棄しました")
+            return False
+        shard = self._shard(args, kwargs)
+        coalesced, ckey = self._try_coalesce(shard, args, kwargs) if not shard.waiters else (False, None)
+        if coalesced:
+            return True
+        ckey = self._new_coalesce_key(shard, ckey, args, kwargs)
+        if not self._has_room(shard):
+            if self.overflow != "drop_oldest":
+                self.stats["dropped"] += 1
+                return False
+            self._drop_oldest(shard)
+        self._enqueue(shard, args, kwargs, ckey)
+        return True
+
+    async def publish(self, *args, **kwargs) -> bool:
+        """イベントを投入する。overflow="block"ならキューに空きが出るまで待つ"""
+        if self.overflow != "block":
+            return self.offer(*args, **kwargs)
+        self.stats["published"] += 1
+        if self._closed:
+            self.stats["dropped"] += 1
+            return False
+        self._ensure_workers()
+        shard = self._shard(args, kwargs)
+        # 待っているpublishがいる間は、置き換えで順番を追い越さない
+        coalesced, ckey = self._try_coalesce(shard, args, kwargs) if not shard.waiters else (False, None)
+        if coalesced:
+            return True
+        if not self._has_room(shard):
+            self.stats["blocked"] += 1
+            waiter = asyncio.get_running_loop().create_future()
+            shard.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 譲られた空きは次に待っているpublishに回す
+                    shard.reserved -= 1
+                    self._release(shard)
+                elif waiter in shard.waiters:
+                    shard.waiters.remove(waiter)
+                raise
+            shard.reserved -= 1
+            if self._closed:
+                self.stats["dropped"] += 1
+                return False
+        self._enqueue(shard, args, kwargs, self._new_coalesce_key(shard, ckey, args, kwargs))
+        return True
+
+    async def _worker(self, shard: _Shard):
+        while True:
+            while not shard.items:
+                shard.ready.clear()
+                await shard.ready.wait()
+            args, kwargs, enqueued_at, ckey = item = shard.items.popleft()
+            if ckey is not None and shard.pending.get(ckey) is item:
+                del shard.pending[ckey]
+            self._release(shard)
+            lag = (time.perf_counter() - enqueued_at) * 1000
+            self.stats["lag_total_ms"] += lag
+            self.stats["last_lag_ms"] = lag
+            if lag > self.stats["lag_max_ms"]:
+                self.stats["lag_max_ms"] = lag
+            try:
+                result = self.callback(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[Unity] {self.name}: イベント処理中にエラー: {e}")
+
+    def close(self):
+        """ワーカーを止める（待機中のイベントは破棄する）"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+        self._closed = True
+        for shard in self._shards:
+            self.stats["dropped"] += len(shard.items)
+            shard.items.clear()
+            shard.pending.clear()
+            # 空きを待っているpublishは起こして破棄させる
+            while shard.waiters:
+                waiter = shard.waiters.popleft()
+                if not waiter.done():
+                    shard.reserved += 1
+                    waiter.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        done = self.stats["processed"] + self.stats["failed"]
+        depths = [len(shard.items) for shard in self._shards]
+        return {
+            "published": self.stats["published"],
+            "processed": self.stats["processed"],
+            "failed": self.stats["failed"],
+            "dropped": self.stats["dropped"],
+            "coalesced": self.stats["coalesced"],
+            "blocked": self.stats["blocked"],
+            "depth": sum(depths),
+            "max_shard_depth": max(depths),
+            "max_depth": self.stats["max_depth"],
+            "capacity": self.capacity * self.workers,
+            "workers": self.workers,
+            "avg_lag_ms": round(self.stats["lag_total_ms"] / done, 3) if done else 0.0,
+            "max_lag_ms": round(self.stats["lag_max_ms"], 3),
+            "last_lag_ms": round(self.stats["last_lag_ms"], 3),
+        }
+
 class EventType:
     def __init__(self, name: str):
         self.name = name
         self._subscribers: List[Callable] = []
+        self._async_subscribers: List[AsyncSubscription] = []
     def subscribe(self, callback: Callable):
         if callback not in self._subscribers:
             self._subscribers.append(callback)
         return callback
+    def subscribe_async(self, callback: Callable, **options) -> AsyncSubscription:
+        """非同期の購読者を登録する（optionsはAsyncSubscriptionの引数）"""
+        for sub in self._async_subscribers:
+            if sub.callback == callback:
+                return sub
+        sub = AsyncSubscription(callback, name=f"{self.name}:{getattr(callback, '__qualname__', callback)}", **options)
+        self._async_subscribers.append(sub)
+        return sub
     def unsubscribe(self, callback: Callable):
         if callback in self._subscribers:
             self._subscribers.remove(callback)
+        for sub in [sub for sub in self._async_subscribers if sub.callback == callback]:
+            sub.close()
+            self._async_subscribers.remove(sub)
     def fire(self, *args, **kwargs):
         for cb in self._subscribers:
             cb(*args, **kwargs)
+        for sub in self._async_subscribers:
+            sub.offer(*args, **kwargs)
+    async def publish(self, *args, **kwargs):
+        """fireと同じだが、overflow="block"の購読者のキューが満杯なら空きを待つ"""
+        for cb in self._subscribers:
+            cb(*args, **kwargs)
+        for sub in self._async_subscribers:
+            await sub.publish(*args, **kwargs)
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {sub.name: sub.get_stats() for sub in self._async_subscribers}
 
 class afterEvent:
     EventType = EventType
@@ -41,8 +293,18 @@ class afterEvent:
     def unsubscribe(cls, name: str, callback: Callable):
         return cls.get_event(name).unsubscribe(callback)
     @classmethod
+    def subscribe_async(cls, name: str, callback: Callable, **options) -> AsyncSubscription:
+        return cls.get_event(name).subscribe_async(callback, **options)
+    @classmethod
     def fire(cls, name: str, *args, **kwargs):
         return cls.get_event(name).fire(*args, **kwargs)
+    @classmethod
+    async def publish(cls, name: str, *args, **kwargs):
+        return await cls.get_event(name).publish(*args, **kwargs)
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """イベント毎・非同期購読者毎のキューの深さ・遅延・破棄数"""
+        return {name: event.get_stats() for name, event in cls._events.items() if event._async_subscribers}
 
 import threading
 import asyncio
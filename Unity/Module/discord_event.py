@@ -8,5 +8,9 @@ def relay_discord_event(event_name, *args, **kwargs):
     """DiscordイベントをUnity afterEventに転送"""
     unity_registry.events.fire(event_name, *args, **kwargs)
 
+async def relay_discord_event_async(event_name, *args, **kwargs):
+    """DiscordイベントをUnity afterEventに転送（overflow="block"の購読者のキューが満杯なら空きを待つ）"""
+    await unity_registry.events.publish(event_name, *args, **kwargs)
+
 # 例: Bot側で on_message などのイベント時に relay_discord_event("message", message) を呼ぶことで
 # Module側で afterEvent.subscribe("message", ...) で購読できる
@@ -0,0 +1,201 @@
+"""
+aiodb.py - DataBase.py の非同期ファサード
+
+async関数からDataBase.pyの同期関数を直接呼ぶと、シリアライズやディスク書き込みの間イベントループが止まる。
+このモジュールでは
+- 読み込みはメモリ上のキャッシュから直接返す（SQLiteバックエンドのみ書き込みスレッドで読む）
+- 書き込み・フラッシュは専用の書き込みスレッド1本に投げ、完了をawaitで待つ（投入順に実行される）
+- キューには上限があり、満杯の場合はイベントループを止めずに空きを待つ（バックプレッシャー）
+
+使い方:
+    import aiodb
+    value = await aiodb.get(("guild", guild_id, "AntiCheat"), {})
+    await aiodb.patch(("guild", guild_id, "AntiCheat", "enabled"), True)
+    await aiodb.run(some_sync_function, arg)   # 任意の同期処理を書き込みスレッドで実行
+"""
+
+import os
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import threading
+
+import DataBase
+
+logger = logging.getLogger("aiodb")
+
+DEFAULT_AIODB_QUEUE_SIZE = 1024
+
+_queue = None
+_writer_thread = None
+_start_lock = threading.Lock()
+_stats = {
+    "enqueued": 0,             # 投入された処理の数
+    "completed": 0,            # 実行が終わった処理の数
+    "failed": 0,               # 例外で終わった処理の数
+    "max_depth": 0,            # キューの最大滞留数
+    "backpressure_waits": 0,   # キューが満杯で待たされた回数
+    "backpressure_ms": 0.0,    # キューの空き待ちに費やした合計時間
+    "last_queue_ms": 0.0,      # 直近の処理がキューで待った時間
+    "last_run_ms": 0.0,        # 直近の処理の実行時間
+}
+
+
+def _ensure_writer():
+    """書き込みスレッドを起動する（初回のみ）"""
+    global _queue, _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _start_lock:
+        if _writer_thread is not None and _writer_thread.is_alive():
+            return
+        if _queue is None:
+            try:
+                size = int(os.environ.get("AIODB_QUEUE_SIZE", DEFAULT_AIODB_QUEUE_SIZE))
+            except ValueError:
+                size = DEFAULT_AIODB_QUEUE_SIZE
+            _queue = queue.Queue(maxsize=max(1, size))
+        _writer_thread = threading.Thread(target=_writer_loop, daemon=True, name="aiodb-writer")
+        _writer_thread.start()
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _writer_loop():
+    while True:
+        item = _queue.get()
+        if item is None:
+            _queue.task_done()
+            return
+        func, args, kwargs, future, loop, enqueued_at = item
+        started = time.perf_counter()
+        result, error = None, None
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            _stats["failed"] += 1
+            if future is None:
+                logger.error(f"{getattr(func, '__name__', func)} の実行に失敗しました: {e}")
+        _stats["completed"] += 1
+        _stats["last_queue_ms"] = round((started - enqueued_at) * 1000, 2)
+        _stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if future is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+        _queue.task_done()
+
+
+async def _enqueue(func, args, kwargs, wait):
+    _ensure_writer()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future() if wait else None
+    item = (func, args, kwargs, future, loop, time.perf_counter())
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        # キューが満杯なら、空きが出るまで別スレッドで待つ（イベントループは止めない）
+        started = time.perf_counter()
+        _stats["backpressure_waits"] += 1
+        await loop.run_in_executor(None, _queue.put, item)
+        _stats["backpressure_ms"] = round(_stats["backpressure_ms"] + (time.perf_counter() - started) * 1000, 2)
+    _stats["enqueued"] += 1
+    _stats["max_depth"] = max(_stats["max_depth"], _queue.qsize())
+    if future is None:
+        return None
+    return await future
+
+
+async def run(func, *args, **kwargs):
+    """同期関数を書き込みスレッドで実行し、結果を返す"""
+    return await _enqueue(func, args, kwargs, wait=True)
+
+
+async def submit(func, *args, **kwargs):
+    """同期関数を書き込みスレッドに投入する（完了は待たない。キューが満杯の場合のみ空きを待つ）"""
+    await _enqueue(func, args, kwargs, wait=False)
+
+
+# === 読み込み ===
+
+async def get(path, default=None):
+    """指定位置の値を取得（パスの形式はDataBase.get_pathと同じ）"""
+    if DataBase._db_backend() == "sqlite":
+        # SQLiteはディスクから読むため書き込みスレッドで実行する（投入済みの書き込みの後に読むので順序も保たれる）
+        return await run(DataBase.get_path, path, default)
+    return DataBase.get_path(path, default)
+
+
+async def get_guild_value(guild_id, key, default=None):
+    return await get(("guild", guild_id, key), default)
+
+
+async def get_user_value(user_id, key, default=None):
+    return await get(("user", user_id, key), default)
+
+
+# === 書き込み ===
+
+async def patch(path, value):
+    await run(DataBase.patch, path, value)
+
+
+async def remove_path(path):
+    return await run(DataBase.remove_path, path)
+
+
+async def increment(path, amount=1, minimum=None, maximum=None):
+    return await run(DataBase.increment, path, amount, minimum, maximum)
+
+
+async def append_to_list(path, value, max_length=None, unique=False):
+    return await run(DataBase.append_to_list, path, value, max_length, unique)
+
+
+async def remove_from_list(path, value):
+    return await run(DataBase.remove_from_list, path, value)
+
+
+async def update_guild_data(guild_id, key, value):
+    await patch(("guild", guild_id, key), value)
+
+
+async def flush(checkpoint=False):
+    """保留中の変更を書き出す（DataBase.flush_db）"""
+    return await run(DataBase.flush_db, checkpoint)
+
+
+# === 監視・終了処理 ===
+
+def get_stats():
+    """書き込みキューの統計（監視用）"""
+    stats = dict(_stats)
+    stats["depth"] = _queue.qsize() if _queue is not None else 0
+    stats["capacity"] = _queue.maxsize if _queue is not None else 0
+    stats["running"] = _writer_thread is not None and _writer_thread.is_alive()
+    return stats
+
+
+def drain(timeout=10.0):
+    """キューに残っている処理がすべて終わるまで待つ（同期関数。終了・プッシュ前用）。完了したらTrue"""
+    if _queue is None or _writer_thread is None or not _writer_thread.is_alive():
+        return True
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks:
+        if time.monotonic() > deadline:
+            logger.warning(f"aiodbのキューに未処理の書き込みが残っています: {_queue.unfinished_tasks}件")
+            return False
+        time.sleep(0.01)
+    return True
+
+
+# DataBaseの終了時フラッシュより先に実行される（atexitは登録と逆順に呼ばれる）
+atexit.register(drain)
@@ -5,8 +5,9 @@ Flask APIのエンドポイントを管理するモジュール
 
 import os
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 import utils
+from lib import jsoncodec
 
 
 def register_api_routes(app: Flask, bot_instance=None):
@@ -57,9 +58,33 @@ def register_api_routes(app: Flask, bot_instance=None):
         if not check_api_key():
             return jsonify({'error': 'Forbidden'}), 403
         try:
-            from DataBase import load_db_cache
-            db = load_db_cache()
-            return jsonify({'success': True, 'data': db, 'timestamp': datetime.now().isoformat()})
+            from DataBase import get_db_snapshot
+            # 保存時にシリアライズ済みのスナップショットをそのまま埋め込む（DBのロックもリクエスト毎のシリアライズも不要）
+            version, data, created_at = get_db_snapshot()
+            etag = f'"db-{version}"'
+            if request.headers.get('If-None-Match') == etag:
+                return Response(status=304, headers={'ETag': etag})
+            payload = b''.join([
+                b'{"success":true,"version":', str(version).encode(),
+                b',"snapshot_at":', jsoncodec.dumps(datetime.fromtimestamp(created_at).isoformat(), compact=True),
+                b',"data":', data,
+                b',"timestamp":', jsoncodec.dumps(datetime.now().isoformat(), compact=True), b'}',
+            ])
+            return Response(payload, mimetype='application/json', headers={'ETag': etag})
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @app.route("/database/stats", methods=["GET"])
+    def api_database_stats():
+        """データベース書き込み統計を取得（監視用）"""
+        if not check_api_key():
+            return jsonify({'error': 'Forbidden'}), 403
+        try:
+            from DataBase import get_db_write_stats
+            import aiodb
+            stats = get_db_write_stats()
+            stats['aiodb'] = aiodb.get_stats()
+            return jsonify({'success': True, 'stats': stats, 'timestamp': datetime.now().isoformat()})
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -84,6 +109,7 @@ def register_api_routes(app: Flask, bot_instance=None):
     print("📋 Registered API endpoints:")
     api_routes = [
         ("/database", "GET", "データベース読み取り"),
+        ("/database/stats", "GET", "データベース書き込み統計"),
         ("/youtube/<video_id>", "GET", "YouTube埋め込み情報取得"),
         ("/consolelog", "GET", "サーバーコンソールログ取得")
     ]
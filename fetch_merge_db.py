@@ -1,9 +1,9 @@
 import os
 import requests
-import json
 import sys
 from dotenv import load_dotenv
 from typing import Dict, Any
+from lib import jsoncodec
 
 
 def deep_merge_remote_priority(local: Dict[Any, Any], remote: Dict[Any, Any]) -> Dict[Any, Any]:
@@ -113,8 +113,8 @@ def fetch_and_merge_json(url, local_path="database.json", dotenv_path=".env"):
         
         # レスポンスがJSONかチェック
         try:
-            response_data = resp.json()
-        except json.JSONDecodeError as e:
+            response_data = jsoncodec.loads(resp.content)
+        except jsoncodec.JSONDecodeError as e:
             print(f"[ERROR] Invalid JSON response: {e}")
             print(f"[ERROR] Response text: {resp.text[:500]}...")
             return False
@@ -146,8 +146,7 @@ def fetch_and_merge_json(url, local_path="database.json", dotenv_path=".env"):
     if os.path.exists(local_path):
         try:
             print(f"[INFO] Loading local data from {local_path}")
-            with open(local_path, "r", encoding="utf-8") as f:
-                local_data = json.load(f)
+            local_data = jsoncodec.load_file(local_path)
             
             if not validate_json_structure(local_data, "Local"):
                 print(f"[WARNING] Local data structure invalid, using empty dict")
@@ -155,7 +154,7 @@ def fetch_and_merge_json(url, local_path="database.json", dotenv_path=".env"):
             else:
                 print(f"[INFO] Local data loaded successfully: {len(local_data)} keys")
                 
-        except json.JSONDecodeError as e:
+        except jsoncodec.JSONDecodeError as e:
             print(f"[ERROR] Local JSON decode error: {e}")
             print(f"[WARNING] Using empty local data")
             local_data = {}
@@ -198,8 +197,8 @@ def fetch_and_merge_json(url, local_path="database.json", dotenv_path=".env"):
     # マージ結果を保存
     try:
         print(f"[INFO] Saving merged data to {local_path}")
-        with open(local_path, "w", encoding="utf-8") as f:
-            json.dump(merged_data, f, ensure_ascii=False, indent=2)
+        with open(local_path, "wb") as f:
+            f.write(jsoncodec.dumps(merged_data))
         
         print(f"[SUCCESS] Merged and saved to {local_path}")
         print(f"[SUCCESS] Backup available at: {backup_path}" if backup_path else "[INFO] No backup created")
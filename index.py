@@ -4,7 +4,7 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 # Unityイベント連携
-from Unity.Module.discord_event import relay_discord_event
+from Unity.Module.discord_event import relay_discord_event, relay_discord_event_async
 import os
 import sys
 import asyncio
@@ -23,7 +23,8 @@ import base64
 import requests
 from waitress import serve
 
-from DataBase import start_api_key_cleanup_loop
+from DataBase import start_api_key_cleanup_loop, start_db_flusher, flush_db
+import aiodb
 import utils
 
 
@@ -475,6 +476,9 @@ def main():
     config = load_config()
     ensure_eula_agreed(config)
 
+    # DB書き込みをwrite-behind化（DB_FLUSH_INTERVAL秒ごとにまとめて保存）
+    start_db_flusher()
+
     # 2. Flaskサーバー起動
     start_flask_server()
 
@@ -523,6 +527,14 @@ def start_auto_stop_timer():
             run_push()
         except Exception as e:
             print(f"[ERROR] autoStop時のrun_push失敗: {e}")
+        # os._exitではatexitが呼ばれないため、保留中のDB変更をここで書き出す
+        try:
+            # 先にキュー済みの（古いスナップショットの）書き込みを終わらせてから、台帳の最新の値を書き込む
+            aiodb.drain()
+            _flush_pending_plugin_writes()
+            flush_db(checkpoint=True)
+        except Exception as e:
+            print(f"[ERROR] autoStop時のDBフラッシュ失敗: {e}")
         print("[INFO] --autoStop: サーバーを終了します。")
         # sys.exit only exits the current thread; use os._exit to terminate the whole process
         try:
@@ -594,20 +606,20 @@ def start_discord_bot(handle_custom_command, config):
                     print(f"  - /{cmd.name}: {cmd.description}")
         except Exception as e:
             print(f"❌ スラッシュコマンド同期エラー: {e}")
-        relay_discord_event("ready")
+        await relay_discord_event_async("ready")
 
     @bot.event
     async def on_message(message):
         await handle_custom_command(message)
-        relay_discord_event("message", message)
+        await relay_discord_event_async("message", message)
 
     @bot.event
     async def on_member_join(member):
-        relay_discord_event("member_join", member)
+        await relay_discord_event_async("member_join", member)
 
     @bot.event
     async def on_member_remove(member):
-        relay_discord_event("member_remove", member)
+        await relay_discord_event_async("member_remove", member)
 
     asyncio.run(bot.start(token))
 
@@ -628,9 +640,25 @@ RUN_PUSH_ON_EXIT = False
 push_executed = False
 
 
+def _flush_pending_plugin_writes():
+    """プラグインがまとめて書き込むために保留している変更をDBへ書き出す（os._exit前用。atexitは呼ばれない）"""
+    # 読み込まれていなければ保留中の変更もない（ここで新たにimportしない）
+    flag_system = sys.modules.get("plugins.antiModule.flag_system")
+    if flag_system is not None:
+        flag_system.FlagSystem._flush_sync()
+
+
 def run_push():
     """GitHub APIを使用してdatabase.jsonをプッシュする"""
     global push_executed
+    # write-behind/ジャーナルで保留中の変更をdatabase.jsonへ反映してからプッシュする
+    try:
+        # 先にキュー済みの（古いスナップショットの）書き込みを終わらせてから、台帳の最新の値を書き込む
+        aiodb.drain()
+        _flush_pending_plugin_writes()
+        flush_db(checkpoint=True)
+    except Exception as e:
+        print(f"[ERROR] プッシュ前のDBフラッシュ失敗: {e}")
     if RUN_PUSH_ON_EXIT and not push_executed:
         push_executed = True
         try:
@@ -0,0 +1,111 @@
+"""
+fileio.py - ファイル書き込みユーティリティ
+
+- アトミック書き込み: 一時ファイルへ書き込み → fsync → renameで置き換え
+  書き込み途中でプロセスが落ちても、対象ファイルは「旧内容」か「新内容」のどちらかになる
+- 世代バックアップ: <path>.bak.1（最新）〜 <path>.bak.N（最古）をローテーション
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Any, List
+
+from lib import jsoncodec
+
+
+def backup_path(path: str, generation: int) -> str:
+    """世代番号に対応するバックアップファイルのパスを返す（1が最新）"""
+    return f"{path}.bak.{generation}"
+
+
+def list_backups(path: str) -> List[str]:
+    """存在するバックアップファイルを新しい順に返す"""
+    backups = []
+    generation = 1
+    while os.path.exists(backup_path(path, generation)):
+        backups.append(backup_path(path, generation))
+        generation += 1
+    return backups
+
+
+def rotate_backups(path: str, generations: int) -> None:
+    """
+    現在のファイルを.bak.1として保存し、既存のバックアップを1世代ずつずらす。
+    generationsを超えた最古の世代は削除される。
+    """
+    if generations <= 0 or not os.path.exists(path):
+        return
+    oldest = backup_path(path, generations)
+    if os.path.exists(oldest):
+        os.remove(oldest)
+    for generation in range(generations - 1, 0, -1):
+        src = backup_path(path, generation)
+        if os.path.exists(src):
+            os.replace(src, backup_path(path, generation + 1))
+    newest = backup_path(path, 1)
+    try:
+        # ハードリンクならコピー不要（直後のrenameで元ファイル名だけが新内容に切り替わる）
+        os.link(path, newest)
+    except OSError:
+        shutil.copy2(path, newest)
+
+
+def _fsync_directory(directory: str) -> None:
+    """rename結果をディスクに確定させる（POSIXのみ。Windowsではディレクトリをopenできない）"""
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: str, data: bytes, backups: int = 0, fsync: bool = True) -> None:
+    """
+    dataをpathへアトミックに書き込む。
+
+    Args:
+        path: 書き込み先ファイル
+        data: 書き込むバイト列
+        backups: 0より大きい場合、置き換え前にその世代数でバックアップをローテーションする
+        fsync: Trueならrename前にfsyncしてデータをディスクへ確定させる
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    # 一時ファイルは".json"で終わらない名前にする（カスタムDB一覧に混ざらないように）
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        if os.path.exists(path):
+            # mkstempは0600で作成されるため、既存ファイルのパーミッションを引き継ぐ
+            try:
+                shutil.copymode(path, tmp_path)
+            except OSError:
+                pass
+        if backups > 0:
+            rotate_backups(path, backups)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        _fsync_directory(directory)
+
+
+def atomic_write_json(path: str, data: Any, compact: bool = False, backups: int = 0) -> None:
+    """JSONとしてシリアライズしてからアトミックに書き込む（compact=Falseなら2スペースインデント）"""
+    payload = jsoncodec.dumps(data, compact=compact)
+    atomic_write_bytes(path, payload, backups=backups)
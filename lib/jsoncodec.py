@@ -0,0 +1,154 @@
+"""
+jsoncodec.py - JSONエンコード/デコードの共通窓口
+
+- orjson がインストールされていれば使用し、なければ標準のjsonモジュールにフォールバックする
+- 出力は常にUTF-8のバイト列（ensure_ascii=False相当）
+- compact=True でインデントなしの出力（ファイルサイズ・書き込み時間を削減）
+  compact=None の場合は環境変数 DB_JSON_COMPACT に従う
+
+ベンチマーク:
+    python -m lib.jsoncodec --guilds 1000 --users 5000
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+from typing import Any, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+# orjson.JSONDecodeError は json.JSONDecodeError のサブクラスなので、どちらのバックエンドでもこれで捕捉できる
+JSONDecodeError = json.JSONDecodeError
+
+
+def compact_default() -> bool:
+    """環境変数 DB_JSON_COMPACT が有効ならインデントなしで保存する"""
+    return os.environ.get("DB_JSON_COMPACT", "").lower() in ("1", "true", "yes")
+
+
+def _stdlib_dumps(obj: Any, compact: bool) -> bytes:
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def dumps(obj: Any, compact: Optional[bool] = None) -> bytes:
+    """objをJSONのバイト列にする"""
+    if compact is None:
+        compact = compact_default()
+    if orjson is not None:
+        # 標準のjsonと同様にint等のキーは文字列化する
+        option = orjson.OPT_NON_STR_KEYS
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # 64bitを超える整数など、orjsonが扱えない値は標準のjsonで処理する
+            pass
+    return _stdlib_dumps(obj, compact)
+
+
+def dumps_str(obj: Any, compact: Optional[bool] = None) -> str:
+    return dumps(obj, compact).decode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """JSONのバイト列/文字列をデコードする"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_file(path: str) -> Any:
+    """JSONファイルを読み込む"""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+# === ベンチマーク ===
+
+def make_synthetic_db(guilds: int, users: int, seed: int = 0) -> dict:
+    """database.jsonに近い構造のダミーデータを作る"""
+    rng = random.Random(seed)
+    db = {}
+    for g in range(guilds):
+        guild_id = str(10 ** 17 + g)
+        db[guild_id] = {
+            "AntiCheat": {
+                "enabled": True,
+                "detection_settings": {"text_spam": True, "image_spam": rng.random() < 0.5, "mention_spam": True},
+                "timeout_duration": rng.choice([60, 300, 600]),
+            },
+            "channels": {str(10 ** 17 + g * 10 + c): {"log": c == 0} for c in range(3)},
+            "user_flags": {
+                str(10 ** 17 + rng.randrange(users or 1)): [
+                    {"type": "text_spam", "timestamp": 1.7e9 + rng.random(), "flags_added": 1, "violations": []}
+                ] for _ in range(5)
+            },
+            "staffRole": str(10 ** 17 + g),
+            "youtube_channels": ["ユーザー名" * 2],
+        }
+    db["userData"] = {
+        str(10 ** 17 + u): {"GameData": {"coin": rng.randrange(10000)}, "name": f"ユーザー{u}"}
+        for u in range(users)
+    }
+    db["api_keys"] = {f"key{i:08x}": {"user_id": i, "expire": "2030-01-01T00:00:00"} for i in range(50)}
+    return db
+
+
+def _measure(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def benchmark(guilds: int, users: int, repeat: int = 5):
+    """各バックエンド・モードのエンコード/デコード時間（最良値, ms）とサイズを返す"""
+    db = make_synthetic_db(guilds, users)
+    candidates = [("json", False, lambda o: _stdlib_dumps(o, False), json.loads),
+                  ("json", True, lambda o: _stdlib_dumps(o, True), json.loads)]
+    if orjson is not None:
+        candidates.append(("orjson", False, lambda o: orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2), orjson.loads))
+        candidates.append(("orjson", True, lambda o: orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS), orjson.loads))
+    results = []
+    for name, compact, encode, decode in candidates:
+        payload = encode(db)
+        results.append({
+            "backend": name,
+            "compact": compact,
+            "encode_ms": round(_measure(lambda: encode(db), repeat), 2),
+            "decode_ms": round(_measure(lambda: decode(payload), repeat), 2),
+            "bytes": len(payload),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONコーデックのベンチマーク")
+    parser.add_argument("--guilds", type=int, default=1000, help="ギルド数")
+    parser.add_argument("--users", type=int, default=5000, help="ユーザー数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（最良値を表示）")
+    args = parser.parse_args()
+
+    print(f"[INFO] 使用中のバックエンド: {BACKEND}")
+    print(f"[INFO] {args.guilds}ギルド × {args.users}ユーザー（{args.repeat}回の最良値）")
+    print(f"{'backend':<8} {'mode':<8} {'encode(ms)':>11} {'decode(ms)':>11} {'bytes':>12}")
+    for r in benchmark(args.guilds, args.users, args.repeat):
+        mode = "compact" if r["compact"] else "indent2"
+        print(f"{r['backend']:<8} {mode:<8} {r['encode_ms']:>11} {r['decode_ms']:>11} {r['bytes']:>12,}")
+    if orjson is None:
+        print("[INFO] orjsonをインストールすると高速なエンコーダーが使用されます: pip install orjson")
+
+
+if __name__ == "__main__":
+    main()
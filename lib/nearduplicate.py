@@ -0,0 +1,129 @@
+"""
+nearduplicate.py - 時間窓付きの近似重複テキスト索引（MinHash + LSH）
+
+- テキストを文字n-gram（シングル）の集合にし、one permutation hashing で MinHash 署名を作る
+  （シングルごとにハッシュを1回計算するだけで署名が求まる）
+- 署名を帯（band）に分けて辞書に登録し、同じ帯を持つクラスタだけを候補として返す
+- 最後の追加から window 秒経過したクラスタは索引から取り除く
+
+候補は近似なので、呼び出し側で正確な類似度（difflib等）を確認してから使うこと。
+"""
+
+from collections import OrderedDict, deque
+from itertools import count
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+_MASK64 = (1 << 64) - 1
+# 空のビンを埋めるときに借りた値へ加える定数（64bit黄金比）
+_DENSIFY_STEP = 0x9E3779B97F4A7C15
+
+
+class Cluster:
+    """近似重複とみなしたテキストのまとまり"""
+    __slots__ = ("id", "text", "key_text", "bands", "entries", "last_seen")
+
+    def __init__(self, cluster_id: int, text: str, key_text: str, bands: Tuple, now: float):
+        self.id = cluster_id
+        self.text = text            # 最初に登録されたテキスト（代表）
+        self.key_text = key_text    # 署名の計算に使ったテキスト
+        self.bands = bands
+        self.entries = deque()      # 呼び出し側が自由に使う（時刻・ユーザーID等）
+        self.last_seen = now
+
+
+class NearDuplicateIndex:
+    def __init__(self, window: float, bands: int = 16, rows: int = 2, shingle: int = 3):
+        self.window = window
+        self.bands = bands
+        self.rows = rows
+        self.shingle = shingle
+        self._bins = bands * rows
+        self._clusters: "OrderedDict[int, Cluster]" = OrderedDict()  # 最後に使われた順
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = {}
+        self._ids = count()
+
+    def __len__(self):
+        return len(self._clusters)
+
+    # --- 署名 ---
+    def _shingles(self, text: str) -> Set[str]:
+        k = self.shingle
+        if len(text) <= k:
+            return {text}
+        return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+    def signature(self, text: str) -> Tuple[Tuple[int, ...], ...]:
+        """テキストのLSH帯（帯ごとのMinHash値のタプル）"""
+        n = self._bins
+        bins: List[Optional[int]] = [None] * n
+        for s in self._shingles(text):
+            h = hash(s) & _MASK64
+            i, v = h % n, h // n
+            if bins[i] is None or v < bins[i]:
+                bins[i] = v
+        # 空のビンは右隣（循環）の値を借りて埋める（densification）
+        filled = list(bins)
+        for i in range(n):
+            if filled[i] is None:
+                for j in range(1, n):
+                    v = bins[(i + j) % n]
+                    if v is not None:
+                        filled[i] = (v + j * _DENSIFY_STEP) & _MASK64
+                        break
+        r = self.rows
+        return tuple(tuple(filled[b * r:(b + 1) * r]) for b in range(self.bands))
+
+    # --- 索引 ---
+    def expire(self, now: float) -> int:
+        """window秒以上更新のないクラスタを取り除く。取り除いた数を返す"""
+        removed = 0
+        while self._clusters:
+            cluster = next(iter(self._clusters.values()))
+            if now - cluster.last_seen <= self.window:
+                break
+            self._remove(cluster)
+            removed += 1
+        return removed
+
+    def _remove(self, cluster: Cluster) -> None:
+        self._clusters.pop(cluster.id, None)
+        for b, band in enumerate(cluster.bands):
+            ids = self._buckets.get((b, band))
+            if ids is not None:
+                ids.discard(cluster.id)
+                if not ids:
+                    del self._buckets[(b, band)]
+
+    def candidates(self, bands: Tuple) -> List[Cluster]:
+        """帯が1つ以上一致するクラスタ（登録順）"""
+        ids = set()
+        for b, band in enumerate(bands):
+            ids.update(self._buckets.get((b, band), ()))
+        return [self._clusters[i] for i in sorted(ids)]
+
+    def find(self, key_text: str, now: float, verify: Callable[[Cluster], bool]) -> Tuple[Optional[Cluster], Tuple]:
+        """
+        key_textの近似重複クラスタを探す。verifyがTrueを返した最初の候補を返す
+        戻り値の署名は、見つからなかった場合にadd()へそのまま渡せる
+        """
+        self.expire(now)
+        bands = self.signature(key_text)
+        for cluster in self.candidates(bands):
+            if verify(cluster):
+                return cluster, bands
+        return None, bands
+
+    def add(self, text: str, key_text: str, now: float, bands: Optional[Tuple] = None) -> Cluster:
+        """新しいクラスタを登録する"""
+        if bands is None:
+            bands = self.signature(key_text)
+        cluster = Cluster(next(self._ids), text, key_text, bands, now)
+        self._clusters[cluster.id] = cluster
+        for b, band in enumerate(bands):
+            self._buckets.setdefault((b, band), set()).add(cluster.id)
+        return cluster
+
+    def touch(self, cluster: Cluster, now: float) -> None:
+        """クラスタの最終更新時刻を進める"""
+        cluster.last_seen = now
+        self._clusters.move_to_end(cluster.id)
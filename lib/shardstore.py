@@ -0,0 +1,168 @@
+"""
+shardstore.py - シャード分割したJSONファイルストア
+
+- database.jsonのトップレベルキー（ギルドID・userData・api_keys等）ごとに1ファイル（シャード）へ分割して保存する
+- シャードは最初にアクセスされた時点で読み込み、メモリ予算（バイト）を超えたら最も長く使われていないものから追い出す
+- 変更されたシャード（dirty）だけを書き戻す。追い出し対象がdirtyの場合は書き戻してから追い出す
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+from typing import Any, Dict, List
+
+from lib import jsoncodec
+from lib.fileio import atomic_write_bytes
+
+SHARD_SUFFIX = ".json"
+
+
+def _encode(value: Any) -> bytes:
+    return jsoncodec.dumps(value, compact=True)
+
+
+class ShardStore:
+    """
+    シャード名 → JSON値 のストア。
+    get()はキャッシュ上のオブジェクトそのものを返すため、呼び出し側で変更した場合はmark_dirty()かwrite()を呼ぶこと。
+    """
+
+    def __init__(self, directory: str, cache_bytes: int):
+        self.directory = directory
+        self.cache_bytes = cache_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # {シャード名: 値}（末尾が最近使用）
+        self._sizes = {}             # {シャード名: 最後に読み書きした時点のバイト数}
+        self._cached_bytes = 0
+        self._dirty = set()
+        self._index = set(self._scan())
+        self.stats = {"loads": 0, "hits": 0, "evictions": 0, "writes": 0, "deletes": 0}
+
+    # --- ファイル ---
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, quote(name, safe="") + SHARD_SUFFIX)
+
+    def _scan(self) -> List[str]:
+        return [unquote(file[:-len(SHARD_SUFFIX)]) for file in os.listdir(self.directory)
+                if file.endswith(SHARD_SUFFIX) and not file.startswith(".")]
+
+    def _read(self, name: str) -> Any:
+        with open(self._path(name), "rb") as f:
+            content = f.read()
+        return jsoncodec.loads(content), len(content)
+
+    # --- LRUキャッシュ ---
+    def _remember(self, name: str, value: Any, size: int) -> None:
+        self._cached_bytes += size - self._sizes.get(name, 0)
+        self._cache[name] = value
+        self._cache.move_to_end(name)
+        self._sizes[name] = size
+        self._evict()
+
+    def _forget(self, name: str) -> None:
+        self._cache.pop(name, None)
+        self._cached_bytes -= self._sizes.pop(name, 0)
+
+    def _evict(self) -> None:
+        """予算を超えている間、古いシャードから追い出す（最新の1件は残す）"""
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            name = next(iter(self._cache))
+            if name in self._dirty:
+                self._write(name)
+            self._forget(name)
+            self.stats["evictions"] += 1
+
+    # --- 読み込み ---
+    def get(self, name: str, default: Any = None) -> Any:
+        with self._lock:
+            if name in self._cache:
+                self._cache.move_to_end(name)
+                self.stats["hits"] += 1
+                return self._cache[name]
+            if name not in self._index:
+                return default
+            value, size = self._read(name)
+            self.stats["loads"] += 1
+            self._remember(name, value, size)
+            return value
+
+    def names(self) -> List[str]:
+        """存在するシャード名の一覧（ファイルを読み込まずに索引から返す）"""
+        with self._lock:
+            return list(self._index)
+
+    def has(self, name: str) -> bool:
+        with self._lock:
+            return name in self._index
+
+    def read_all(self) -> Dict[str, Any]:
+        """全シャードを辞書にまとめる。キャッシュにないシャードはLRUに載せずに直接読む"""
+        with self._lock:
+            result = {}
+            for name in self._index:
+                result[name] = self._cache[name] if name in self._cache else self._read(name)[0]
+            return result
+
+    # --- 書き込み ---
+    def put(self, name: str, value: Any, write: bool = True) -> None:
+        """シャードの値を置き換える。write=Falseならdirtyにするだけ"""
+        with self._lock:
+            self._index.add(name)
+            self._remember(name, value, self._sizes.get(name, 0))
+            self._dirty.add(name)
+            if write:
+                self._write(name)
+
+    def mark_dirty(self, name: str) -> None:
+        with self._lock:
+            if name in self._cache:
+                self._dirty.add(name)
+
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            if name not in self._index:
+                return False
+            self._index.discard(name)
+            self._dirty.discard(name)
+            self._forget(name)
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            self.stats["deletes"] += 1
+            return True
+
+    def _write(self, name: str) -> None:
+        payload = _encode(self._cache[name])
+        atomic_write_bytes(self._path(name), payload)
+        self._dirty.discard(name)
+        self._cached_bytes += len(payload) - self._sizes.get(name, 0)
+        self._sizes[name] = len(payload)
+        self.stats["writes"] += 1
+
+    def write(self, name: str) -> None:
+        """キャッシュ上のシャードを書き戻す"""
+        with self._lock:
+            if name in self._cache:
+                self._write(name)
+            self._evict()
+
+    def flush(self) -> int:
+        """dirtyなシャードをすべて書き戻す。書き込んだシャード数を返す"""
+        with self._lock:
+            names = list(self._dirty)
+            for name in names:
+                self._write(name)
+            self._evict()
+            return len(names)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._dirty)
+
+    def cache_info(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, cached=len(self._cache), cached_bytes=self._cached_bytes,
+                        budget=self.cache_bytes, shards=len(self._index), dirty=len(self._dirty))
@@ -0,0 +1,225 @@
+"""
+similarity.py - 文字列類似度の計算
+
+- ratio() は difflib.SequenceMatcher(None, a, b).ratio() と同じ値を返す（検知の閾値はこの値で調整されている）
+- score_cutoff を指定すると、長さ比・文字ヒストグラムによる上限値（difflibのreal_quick_ratio/quick_ratio）で
+  先に足切りし、届かない組は ratio() を計算せずに 0.0 を返す
+- 上限値を通った組も、一致ブロックを探す途中で「見つかった一致 + 未探索の区間で一致しうる最大数」が
+  score_cutoffに届かなくなった時点で打ち切る（探索する区間はdifflibと同じなので、届く組の値は変わらない）
+- 一致ブロックの探索は、autojunkで索引から除かれた頻出文字の位置を飛ばして行う（結果はdifflibと同じ）
+- 同じ b と繰り返し比較する場合（直近のメッセージ同士の比較など）は、b の索引を作ったSequenceMatcherを使い回す
+- 計算量のオーダーはdifflibと同じで、score_cutoff以上になる組（ほぼ同じ長文の貼り付けなど）は打ち切れない
+
+ベンチマーク:
+    python -m lib.similarity --length 2000 --pairs 200
+"""
+
+import time
+import random
+import string
+import difflib
+import argparse
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+# 文字ヒストグラムによる足切りを行う最小の合計文字数（短い文字列はratio()を直接計算した方が速い）
+_HISTOGRAM_MIN_TOTAL = 200
+# bの索引を作ったSequenceMatcherを保持する数
+_MATCHER_CACHE_SIZE = 8
+_matchers: Dict[str, difflib.SequenceMatcher] = {}
+
+
+def length_bound(a: str, b: str) -> float:
+    """長さだけから求めた類似度の上限（difflibのreal_quick_ratio相当）"""
+    total = len(a) + len(b)
+    if not total:
+        return 1.0
+    return 2.0 * min(len(a), len(b)) / total
+
+
+def histogram_bound(a: str, b: str) -> float:
+    """文字の出現回数から求めた類似度の上限（difflibのquick_ratio相当）"""
+    total = len(a) + len(b)
+    if not total:
+        return 1.0
+    counts = Counter(a)
+    common = 0
+    for ch, n in Counter(b).items():
+        m = counts.get(ch)
+        if m:
+            common += n if n < m else m
+    return 2.0 * common / total
+
+
+def _matcher(b: str) -> difflib.SequenceMatcher:
+    """bを設定済みのSequenceMatcher（bの索引b2jの作成は同じbにつき1回）"""
+    matcher = _matchers.get(b)
+    if matcher is None:
+        if len(_matchers) >= _MATCHER_CACHE_SIZE:
+            _matchers.pop(next(iter(_matchers)))
+        matcher = _matchers[b] = difflib.SequenceMatcher(None, "", b)
+    return matcher
+
+
+def _find_longest_match(a: str, b: str, b2j: Dict[str, List[int]], indexed: List[int],
+                        alo: int, ahi: int, blo: int, bhi: int) -> Tuple[int, int, int]:
+    """
+    SequenceMatcher.find_longest_match()と同じ結果（isjunk=Noneの場合）。
+    b2jに無い文字（autojunkで除かれた頻出文字など）の位置は一致の長さを0に戻すだけなので、
+    b2jにある文字の位置（indexed）だけを調べる
+    """
+    besti, bestj, bestsize = alo, blo, 0
+    j2len = {}
+    previ = -2
+    for n in range(bisect_left(indexed, alo), bisect_left(indexed, ahi)):
+        i = indexed[n]
+        if i != previ + 1:
+            j2len = {}
+        previ = i
+        j2lenget = j2len.get
+        newj2len = {}
+        for j in b2j[a[i]]:
+            if j < blo:
+                continue
+            if j >= bhi:
+                break
+            k = newj2len[j] = j2lenget(j - 1, 0) + 1
+            if k > bestsize:
+                besti, bestj, bestsize = i - k + 1, j - k + 1, k
+        j2len = newj2len
+    # 頻出文字も含めて前後に伸ばす（isjunk=Noneなのでジャンクの扱いは無い）
+    while besti > alo and bestj > blo and a[besti - 1] == b[bestj - 1]:
+        besti, bestj, bestsize = besti - 1, bestj - 1, bestsize + 1
+    while besti + bestsize < ahi and bestj + bestsize < bhi and a[besti + bestsize] == b[bestj + bestsize]:
+        bestsize += 1
+    return besti, bestj, bestsize
+
+
+def _bounded_matches(a: str, b: str, b2j: Dict[str, List[int]], score_cutoff: float) -> int:
+    """
+    get_matching_blocks()と同じ区間を探索して一致数を数える。
+    一致数の上限（見つかった一致 + 未探索の区間の短い方の長さの合計）による類似度がscore_cutoffを下回ったら-1を返す
+    """
+    la, lb = len(a), len(b)
+    total = la + lb
+    indexed = [i for i, ch in enumerate(a) if ch in b2j]
+    queue = [(0, la, 0, lb)]
+    matches = 0
+    pending = min(la, lb)
+    while queue:
+        alo, ahi, blo, bhi = queue.pop()
+        pending -= min(ahi - alo, bhi - blo)
+        i, j, k = _find_longest_match(a, b, b2j, indexed, alo, ahi, blo, bhi)
+        if k:
+            matches += k
+            if alo < i and blo < j:
+                queue.append((alo, i, blo, j))
+                pending += min(i - alo, j - blo)
+            if i + k < ahi and j + k < bhi:
+                queue.append((i + k, ahi, j + k, bhi))
+                pending += min(ahi - i - k, bhi - j - k)
+        if 2.0 * (matches + pending) / total < score_cutoff:
+            return -1
+    return matches
+
+
+def ratio(a: str, b: str, score_cutoff: float = 0.0) -> float:
+    """類似度（0.0〜1.0、difflibと同じ値）。score_cutoff未満の場合は0.0を返す"""
+    total = len(a) + len(b)
+    if not total:
+        return 1.0
+    if score_cutoff:
+        if length_bound(a, b) < score_cutoff:
+            return 0.0
+        if total >= _HISTOGRAM_MIN_TOTAL and histogram_bound(a, b) < score_cutoff:
+            return 0.0
+    matches = _bounded_matches(a, b, _matcher(b).b2j, score_cutoff)
+    if matches < 0:
+        return 0.0
+    # difflibと同じ式で計算する（浮動小数点の丸めも同じになる）
+    result = 2.0 * matches / total
+    return result if result >= score_cutoff else 0.0
+
+
+# === ベンチマーク ===
+
+def _make_pairs(length: int, pairs: int, seed: int = 0) -> List[tuple]:
+    """元の文字列と、一部を書き換え・挿入・削除した文字列の組を作る（同じ元の文字列と複数回比較する）"""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + " !?あいうえおアイウエオ"
+    result = []
+    base = ""
+    for i in range(pairs):
+        if i % 4 == 0:
+            # TextSpamと同様に、同じ文字列（直近のメッセージ）と4件ずつ比較する
+            base = "".join(rng.choice(alphabet) for _ in range(length))
+        chars = list(base)
+        edits = rng.randrange(max(1, length // 2))
+        for _ in range(edits):
+            op = rng.random()
+            pos = rng.randrange(len(chars) + 1)
+            if op < 0.4 and pos < len(chars):
+                chars[pos] = rng.choice(alphabet)
+            elif op < 0.7:
+                chars.insert(pos, rng.choice(alphabet))
+            elif pos < len(chars):
+                del chars[pos]
+        result.append(("".join(chars), base))
+    return result
+
+
+def _classify(score: float, thresholds: Iterable[float]) -> int:
+    """scoreがいくつの閾値を超えているか（TextSpamの段階判定と同じ比較）"""
+    return sum(1 for t in thresholds if score > t)
+
+
+def benchmark(length: int, pairs: int, thresholds: List[float], repeat: int = 3):
+    """difflibとの比較（最良値, ms）と、閾値による段階判定の一致率"""
+    data = _make_pairs(length, pairs)
+    cutoff = min(thresholds) if thresholds else 0.0
+
+    def run_difflib():
+        return [difflib.SequenceMatcher(None, a, b).ratio() for a, b in data]
+
+    def run_ratio():
+        _matchers.clear()
+        return [ratio(a, b) for a, b in data]
+
+    def run_cutoff():
+        _matchers.clear()
+        return [ratio(a, b, cutoff) for a, b in data]
+
+    results = {}
+    methods = (("difflib", run_difflib), ("ratio", run_ratio), (f"ratio(cutoff={cutoff})", run_cutoff))
+    for name, func in methods:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            scores = func()
+            best = min(best, time.perf_counter() - started)
+        results[name] = (round(best * 1000, 2), scores)
+
+    reference = results["difflib"][1]
+    for name, (ms, scores) in results.items():
+        agree = sum(1 for x, y in zip(reference, scores) if _classify(x, thresholds) == _classify(y, thresholds))
+        yield {"name": name, "ms": ms, "agreement": round(agree / max(1, len(scores)), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文字列類似度のベンチマーク（difflibとの比較）")
+    parser.add_argument("--length", type=int, default=2000, help="文字列の長さ")
+    parser.add_argument("--pairs", type=int, default=200, help="比較する組の数")
+    parser.add_argument("--thresholds", default="0.6,0.75,0.9", help="段階判定の閾値（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最良値を表示）")
+    args = parser.parse_args()
+
+    thresholds = [float(x) for x in args.thresholds.split(",") if x]
+    print(f"[INFO] {args.length}文字 × {args.pairs}組（{args.repeat}回の最良値）")
+    print(f"{'method':<24} {'time(ms)':>10} {'一致率(difflib)':>16}")
+    for r in benchmark(args.length, args.pairs, thresholds, args.repeat):
+        print(f"{r['name']:<24} {r['ms']:>10} {r['agreement']:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+sqlitestore.py - SQLiteによるキー単位のJSONストア
+
+- 1行 = (bucket, key) → JSON文字列。読み書きは触れた行だけで済み、DB全体を読み込み・書き直す必要がない
+- WALモード + synchronous=NORMAL（コミット毎のfsyncを省き、チェックポイント時にまとめて書き出す）
+- SQL文は定数にして sqlite3 のステートメントキャッシュで使い回す
+
+database.json からの一括移行:
+    python -m lib.sqlitestore database.json database.sqlite3
+"""
+
+import os
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from lib import jsoncodec
+
+ROOT_BUCKET = "root"
+CUSTOM_BUCKET_PREFIX = "custom:"
+
+_SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (bucket, key)
+) WITHOUT ROWID
+"""
+_SQL_GET = "SELECT value FROM kv WHERE bucket = ? AND key = ?"
+_SQL_PUT = "INSERT OR REPLACE INTO kv (bucket, key, value) VALUES (?, ?, ?)"
+_SQL_DELETE = "DELETE FROM kv WHERE bucket = ? AND key = ?"
+_SQL_EXISTS = "SELECT 1 FROM kv WHERE bucket = ? AND key = ?"
+_SQL_KEYS = "SELECT key FROM kv WHERE bucket = ?"
+_SQL_ITEMS = "SELECT key, value FROM kv WHERE bucket = ?"
+_SQL_COUNT = "SELECT COUNT(*) FROM kv WHERE bucket = ?"
+_SQL_BUCKETS = "SELECT DISTINCT bucket FROM kv"
+_SQL_DELETE_BUCKET = "DELETE FROM kv WHERE bucket = ?"
+_SQL_IS_EMPTY = "SELECT NOT EXISTS (SELECT 1 FROM kv)"
+
+
+def custom_bucket(db_name: str) -> str:
+    """カスタムDB名に対応するバケット名"""
+    return f"{CUSTOM_BUCKET_PREFIX}{db_name}"
+
+
+def _encode(value: Any) -> str:
+    return jsoncodec.dumps_str(value, compact=True)
+
+
+def _decode(text: str) -> Any:
+    return jsoncodec.loads(text)
+
+
+class SQLiteStore:
+    """
+    (bucket, key) 単位でJSON値を保存するストア。
+    接続は1本をロックで共有する（Botのイベント処理スレッドとFlaskスレッドから同時に呼ばれるため）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=64)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SQL_SCHEMA)
+        self._depth = 0
+        self.stats = {"reads": 0, "writes": 0, "transactions": 0}
+
+    # --- トランザクション ---
+    @contextmanager
+    def transaction(self):
+        """書き込みトランザクション。ネストした場合は最外側でまとめてコミットする"""
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+                self.stats["transactions"] += 1
+
+    # --- 読み込み ---
+    def get(self, bucket: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(_SQL_GET, (bucket, key)).fetchone()
+            self.stats["reads"] += 1
+        return _decode(row[0]) if row else default
+
+    def has(self, bucket: str, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute(_SQL_EXISTS, (bucket, key)).fetchone() is not None
+
+    def keys(self, bucket: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(_SQL_KEYS, (bucket,))]
+
+    def items(self, bucket: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(_SQL_ITEMS, (bucket,)).fetchall()
+            self.stats["reads"] += len(rows)
+        return {key: _decode(value) for key, value in rows}
+
+    def count(self, bucket: str) -> int:
+        with self._lock:
+            return self._conn.execute(_SQL_COUNT, (bucket,)).fetchone()[0]
+
+    def buckets(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(_SQL_BUCKETS)]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return bool(self._conn.execute(_SQL_IS_EMPTY).fetchone()[0])
+
+    # --- 書き込み ---
+    def put(self, bucket: str, key: str, value: Any) -> None:
+        payload = _encode(value)
+        with self.transaction():
+            self._conn.execute(_SQL_PUT, (bucket, key, payload))
+            self.stats["writes"] += 1
+
+    def put_many(self, rows: Iterable[Tuple[str, str, Any]]) -> int:
+        """複数行を1トランザクションで書き込む。書き込んだ行数を返す"""
+        encoded = [(bucket, key, _encode(value)) for bucket, key, value in rows]
+        with self.transaction():
+            self._conn.executemany(_SQL_PUT, encoded)
+            self.stats["writes"] += len(encoded)
+        return len(encoded)
+
+    def delete(self, bucket: str, key: str) -> bool:
+        with self.transaction():
+            cursor = self._conn.execute(_SQL_DELETE, (bucket, key))
+            self.stats["writes"] += 1
+        return cursor.rowcount > 0
+
+    def delete_bucket(self, bucket: str) -> int:
+        with self.transaction():
+            cursor = self._conn.execute(_SQL_DELETE_BUCKET, (bucket,))
+        return cursor.rowcount
+
+    def replace_bucket(self, bucket: str, mapping: Dict[str, Any]) -> None:
+        """バケットの内容をmappingで置き換える"""
+        with self.transaction():
+            self._conn.execute(_SQL_DELETE_BUCKET, (bucket,))
+            self.put_many((bucket, str(key), value) for key, value in mapping.items())
+
+    # --- 保守 ---
+    def checkpoint(self) -> None:
+        """WALの内容を本体ファイルへ書き戻し、WALを切り詰める"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# === database.json との相互変換 ===
+
+def import_db_dict(store: SQLiteStore, data: Dict[str, Any], nested_buckets: Iterable[str]) -> int:
+    """
+    database.json形式の辞書をストアへ書き込む。
+    nested_bucketsに含まれるトップレベルキー（userData等）は子キー単位の行に、それ以外はrootバケットの行になる。
+    """
+    nested = set(nested_buckets)
+    rows = []
+    for key, value in data.items():
+        if key in nested and isinstance(value, dict):
+            rows.extend((key, str(sub_key), sub_value) for sub_key, sub_value in value.items())
+        else:
+            rows.append((ROOT_BUCKET, str(key), value))
+    return store.put_many(rows)
+
+
+def export_db_dict(store: SQLiteStore, nested_buckets: Iterable[str]) -> Dict[str, Any]:
+    """ストアの内容をdatabase.json形式の辞書に戻す（カスタムDBは含まない）"""
+    data = store.items(ROOT_BUCKET)
+    for bucket in nested_buckets:
+        items = store.items(bucket)
+        if items:
+            data[bucket] = items
+    return data
+
+
+def migrate_json_files(json_path: str, sqlite_path: str, nested_buckets: Iterable[str],
+                       custom_paths: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """
+    database.json（と任意のカスタムDBファイル）をSQLiteへ一括移行する。
+    移行先に同じキーがある場合は上書きされる。移行した行数をバケット別に返す。
+    """
+    store = SQLiteStore(sqlite_path)
+    result = {}
+    try:
+        with store.transaction():
+            if os.path.exists(json_path):
+                with open(json_path, "rb") as f:
+                    content = f.read()
+                data = jsoncodec.loads(content) if content.strip() else {}
+                result["database"] = import_db_dict(store, data, nested_buckets)
+            for db_name, path in (custom_paths or {}).items():
+                with open(path, "rb") as f:
+                    content = f.read()
+                data = jsoncodec.loads(content) if content.strip() else {}
+                store.replace_bucket(custom_bucket(db_name), data)
+                result[custom_bucket(db_name)] = len(data)
+        store.checkpoint()
+    finally:
+        store.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="database.jsonをSQLiteへ移行します")
+    parser.add_argument("json_path", nargs="?", default="database.json", help="移行元のdatabase.json")
+    parser.add_argument("sqlite_path", nargs="?", default="database.sqlite3", help="移行先のSQLiteファイル")
+    parser.add_argument("--nested", default="userData,api_keys",
+                        help="子キー単位の行に分割するトップレベルキー（カンマ区切り）")
+    parser.add_argument("--custom", action="append", default=[], metavar="NAME=PATH",
+                        help="一緒に移行するカスタムDB（複数指定可）")
+    args = parser.parse_args()
+
+    custom_paths = {}
+    for item in args.custom:
+        name, _, path = item.partition("=")
+        custom_paths[name] = path or f"{name}.json"
+    nested = [name for name in args.nested.split(",") if name]
+    result = migrate_json_files(args.json_path, args.sqlite_path, nested, custom_paths)
+    for bucket, count in result.items():
+        print(f"[INFO] {bucket}: {count}件を移行しました")
+    print(f"[INFO] 移行完了: {args.sqlite_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import discord
 from discord.ext import commands
 from plugins import register_command
 import asyncio
-from DataBase import get_user_data, set_user_data, update_user_data
+from DataBase import get_user_data, patch, increment
 
 class GameManager:
     """
@@ -46,36 +46,17 @@ class GameManager:
         """コインを加算（負の値は無視）。userData['GameData']['coin'] で永続管理"""
         if amount < 0:
             return
-        uid = str(user_id)
-        data = get_user_data(uid)
-        gamedata = data.get('GameData', {})
-        coin = gamedata.get('coin', 0)
-        coin = max(0, coin + amount)
-        gamedata['coin'] = coin
-        data['GameData'] = gamedata
-        set_user_data(uid, data)
+        increment(("user", user_id, 'GameData', 'coin'), amount, minimum=0)
 
     def remove_currency(self, user_id, amount):
         """コインを減算（残高が足りない場合は0に）。userData['GameData']['coin'] で永続管理"""
         if amount < 0:
             return
-        uid = str(user_id)
-        data = get_user_data(uid)
-        gamedata = data.get('GameData', {})
-        coin = gamedata.get('coin', 0)
-        coin = max(0, coin - amount)
-        gamedata['coin'] = coin
-        data['GameData'] = gamedata
-        set_user_data(uid, data)
+        increment(("user", user_id, 'GameData', 'coin'), -amount, minimum=0)
 
     def set_currency(self, user_id, amount):
         """コイン残高を直接セット（0未満は0）。userData['GameData']['coin'] で永続管理"""
-        uid = str(user_id)
-        data = get_user_data(uid)
-        gamedata = data.get('GameData', {})
-        gamedata['coin'] = max(0, amount)
-        data['GameData'] = gamedata
-        set_user_data(uid, data)
+        patch(("user", user_id, 'GameData', 'coin'), max(0, amount))
 
     def get_currency(self, user_id):
         """コイン残高を取得。userData['GameData']['coin'] で永続管理"""
@@ -1,41 +1,50 @@
-from plugins.antiModule.spam import IMAGE_SPAM_THRESHOLD, IMAGE_SPAM_WINDOW, user_image_timestamps, DEFAULT_TIMEOUT_DURATION, _now
-from plugins.antiModule.bypass import MiniAntiBypass
+from plugins.antiModule.spam import IMAGE_SPAM_THRESHOLD, IMAGE_SPAM_WINDOW, user_image_timestamps, DEFAULT_TIMEOUT_DURATION
+from plugins.antiModule.features import MessageFeatures, Verdict
+from plugins.antiModule.types import DetectionType
 from collections import deque
-import discord
+from typing import Mapping, Optional, Tuple
 from plugins.antiModule.spam import BaseSpam
 
 class MediaSpam(BaseSpam):
+    # 判定の閾値（シャドウ評価で上書きできる）
+    PARAMS = {"threshold": IMAGE_SPAM_THRESHOLD}
+
     @staticmethod
-    async def check_and_block_media_spam(message, timeout_duration: int = DEFAULT_TIMEOUT_DURATION):
-        from plugins.antiModule.config import AntiCheatConfig
-        if not await AntiCheatConfig.is_enabled(message.guild):
-            return False
-        if not await AntiCheatConfig.is_detection_enabled(message.guild, "image_spam"):
-            return False
-        if await MiniAntiBypass.should_bypass(message):
-            return False
-        uid = message.author.id
-        now = _now()
+    def evaluate(features: MessageFeatures) -> Optional[Verdict]:
+        uid = features.author_id
+        now = features.now
         if uid not in user_image_timestamps:
             user_image_timestamps[uid] = deque()
-        if message.attachments or any(e.type == "image" for e in getattr(message, "embeds", [])):
+        if features.has_media:
             user_image_timestamps[uid].append(now)
             while user_image_timestamps[uid] and now - user_image_timestamps[uid][0] > IMAGE_SPAM_WINDOW:
                 user_image_timestamps[uid].popleft()
-            if len(user_image_timestamps[uid]) >= IMAGE_SPAM_THRESHOLD:
-                from plugins.antiModule.spam import spam_log_aggregator
-                guild_id = message.guild.id if message.guild else None
-                spam_log_aggregator.add_spam_log(guild_id, uid, "image", now)
-                if guild_id and spam_log_aggregator.check_mass_spam(guild_id):
-                    alert_type = "mass_image"
-                else:
-                    alert_type = "image"
-                return await MediaSpam.block_and_notify(
-                    message,
-                    uid,
-                    now,
-                    alert_type,
-                    timeout_duration,
-                    "画像・動画スパム検知による自動タイムアウト",
-                )
-        return False
+        return MediaSpam.judge(features, MediaSpam.PARAMS)[1]
+
+    @staticmethod
+    def judge(features: MessageFeatures, params: Mapping) -> Tuple[Optional[float], Optional[Verdict]]:
+        """窓内の画像投稿数をparamsの閾値で判定する（状態は変更しない）。(投稿数, 判定) を返す"""
+        if not features.has_media:
+            return None, None
+        count = len(user_image_timestamps.get(features.author_id) or ())
+        if count >= params["threshold"]:
+            return count, Verdict(DetectionType.IMAGE, count)
+        return count, None
+
+    @staticmethod
+    async def apply(message, features: MessageFeatures, verdict: Verdict, timeout_duration: int = DEFAULT_TIMEOUT_DURATION):
+        from plugins.antiModule.spam import spam_log_aggregator
+        guild_id = features.guild_id
+        spam_log_aggregator.add_spam_log(guild_id, features.author_id, "image", features.now)
+        if guild_id and spam_log_aggregator.check_mass_spam(guild_id):
+            alert_type = "mass_image"
+        else:
+            alert_type = "image"
+        return await MediaSpam.block_and_notify(
+            message,
+            features.author_id,
+            features.now,
+            alert_type,
+            timeout_duration,
+            "画像・動画スパム検知による自動タイムアウト",
+        )
@@ -1,57 +1,55 @@
 from plugins.antiModule.spam import (
     MENTION_SPAM_THRESHOLD,
     MENTION_SPAM_WINDOW,
+    USER_STATE_TTL,
     user_mention_timestamps as _user_mention_timestamps,
     DEFAULT_TIMEOUT_DURATION,
-    _now,
 )
-from plugins.antiModule.bypass import MiniAntiBypass
+from plugins.antiModule.features import MessageFeatures, Verdict
+from plugins.antiModule.types import DetectionType
+from plugins.antiModule.state import ExpiringStateStore
 from collections import deque
-import discord
+from typing import Mapping, Optional, Tuple
 from plugins.antiModule.spam import BaseSpam
 
-user_mention_history = {}
+user_mention_history = ExpiringStateStore("mention.history", USER_STATE_TTL)
 
 
 class MentionSpam(BaseSpam):
-    @staticmethod
-    async def check_and_block_mention_spam(
-        message, timeout_duration: int = DEFAULT_TIMEOUT_DURATION
-    ):
-        from plugins.antiModule.config import AntiCheatConfig
+    # 判定の閾値（シャドウ評価で上書きできる）
+    PARAMS = {"window_threshold": MENTION_SPAM_THRESHOLD, "score_threshold": 2}
 
-        if not await AntiCheatConfig.is_enabled(message.guild):
-            return False
-        if not await AntiCheatConfig.is_detection_enabled(message.guild, "mention_spam"):
-            return False
-        if await MiniAntiBypass.should_bypass(message):
-            return False
-        uid = message.author.id
-        now = _now()
+    @staticmethod
+    def evaluate(features: MessageFeatures) -> Optional[Verdict]:
+        uid = features.author_id
+        now = features.now
         # 直近2回分のメンション履歴を記録
         if uid not in user_mention_history:
             user_mention_history[uid] = deque(maxlen=2)
-        mention_ids = [m.id for m in getattr(message, 'mentions', []) if isinstance(m, discord.User) or isinstance(m, discord.Member)]
-        role_mention_ids = [r.id for r in getattr(message, 'role_mentions', [])]
-        mention_everyone = getattr(message, 'mention_everyone', False)
         user_mention_history[uid].append({
             'time': now,
-            'mention_ids': mention_ids,
-            'role_mention_ids': role_mention_ids,
-            'mention_everyone': mention_everyone
+            'mention_ids': features.mention_ids,
+            'role_mention_ids': features.role_mention_ids,
+            'mention_everyone': features.mention_everyone
         })
         # 既存のウィンドウ方式も記録
-        if message.mentions or message.role_mentions or mention_everyone:
+        if features.has_mentions:
             if uid not in _user_mention_timestamps:
                 _user_mention_timestamps[uid] = deque()
             _user_mention_timestamps[uid].append(now)
             while _user_mention_timestamps[uid] and now - _user_mention_timestamps[uid][0] > MENTION_SPAM_WINDOW:
                 _user_mention_timestamps[uid].popleft()
-        # スコアリング
+        return MentionSpam.judge(features, MentionSpam.PARAMS)[1]
+
+    @staticmethod
+    def judge(features: MessageFeatures, params: Mapping) -> Tuple[Optional[float], Optional[Verdict]]:
+        """記録済みのメンション履歴をparamsの閾値で採点する（状態は変更しない）。(スコア, 判定) を返す"""
+        uid = features.author_id
+        history = user_mention_history.get(uid) or ()
         score = 0
         # 直近2回の履歴でスパムパターン
-        if len(user_mention_history[uid]) == 2:
-            h1, h2 = user_mention_history[uid][0], user_mention_history[uid][1]
+        if len(history) == 2:
+            h1, h2 = history[0], history[1]
             # 個人2人メンション連続
             if len(h1['mention_ids']) == 2 and len(h2['mention_ids']) == 2:
                 score += 1
@@ -62,20 +60,22 @@ class MentionSpam(BaseSpam):
             if h1['mention_everyone'] and h2['mention_everyone']:
                 score += 1
         # ウィンドウ内のメンション回数
-        if uid in _user_mention_timestamps and len(_user_mention_timestamps[uid]) >= MENTION_SPAM_THRESHOLD:
+        if len(_user_mention_timestamps.get(uid) or ()) >= params["window_threshold"]:
             score += 1
         # 閾値（例: 2）
-        if score >= 2:
-            from plugins.antiModule.spam import spam_log_aggregator
-            guild_id = message.guild.id if message.guild else None
-            spam_log_aggregator.add_spam_log(guild_id, uid, "mention", now)
-            alert_type = "mention"
-            return await MentionSpam.block_and_notify(
-                message,
-                uid,
-                now,
-                alert_type,
-                timeout_duration,
-                "メンションスパム検知による自動タイムアウト",
-            )
-        return False
+        if score >= params["score_threshold"]:
+            return score, Verdict(DetectionType.MENTION, score)
+        return score, None
+
+    @staticmethod
+    async def apply(message, features: MessageFeatures, verdict: Verdict, timeout_duration: int = DEFAULT_TIMEOUT_DURATION):
+        from plugins.antiModule.spam import spam_log_aggregator
+        spam_log_aggregator.add_spam_log(features.guild_id, features.author_id, "mention", features.now)
+        return await MentionSpam.block_and_notify(
+            message,
+            features.author_id,
+            features.now,
+            "mention",
+            timeout_duration,
+            "メンションスパム検知による自動タイムアウト",
+        )
@@ -3,98 +3,100 @@ from plugins.antiModule.spam import (
     user_recent_messages,
     RECENT_MSG_COUNT,
     DEFAULT_TIMEOUT_DURATION,
-    _now,
 )
-from plugins.antiModule.bypass import MiniAntiBypass
+from plugins.antiModule.features import MessageFeatures, Verdict
+from plugins.antiModule.types import DetectionType
 from plugins.antiModule.spam import BaseSpam
-import difflib
-import re
+from typing import List, Mapping, Optional, Tuple
+from lib import similarity
 from collections import deque
 import discord
 
 
 class TextSpam(BaseSpam):
-    @staticmethod
-    async def check_and_block_spam(
-        message: discord.Message, timeout_duration: int = DEFAULT_TIMEOUT_DURATION
-    ):
-        from plugins.antiModule.config import AntiCheatConfig
+    # 判定の閾値（シャドウ評価で上書きできる）
+    PARAMS = TEXT_SPAM_CONFIG
+    # 直前に計算した類似度 (特徴量, 足切り値, 類似度のリスト)。シャドウ評価で同じメッセージの計算を再利用する
+    _similarity_cache: Tuple[Optional[MessageFeatures], float, List[float]] = (None, 0.0, [])
 
-        if not await AntiCheatConfig.is_enabled(message.guild):
-            return False
-        if not await AntiCheatConfig.is_detection_enabled(message.guild, "text_spam"):
-            return False
-        if await MiniAntiBypass.should_bypass(message):
-            return False
-        uid = message.author.id
-        now = _now()
+    @staticmethod
+    def evaluate(features: MessageFeatures) -> Optional[Verdict]:
+        uid = features.author_id
         if uid not in user_recent_messages:
             user_recent_messages[uid] = deque(maxlen=RECENT_MSG_COUNT)
-        user_recent_messages[uid].append((now, message.content))
-        recent = [c for t, c in user_recent_messages[uid] if c]
+        user_recent_messages[uid].append((features.now, features.content))
+        return TextSpam.judge(features, TextSpam.PARAMS)[1]
+
+    @staticmethod
+    def _similarities(features: MessageFeatures, recent: List[str], cutoff: float) -> List[float]:
+        cached_features, cached_cutoff, scores = TextSpam._similarity_cache
+        if cached_features is features and cached_cutoff <= cutoff:
+            return [s if s >= cutoff else 0.0 for s in scores]
+        scores = [similarity.ratio(text, recent[-1], cutoff) for text in recent[:-1]]
+        TextSpam._similarity_cache = (features, cutoff, scores)
+        return scores
+
+    @staticmethod
+    def judge(features: MessageFeatures, config: Mapping) -> Tuple[Optional[float], Optional[Verdict]]:
+        """記録済みの履歴をconfigの閾値で採点する（状態は変更しない）。(スコア, 判定) を返す"""
+        history = user_recent_messages.get(features.author_id)
+        if not history:
+            return None, None
+        recent = [c for t, c in history if c]
         if len(recent) < 2:
-            return False
+            return None, None
         score = 0
-        for i in range(len(recent) - 1):
-            s = difflib.SequenceMatcher(None, recent[i], recent[-1]).ratio()
-            if s > TEXT_SPAM_CONFIG["high_similarity_threshold"]:
-                score += TEXT_SPAM_CONFIG["high_similarity_score"]
-            elif s > TEXT_SPAM_CONFIG["medium_similarity_threshold"]:
-                score += TEXT_SPAM_CONFIG["medium_similarity_score"]
-            elif s > TEXT_SPAM_CONFIG["low_similarity_threshold"]:
-                score += TEXT_SPAM_CONFIG["low_similarity_score"]
-        if len(user_recent_messages[uid]) >= 2:
-            t0 = user_recent_messages[uid][-2][0]
-            dt = now - t0
-            if dt < TEXT_SPAM_CONFIG["rapid_post_threshold"]:
-                score += TEXT_SPAM_CONFIG["rapid_post_score"]
-            elif dt < TEXT_SPAM_CONFIG["fast_post_threshold"]:
-                score += TEXT_SPAM_CONFIG["fast_post_score"]
-        content = message.content
-        if content:
-            symbol_ratio = sum(1 for c in content if not c.isalnum()) / max(
-                1, len(content)
-            )
-            if symbol_ratio > TEXT_SPAM_CONFIG["high_symbol_threshold"]:
-                score += TEXT_SPAM_CONFIG["high_symbol_score"]
-            elif symbol_ratio > TEXT_SPAM_CONFIG["medium_symbol_threshold"]:
-                score += TEXT_SPAM_CONFIG["medium_symbol_score"]
-        repeated_char_match = re.search(r"(.)\1{7,}", content)
-        repeated_digit_match = re.search(r"(\d)\1{7,}", content)
-        uuid4_pattern = re.compile(
-            r"[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-4[a-fA-F0-9]{3}-[89abAB][a-fA-F0-9]{3}-[a-fA-F0-9]{12}"
-        )
-        uuid4_matches = uuid4_pattern.findall(content)
-        uuid4_count = len(uuid4_matches)
-        dot_pattern = re.compile(r"(?:[a-zA-Z0-9]\.){4,}[a-zA-Z0-9_]+")
-        dot_matches = dot_pattern.findall(content)
-        dot_count = len(dot_matches)
+        # 最も低い閾値未満は加点しないので、上限値で足切りできる
+        for s in TextSpam._similarities(features, recent, config["low_similarity_threshold"]):
+            if s > config["high_similarity_threshold"]:
+                score += config["high_similarity_score"]
+            elif s > config["medium_similarity_threshold"]:
+                score += config["medium_similarity_score"]
+            elif s > config["low_similarity_threshold"]:
+                score += config["low_similarity_score"]
+        if len(history) >= 2:
+            t0 = history[-2][0]
+            dt = features.now - t0
+            if dt < config["rapid_post_threshold"]:
+                score += config["rapid_post_score"]
+            elif dt < config["fast_post_threshold"]:
+                score += config["fast_post_score"]
+        if features.content:
+            if features.symbol_ratio > config["high_symbol_threshold"]:
+                score += config["high_symbol_score"]
+            elif features.symbol_ratio > config["medium_symbol_threshold"]:
+                score += config["medium_symbol_score"]
 
-        if repeated_char_match or repeated_digit_match:
+        if features.has_repeated_char:
             score += 0.4
-        if uuid4_count >= 2:
+        if features.uuid_count >= 2:
             score += 0.5
-        elif uuid4_count == 1:
+        elif features.uuid_count == 1:
             score += 0.25
-        if dot_count >= 1:
+        if features.dot_count >= 1:
             score += 0.2
 
-            
-        if score >= TEXT_SPAM_CONFIG["base_threshold"]:
-            from plugins.antiModule.spam import spam_log_aggregator
+        if score >= config["base_threshold"]:
+            return score, Verdict(DetectionType.TEXT, score)
+        return score, None
+
+    @staticmethod
+    async def apply(
+        message: discord.Message, features: MessageFeatures, verdict: Verdict, timeout_duration: int = DEFAULT_TIMEOUT_DURATION
+    ):
+        from plugins.antiModule.spam import spam_log_aggregator
 
-            guild_id = message.guild.id if message.guild else None
-            spam_log_aggregator.add_spam_log(guild_id, uid, "text", now)
-            if guild_id and spam_log_aggregator.check_mass_spam(guild_id):
-                alert_type = "mass_text"
-            else:
-                alert_type = "text"
-            return await TextSpam.block_and_notify(
-                message,
-                uid,
-                now,
-                alert_type,
-                timeout_duration,
-                "テキストスパム検知による自動タイムアウト",
-            )
-        return False
+        guild_id = features.guild_id
+        spam_log_aggregator.add_spam_log(guild_id, features.author_id, "text", features.now)
+        if guild_id and spam_log_aggregator.check_mass_spam(guild_id):
+            alert_type = "mass_text"
+        else:
+            alert_type = "text"
+        return await TextSpam.block_and_notify(
+            message,
+            features.author_id,
+            features.now,
+            alert_type,
+            timeout_duration,
+            "テキストスパム検知による自動タイムアウト",
+        )
@@ -1,14 +1,18 @@
 import time
-from typing import Any, Callable
-from plugins.antiModule.spam import BaseSpam
-from plugins.antiModule.bypass import MiniAntiBypass
-from plugins.antiModule.config import AntiCheatConfig
+from typing import Any, Callable, Optional
+from plugins.antiModule.spam import BaseSpam, DEFAULT_TIMEOUT_DURATION
+from plugins.antiModule.features import MessageFeatures, Verdict
+from plugins.antiModule.types import DetectionType
+from plugins.antiModule.state import ExpiringStateStore
+
+# 入力中イベントの記録を保持する時間（これより前に入力したユーザーは未記録として扱う）
+TYPING_STATE_TTL = 24 * 60 * 60
 
 
 class TypingBypass(BaseSpam):
-    typing_timestamps = {}
+    typing_timestamps = ExpiringStateStore("typing_bypass.typing", TYPING_STATE_TTL, touch_on_read=False)
     # track users who already consumed their one-time grace pass
-    _grace_used = set()
+    _grace_used = ExpiringStateStore("typing_bypass.grace", TYPING_STATE_TTL, touch_on_read=False)
     _bot: Any = None
     _on_typing_handler = None
     TYPING_BYPASS_WINDOW = 300
@@ -35,53 +39,37 @@ class TypingBypass(BaseSpam):
         TypingBypass.typing_timestamps[user_id] = now
 
     @staticmethod
-    async def check_and_block_typing_bypass(message: Any) -> bool:
-        user_id = message.author.id
-        current_time = time.time()
-        content = getattr(message, 'content', '')
-        # 10文字以下のメッセージは許可
-        if len(content) <= 20:
-            return False
-        import re
-        url_pattern = r"^(https?://[\w\-._~:/?#\[\]@!$&'()*+,;=%]+)$"
-        if re.fullmatch(url_pattern, content.strip()):
-            return False
+    def evaluate(features: MessageFeatures) -> Optional[Verdict]:
+        user_id = features.author_id
+        # 20文字以下のメッセージは許可
+        if features.length <= 20:
+            return None
+        if features.is_url_only:
+            return None
         # If we have no typing timestamp for this user, allow a one-time grace pass
         if user_id not in TypingBypass.typing_timestamps:
             if user_id not in TypingBypass._grace_used:
                 # consume the grace and allow this first message
-                TypingBypass._grace_used.add(user_id)
-                return False
-            try:
-                await message.delete()
-            except Exception as e:
-                print(f"[TypingBypass] message.delete error: {e}")
-            return False
+                TypingBypass._grace_used[user_id] = True
+                return None
+            # 入力中イベントのないメッセージは削除のみ（タイムアウトはしない）
+            return Verdict(DetectionType.TYPING_BYPASS, 0, action="delete")
         last_typing = TypingBypass.typing_timestamps.get(user_id)
-        if last_typing is not None and current_time - last_typing <= TypingBypass.TYPING_BYPASS_WINDOW:
-            return False
-        if await MiniAntiBypass.should_bypass(message):
-            return False
-        from plugins.antiModule.config import AntiCheatConfig
-        if not await AntiCheatConfig.is_enabled(message.guild):
-            return False
-        if not await AntiCheatConfig.is_detection_enabled(message.guild, "typing_bypass"):
-            return False
+        if last_typing is not None and features.wall_time - last_typing <= TypingBypass.TYPING_BYPASS_WINDOW:
+            return None
+        return Verdict(DetectionType.TYPING_BYPASS, features.wall_time - last_typing)
+
+    @staticmethod
+    async def apply(message: Any, features: MessageFeatures, verdict: Verdict, timeout_duration: int = DEFAULT_TIMEOUT_DURATION) -> bool:
         print(f"Typing Bypass detected: {message.author.name} in {message.channel.id}")
         try:
-            from plugins.antiModule.spam import _now, DEFAULT_TIMEOUT_DURATION
-            uid = user_id
-            now = _now()
-            alert_type = "typing_bypass"
-            timeout_duration = DEFAULT_TIMEOUT_DURATION
-            reason = "Typing Bypass検知による自動タイムアウト"
             await TypingBypass.block_and_notify(
                 message,
-                uid,
-                now,
-                alert_type,
+                features.author_id,
+                features.now,
+                "typing_bypass",
                 timeout_duration,
-                reason
+                "Typing Bypass検知による自動タイムアウト"
             )
         except Exception as e:
             print(f"[TypingBypass] block_and_notify error: {e}")
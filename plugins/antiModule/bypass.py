@@ -9,29 +9,15 @@ class MiniAntiBypass:
             return False
         try:
             from .config import AntiCheatConfig
+            compiled = await AntiCheatConfig.get_compiled(message.guild)
             # ホワイトリストチャンネルなら常にバイパス
-            whitelist = await AntiCheatConfig.get_setting(message.guild, "whitelist_channels")
-            if whitelist is not None and type(whitelist) is list:
-                if message.channel.id in [int(x) for x in whitelist if isinstance(x, int) or (isinstance(x, str) and str(x).isdigit())]:
-                    return True
-            # バイパスロールID取得
-            bypass_role_id = await AntiCheatConfig.get_setting(message.guild, "bypass_role")
-            if not bypass_role_id:
-                return False
-            try:
-                if bypass_role_id is not None and str(bypass_role_id).isdigit():
-                    bypass_role_id = int(str(bypass_role_id))
-                else:
-                    return False
-            except (ValueError, TypeError):
-                print(f"[miniAnti] Invalid bypass role ID: {bypass_role_id}")
+            if message.channel.id in compiled.whitelist_channels:
+                return True
+            # ユーザーがバイパスロールを持っているかチェック
+            bypass_role_id = compiled.bypass_role_id
+            if bypass_role_id is None:
                 return False
-            # ユーザーが該当ロールを持っているかチェック
-            if hasattr(message.author, "roles"):
-                for role in message.author.roles:
-                    if role.id == bypass_role_id:
-                        return True
-            return False
+            return any(role.id == bypass_role_id for role in getattr(message.author, "roles", ()))
         except Exception as e:
             print(f"[miniAnti] Error in bypass check: {e}")
             return False
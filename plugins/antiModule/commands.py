@@ -29,7 +29,7 @@ def setup_anti_commands(bot):
         """
         if ctx.invoked_subcommand is None:
             await ctx.send(
-                "`#anti settings|bypass|unblock|block|list|alert|toggle|flag` サブコマンドを指定してください。\n例: `#anti settings`, `#anti flag`, `#anti flag quick`"
+                "`#anti settings|bypass|unblock|block|list|alert|toggle|flag|shadow` サブコマンドを指定してください。\n例: `#anti settings`, `#anti flag`, `#anti flag quick`"
             )
 
     @anti.command()
@@ -137,7 +137,7 @@ def setup_anti_commands(bot):
         from plugins.antiModule.spam import user_blocked_until, Block
         from datetime import timedelta
 
-        user_blocked_until[user_id] = int(discord.utils.utcnow().timestamp()) + seconds
+        user_blocked_until.set(user_id, int(discord.utils.utcnow().timestamp()) + seconds, ttl=seconds)
         # タイムアウトも適用
         member = None
         try:
@@ -332,27 +332,9 @@ def setup_anti_commands(bot):
                 if not (1 <= count <= 100):
                     await ctx.send("❌ 1～100の範囲で指定してください。")
                     return
-                # 指定数だけ減算: まず全リセット→新しいフラグを1件だけ追加
-                await FlagSystem.reset_user_flags(ctx.guild, user_id)
+                # 指定数だけ減算（違反履歴は残す）
                 new_flags = max(0, before - count)
-                if new_flags > 0:
-                    # flags_added, last_decay, violationsの最低限で追加
-                    from plugins.antiModule.flag_system import FlagSystem as _FS
-
-                    guild_id = ctx.guild.id
-                    _FS._ensure_user_flags_loaded(guild_id)
-                    if guild_id not in _FS._user_flags:
-                        _FS._user_flags[guild_id] = {}
-                    if user_id not in _FS._user_flags[guild_id]:
-                        _FS._user_flags[guild_id][user_id] = []
-                    _FS._user_flags[guild_id][user_id].append(
-                        {
-                            "flags_added": new_flags,
-                            "last_decay": int(discord.utils.utcnow().timestamp()),
-                            "violations": [],
-                        }
-                    )
-                    _FS._save_user_flags_to_db(guild_id, _FS._user_flags[guild_id])
+                await FlagSystem.set_user_flags(ctx.guild, user_id, new_flags)
                 await ctx.send(
                     f"✅ <@{user_id}> のフラグを {count} 減らしました。（{before} → {new_flags}）"
                 )
@@ -436,4 +418,86 @@ def setup_anti_commands(bot):
             await AntiCheatConfig.update_setting(ctx.guild, "whitelist_channels", whitelist)
             await ctx.send(f"<#{channel_id_int}> をホワイトリストから削除しました。")
 
+    @anti.command()
+    async def shadow(ctx, action: str = "status", stage: str = "", key: str = "", value: str = ""):
+        """
+        シャドウモード: 候補の閾値で並行して判定し、検知率を比較する（処罰はしない）
+        #anti shadow [status|on|off|reset]
+        #anti shadow set <検知タイプ> <閾値名> <値> / #anti shadow unset <検知タイプ> [閾値名]
+        """
+        if not isAdmin(str(ctx.author.id), str(ctx.guild.id), config):
+            await ctx.send("管理者権限が必要です。")
+            return
+        from plugins.antiModule.pipeline import DetectionPipeline
+        from plugins.antiModule.shadow import ShadowMode
+
+        # シャドウ評価できる検知タイプ → 本番の閾値
+        detectors = {
+            name: detector.PARAMS
+            for name, detector in DetectionPipeline.STAGES
+            if ShadowMode.supports(detector)
+        }
+        shadow_config = await AntiCheatConfig.get_setting(ctx.guild, "shadow", {}) or {}
+        rules = dict(shadow_config.get("rules") or {})
+
+        if action in ("on", "off"):
+            await AntiCheatConfig.update_setting(ctx.guild, "shadow.enabled", action == "on")
+            await ctx.send(f"シャドウモードを{'有効' if action == 'on' else '無効'}にしました。")
+            return
+        if action == "reset":
+            ShadowMode.reset_stats(ctx.guild.id)
+            await ctx.send("シャドウモードの統計をリセットしました。")
+            return
+        if action in ("set", "unset"):
+            if stage not in detectors:
+                await ctx.send(f"❌ 検知タイプを指定してください。利用可能: {', '.join(detectors)}")
+                return
+            if action == "unset":
+                if key:
+                    (rules.get(stage) or {}).pop(key, None)
+                else:
+                    rules.pop(stage, None)
+            else:
+                if key not in detectors[stage]:
+                    await ctx.send(f"❌ 閾値名が不正です。利用可能: {', '.join(detectors[stage])}")
+                    return
+                try:
+                    number = float(value)
+                except ValueError:
+                    await ctx.send("❌ 値は数値で指定してください。")
+                    return
+                rules.setdefault(stage, {})[key] = int(number) if number.is_integer() else number
+            await AntiCheatConfig.update_setting(ctx.guild, "shadow.rules", rules)
+            ShadowMode.reset_stats(ctx.guild.id)
+            await ctx.send(f"シャドウモードの候補を更新しました（統計はリセットされます）: `{rules}`")
+            return
+        if action != "status":
+            await ctx.send("使用方法: #anti shadow [status|on|off|reset|set|unset]")
+            return
+
+        embed = discord.Embed(title="🧪 シャドウモード", color=0x9B59B6)
+        embed.add_field(
+            name="状態",
+            value=f"{'✅ 有効' if shadow_config.get('enabled') else '❌ 無効'}\n"
+            f"**候補**: `{rules or 'なし'}`",
+            inline=False,
+        )
+        stats = ShadowMode.get_stats(ctx.guild.id)
+        lines = []
+        shadow_ms = 0.0
+        for name, stat in stats.items():
+            shadow_ms += stat["total_ms"]
+            n = stat["evaluated"]
+            lines.append(
+                f"{DetectionTypeManager.get_display_name(name)}: 評価 {n} / "
+                f"本番 {stat['live_hits']} ({stat['live_rate']:.1%}) / 候補 {stat['shadow_hits']} ({stat['shadow_rate']:.1%})\n"
+                f"　本番のみ {stat['live_only']} / 候補のみ {stat['shadow_only']} / 平均 {stat['avg_ms'] * 1000:.1f}µs"
+            )
+        embed.add_field(name="比較", value="\n".join(lines) or "まだ記録がありません", inline=False)
+        total = DetectionPipeline.get_stats().get("total")
+        if total and total["calls"]:
+            total_ms = total["avg_ms"] * total["calls"]
+            embed.set_footer(text=f"シャドウ判定時間 {shadow_ms:.1f}ms（検知処理全体の {shadow_ms / total_ms:.1%}）")
+        await ctx.send(embed=embed)
+
     register_command(bot, anti)
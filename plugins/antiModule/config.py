@@ -1,6 +1,55 @@
 # AntiCheat統合設定管理
 import json
-from typing import Optional, Dict, Any
+import copy
+from types import MappingProxyType
+from typing import Optional, Dict, Any, FrozenSet, Mapping, NamedTuple, Tuple
+
+# 検知機能のキー → ビット（設定に現れた順に割り当てる）
+_DETECTION_BITS: Dict[str, int] = {}
+
+
+def _detection_bit(key: str) -> int:
+    bit = _DETECTION_BITS.get(key)
+    if bit is None:
+        bit = 1 << len(_DETECTION_BITS)
+        _DETECTION_BITS[key] = bit
+    return bit
+
+
+def _parse_id(value) -> Optional[int]:
+    """int または数字のみの文字列をIDとして解釈する"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+class CompiledAntiCheatConfig(NamedTuple):
+    """
+    メッセージ毎の判定用にコンパイルしたギルドのAntiCheat設定（変更不可）
+    設定の保存時に破棄され、次のアクセスで作り直される
+    """
+    enabled: bool
+    detection_mask: int                   # 有効な検知機能のビット集合
+    configured_detections: int            # 設定に存在する検知機能のビット集合（存在しないものは有効扱い）
+    whitelist_channels: FrozenSet[int]
+    bypass_role_id: Optional[int]
+    alert_channel_id: Optional[int]
+    flag_config: Mapping[str, Any]        # フラグシステム設定（デフォルトとマージ済み）
+    flag_weights: Mapping[str, int]
+    flag_actions: Tuple[Mapping[str, Any], ...]  # flag_countの降順
+    # シャドウ評価する検知ステージ → 上書きする閾値（シャドウモードが無効なら空）
+    shadow_rules: Mapping[str, Mapping[str, float]] = MappingProxyType({})
+
+    def is_detection_enabled(self, detection_type: str) -> bool:
+        bit = _DETECTION_BITS.get(detection_type)
+        if bit is None or not (self.configured_detections & bit):
+            return True
+        return bool(self.detection_mask & bit)
+
 
 class AntiCheatConfig:
     """
@@ -19,9 +68,20 @@ class AntiCheatConfig:
             "timebase_spam": True,
             "typing_bypass": True,
             "forward_spam": True,  
-        }
+        },
+        # シャドウモード: rulesの閾値で並行して判定し、結果を統計として記録するだけ（処罰はしない）
+        # 例: {"enabled": True, "rules": {"text": {"base_threshold": 0.7}, "timebase": {"var_threshold": 0.2}}}
+        "shadow": {
+            "enabled": False,
+            "rules": {},
+        },
     }
     
+    # コンパイル済み設定のキャッシュ {guild_id: CompiledAntiCheatConfig}
+    _compiled: Dict[int, CompiledAntiCheatConfig] = {}
+    # 保存のたびに増える世代（読み込み中に保存された古い設定をキャッシュしないため）
+    _generations: Dict[int, int] = {}
+    
     @staticmethod
     async def get_config(guild) -> Dict[str, Any]:
         """
@@ -31,15 +91,16 @@ class AntiCheatConfig:
             from . import GuildConfig
             config = await GuildConfig.load_guild_json(guild, "AntiCheat")
             if not config:
-                return AntiCheatConfig.DEFAULT_CONFIG.copy()
+                return copy.deepcopy(AntiCheatConfig.DEFAULT_CONFIG)
             
             # デフォルト設定とマージ（新しい設定項目の追加に対応）
-            merged_config = AntiCheatConfig.DEFAULT_CONFIG.copy()
-            AntiCheatConfig._deep_merge(merged_config, config)
+            # ネストした辞書を共有しないよう深いコピーにマージする（DEFAULT_CONFIGを書き換えないため）
+            merged_config = copy.deepcopy(AntiCheatConfig.DEFAULT_CONFIG)
+            AntiCheatConfig._deep_merge(merged_config, copy.deepcopy(config))
             return merged_config
         except Exception as e:
             print(f"[AntiCheat] Failed to load config: {e}")
-            return AntiCheatConfig.DEFAULT_CONFIG.copy()
+            return copy.deepcopy(AntiCheatConfig.DEFAULT_CONFIG)
     
     @staticmethod
     async def save_config(guild, config: Dict[str, Any]):
@@ -52,6 +113,85 @@ class AntiCheatConfig:
             print(f"[AntiCheat] Config saved for guild {guild.name}")
         except Exception as e:
             print(f"[AntiCheat] Failed to save config: {e}")
+        finally:
+            AntiCheatConfig.invalidate(guild)
+    
+    @staticmethod
+    def _guild_key(guild) -> int:
+        return guild.id if hasattr(guild, "id") else int(guild)
+    
+    @staticmethod
+    def invalidate(guild):
+        """コンパイル済み設定を破棄する（設定を保存したとき）"""
+        key = AntiCheatConfig._guild_key(guild)
+        AntiCheatConfig._generations[key] = AntiCheatConfig._generations.get(key, 0) + 1
+        AntiCheatConfig._compiled.pop(key, None)
+    
+    @staticmethod
+    async def get_compiled(guild) -> CompiledAntiCheatConfig:
+        """
+        コンパイル済みの設定を取得（キャッシュになければ読み込んでコンパイル）
+        メッセージ毎の判定はget_setting等ではなくこちらを使う
+        """
+        key = AntiCheatConfig._guild_key(guild)
+        compiled = AntiCheatConfig._compiled.get(key)
+        if compiled is not None:
+            return compiled
+        generation = AntiCheatConfig._generations.get(key, 0)
+        compiled = AntiCheatConfig.compile(await AntiCheatConfig.get_config(guild))
+        if AntiCheatConfig._generations.get(key, 0) == generation:
+            AntiCheatConfig._compiled[key] = compiled
+        return compiled
+    
+    @staticmethod
+    def compile(config: Dict[str, Any]) -> CompiledAntiCheatConfig:
+        """マージ済みの設定辞書を判定用の不変オブジェクトに変換する"""
+        from plugins.antiModule.flag_system import FlagSystem
+        
+        detection_mask = 0
+        configured = 0
+        for key, value in (config.get("detection_settings") or {}).items():
+            bit = _detection_bit(key)
+            configured |= bit
+            if value:
+                detection_mask |= bit
+        
+        whitelist = config.get("whitelist_channels")
+        if type(whitelist) is not list:
+            whitelist = []
+        
+        flag_config = copy.deepcopy(FlagSystem.DEFAULT_FLAG_CONFIG)
+        if isinstance(config.get("flag_system"), dict):
+            AntiCheatConfig._deep_merge(flag_config, copy.deepcopy(config["flag_system"]))
+        flag_weights = MappingProxyType(dict(flag_config.get("flag_weights") or {}))
+        actions = [a for a in flag_config.get("actions") or [] if isinstance(a, dict) and "flag_count" in a]
+        flag_actions = tuple(MappingProxyType(a) for a in sorted(actions, key=lambda a: a["flag_count"], reverse=True))
+        flag_config["flag_weights"] = flag_weights
+        flag_config["actions"] = flag_actions
+        
+        shadow_rules = {}
+        shadow = config.get("shadow")
+        if isinstance(shadow, dict) and shadow.get("enabled") and isinstance(shadow.get("rules"), dict):
+            for stage, params in shadow["rules"].items():
+                if not isinstance(params, dict):
+                    continue
+                shadow_rules[stage] = MappingProxyType({
+                    key: value for key, value in params.items()
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)
+                })
+        
+        return CompiledAntiCheatConfig(
+            enabled=bool(config.get("enabled", True)),
+            detection_mask=detection_mask,
+            configured_detections=configured,
+            whitelist_channels=frozenset(filter(None, (_parse_id(x) for x in whitelist))),
+            bypass_role_id=_parse_id(config.get("bypass_role")),
+            alert_channel_id=_parse_id(config.get("alert_channel")),
+            flag_config=MappingProxyType(flag_config),
+            flag_weights=flag_weights,
+            flag_actions=flag_actions,
+            shadow_rules=MappingProxyType(shadow_rules),
+        )
     
     @staticmethod
     async def update_setting(guild, key_path: str, value: Any):
@@ -114,13 +254,11 @@ class AntiCheatConfig:
         """
         AntiCheat機能が有効かチェック
         """
-        result = await AntiCheatConfig.get_setting(guild, "enabled", True)
-        return bool(result)
+        return (await AntiCheatConfig.get_compiled(guild)).enabled
     
     @staticmethod
     async def is_detection_enabled(guild, detection_type: str) -> bool:
         """
         特定の検知機能が有効かチェック
         """
-        result = await AntiCheatConfig.get_setting(guild, f"detection_settings.{detection_type}", True)
-        return bool(result)
+        return (await AntiCheatConfig.get_compiled(guild)).is_detection_enabled(detection_type)
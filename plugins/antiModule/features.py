@@ -0,0 +1,86 @@
+# メッセージ特徴量（検知パイプラインの各ステージで共有する）
+import re
+import time
+from typing import Any, NamedTuple, Optional, Tuple
+
+import discord
+
+UUID4_PATTERN = re.compile(r"[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-4[a-fA-F0-9]{3}-[89abAB][a-fA-F0-9]{3}-[a-fA-F0-9]{12}")
+DOT_PATTERN = re.compile(r"(?:[a-zA-Z0-9]\.){4,}[a-zA-Z0-9_]+")
+REPEATED_CHAR_PATTERN = re.compile(r"(.)\1{7,}")
+URL_ONLY_PATTERN = re.compile(r"^(https?://[\w\-._~:/?#\[\]@!$&'()*+,;=%]+)$")
+
+
+class MessageFeatures(NamedTuple):
+    """1メッセージから一度だけ計算する特徴量"""
+    guild_id: int
+    channel_id: int
+    author_id: int
+    content: str
+    length: int
+    symbol_ratio: float                 # 英数字以外の文字の割合
+    uuid_count: int
+    content_no_uuid: str                # UUIDを取り除いた本文
+    dot_count: int                      # "a.b.c.d.e" のようなドット区切りの数
+    has_repeated_char: bool             # 同じ文字（数字を含む）が8回以上連続
+    is_url_only: bool
+    mention_ids: Tuple[int, ...]        # ユーザーメンション
+    role_mention_ids: Tuple[int, ...]
+    mention_everyone: bool
+    has_mentions: bool
+    has_media: bool                     # 添付ファイルまたは画像埋め込み
+    is_forwarded: bool
+    now: int                            # 検知処理の時刻（秒）
+    created_at: int                     # メッセージの作成時刻（秒）
+    wall_time: float                    # time.time()（入力中イベントとの比較用）
+
+
+class Verdict(NamedTuple):
+    """ステージの判定結果"""
+    stage: str           # 検知タイプ（DetectionType）
+    score: float
+    action: str = "block"  # "block": タイムアウト等を実行 / "delete": メッセージ削除のみ
+    detail: Any = None     # ステージ固有の情報（apply時に使う）
+
+
+def _is_forwarded(message) -> bool:
+    # 返信と転送の区別: referenceがあり返信でなければ転送、または転送埋め込みがあれば転送
+    if getattr(message, "reference", None) is not None:
+        return getattr(message, "type", None) != getattr(discord.MessageType, "reply", None)
+    return any(getattr(e, "type", None) == "message_reference" for e in getattr(message, "embeds", []))
+
+
+def extract_features(message, now: Optional[int] = None) -> MessageFeatures:
+    """メッセージから特徴量を計算する"""
+    if now is None:
+        now = int(time.time())
+    content = getattr(message, "content", "") or ""
+    symbol_ratio = sum(1 for c in content if not c.isalnum()) / len(content) if content else 0.0
+    uuid_count = len(UUID4_PATTERN.findall(content))
+    mentions = getattr(message, "mentions", []) or []
+    role_mentions = getattr(message, "role_mentions", []) or []
+    mention_everyone = bool(getattr(message, "mention_everyone", False))
+    embeds = getattr(message, "embeds", []) or []
+    created_at = getattr(message, "created_at", None)
+    return MessageFeatures(
+        guild_id=message.guild.id,
+        channel_id=message.channel.id,
+        author_id=message.author.id,
+        content=content,
+        length=len(content),
+        symbol_ratio=symbol_ratio,
+        uuid_count=uuid_count,
+        content_no_uuid=UUID4_PATTERN.sub("", content) if uuid_count else content,
+        dot_count=len(DOT_PATTERN.findall(content)),
+        has_repeated_char=REPEATED_CHAR_PATTERN.search(content) is not None,
+        is_url_only=URL_ONLY_PATTERN.fullmatch(content.strip()) is not None,
+        mention_ids=tuple(m.id for m in mentions if isinstance(m, (discord.User, discord.Member))),
+        role_mention_ids=tuple(r.id for r in role_mentions),
+        mention_everyone=mention_everyone,
+        has_mentions=bool(mentions or role_mentions or mention_everyone),
+        has_media=bool(getattr(message, "attachments", None)) or any(getattr(e, "type", None) == "image" for e in embeds),
+        is_forwarded=_is_forwarded(message),
+        now=now,
+        created_at=int(created_at.timestamp()) if created_at is not None else now,
+        wall_time=time.time(),
+    )
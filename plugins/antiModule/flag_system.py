@@ -1,11 +1,74 @@
 # フラグシステム - ユーザーの違反に対してフラグを蓄積し、段階的なアクションを実行
 import json
-from typing import Dict, List, Optional, Union
+import copy
+import atexit
+import asyncio
+from bisect import bisect_left, insort
+from collections import deque
+from heapq import heapify, heappop, heappush
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 from datetime import datetime, timedelta
 import discord
 from discord.ext import commands
 from plugins.antiModule.config import AntiCheatConfig
-from DataBase import get_guild_data, set_guild_data, update_guild_data
+from plugins.antiModule.scheduler import moderation_scheduler
+from DataBase import get_path, patch, remove_path
+import aiodb
+
+
+class FlagLeaderboard:
+    """
+    ギルド毎のフラグ数ランキング（減衰後のフラグ数の多い順）
+    フラグの追加・変更時にそのユーザーだけ並べ直し、減衰の境界を過ぎたユーザーは参照時に並べ直す
+    """
+    __slots__ = ("period", "_ranked", "_keys", "_due", "_boundaries")
+
+    def __init__(self, period: float):
+        self.period = period                       # 1フラグ減衰するまでの秒数（作成時の設定）
+        self._ranked: List[Tuple[int, int]] = []   # (-フラグ数, user_id) の昇順 = フラグ数の多い順
+        self._keys: Dict[int, Tuple[int, int]] = {}
+        self._due: Dict[int, float] = {}           # user_id -> 次にフラグ数が減る時刻
+        self._boundaries: List[Tuple[float, int]] = []  # (次にフラグ数が減る時刻, user_id) のヒープ（古いものは_dueと照合して捨てる）
+
+    def __len__(self) -> int:
+        return len(self._ranked)
+
+    def update(self, user_id: int, record: Dict, flags: int, now: float):
+        """ユーザーの時刻nowでのフラグ数をflagsとして並べ直す（0以下なら外す）"""
+        self.remove(user_id)
+        if flags <= 0:
+            return
+        key = (-flags, user_id)
+        insort(self._ranked, key)
+        self._keys[user_id] = key
+        if self.period > 0:
+            steps = max(0, int((now - record["last_decay"]) // self.period))
+            due = record["last_decay"] + (steps + 1) * self.period
+            self._due[user_id] = due
+            heappush(self._boundaries, (due, user_id))
+            if len(self._boundaries) > 2 * len(self._due) + 64:
+                self._boundaries = [(due, uid) for uid, due in self._due.items()]
+                heapify(self._boundaries)
+
+    def remove(self, user_id: int):
+        key = self._keys.pop(user_id, None)
+        if key is not None:
+            del self._ranked[bisect_left(self._ranked, key)]
+        self._due.pop(user_id, None)
+
+    def top(self, limit: int, now: float, ledger: Dict[int, Dict], config) -> List[Tuple[int, int]]:
+        """上位limit人の [(user_id, フラグ数)]（減衰の境界を過ぎたユーザーだけ並べ直してから返す）"""
+        boundaries = self._boundaries
+        while boundaries and boundaries[0][0] <= now:
+            due, user_id = heappop(boundaries)
+            if self._due.get(user_id) != due:
+                continue
+            record = ledger.get(user_id)
+            if record is None:
+                self.remove(user_id)
+                continue
+            self.update(user_id, record, FlagSystem.effective_flags(record, now, config), now)
+        return [(user_id, -negative) for negative, user_id in self._ranked[:limit]]
 
 
 class FlagSystem:
@@ -29,24 +92,33 @@ class FlagSystem:
         "actions": []  
     }
     
-    # ユーザーのフラグデータ: {guild_id: {user_id: [{"flags": int, "last_decay": timestamp, "violations": []}]}}
-    _user_flags: Dict[int, Dict[int, List[Dict]]] = {}
+    # ユーザー毎のフラグ台帳: {guild_id: {user_id: {"flags": int, "last_decay": timestamp, "violations": deque}}}
+    # flagsはlast_decay時点のフラグ数（現在のフラグ数はeffective_flagsで求める）。violationsは直近MAX_VIOLATIONS件の違反のみ保持する
+    _user_flags: Dict[int, Dict[int, Dict]] = {}
+    # DBに書き戻していないユーザー {guild_id: {user_id, ...}}
+    _dirty: Dict[int, Set[int]] = {}
+    _flush_task: Optional[asyncio.Task] = None
+    # フラグ数ランキング {guild_id: FlagLeaderboard}（初めて参照されたギルドのみ。以降はフラグの変更毎に更新する）
+    _leaderboards: Dict[int, FlagLeaderboard] = {}
+
+    MAX_VIOLATIONS = 50      # ユーザー毎に保持する違反履歴の件数
+    FLUSH_DELAY = 3.0        # 変更からDBへ書き戻すまでの待ち時間（秒。この間の変更はまとめて書き込む）
     
     @classmethod
     async def get_flag_config(cls, guild) -> Dict:
-        """ギルドのフラグ設定を取得"""
+        """ギルドのフラグ設定を取得（変更して保存する用の複製。判定だけならAntiCheatConfig.get_compiledを使う）"""
         try:
             config = await AntiCheatConfig.get_setting(guild, "flag_system", cls.DEFAULT_FLAG_CONFIG)
             if not config:
-                return cls.DEFAULT_FLAG_CONFIG.copy()
+                return copy.deepcopy(cls.DEFAULT_FLAG_CONFIG)
             
             # デフォルト設定とマージ
-            merged_config = cls.DEFAULT_FLAG_CONFIG.copy()
-            cls._deep_merge(merged_config, config)
+            merged_config = copy.deepcopy(cls.DEFAULT_FLAG_CONFIG)
+            cls._deep_merge(merged_config, copy.deepcopy(config))
             return merged_config
         except Exception as e:
             print(f"[FlagSystem] Failed to load config: {e}")
-            return cls.DEFAULT_FLAG_CONFIG.copy()
+            return copy.deepcopy(cls.DEFAULT_FLAG_CONFIG)
     
     @classmethod
     async def save_flag_config(cls, guild, config: Dict):
@@ -67,49 +139,133 @@ class FlagSystem:
                 base_dict[key] = value
     
     @classmethod
-    def _load_user_flags_from_db(cls, guild_id):
-        """DBから該当ギルドのユーザーフラグ情報を読み込む"""
-        data = get_guild_data(guild_id)
-        return data.get("user_flags", {})
+    def _new_record(cls, now: float) -> Dict:
+        return {"flags": 0, "last_decay": now, "violations": deque(maxlen=cls.MAX_VIOLATIONS)}
+
+    @classmethod
+    def _record_from_db(cls, data) -> Dict:
+        """DB上のユーザーのデータを台帳のレコードに変換する（旧形式の違反のリストは合計して移行する）"""
+        record = cls._new_record(datetime.now().timestamp())
+        if isinstance(data, dict):
+            record["flags"] = int(data.get("flags", 0))
+            record["last_decay"] = data.get("last_decay", record["last_decay"])
+            record["violations"].extend(dict(v) for v in data.get("violations", ()))
+        elif isinstance(data, list):
+            # 旧形式: [{"type", "timestamp", "flags_added", "channel_id", "message_id", "violations"}, ...]
+            entries = [f for f in data if isinstance(f, dict)]
+            record["flags"] = sum(int(f.get("flags_added", 0)) for f in entries)
+            violations = [
+                {key: f.get(key) for key in ("type", "timestamp", "flags_added", "channel_id", "message_id")}
+                for f in entries if "type" in f and "timestamp" in f
+            ]
+            record["violations"].extend(violations)
+            timestamps = [f.get("timestamp") or f.get("last_decay") for f in entries]
+            timestamps = [t for t in timestamps if t]
+            if timestamps:
+                record["last_decay"] = max(timestamps)
+        return record
+
+    @staticmethod
+    def _record_to_db(record: Dict) -> Dict:
+        """DBに書き込む形式（dequeはリストにする）"""
+        return {"flags": record["flags"], "last_decay": record["last_decay"], "violations": list(record["violations"])}
+
+    @classmethod
+    def _load_user_flags_from_db(cls, guild_id) -> Dict[int, Dict]:
+        """DBから該当ギルドのユーザーフラグ情報を読み込み、台帳のレコードに変換する"""
+        user_flags = get_path(("guild", guild_id, "user_flags"), {}) or {}
+        # メモリ上ではユーザーIDをintキーで扱う（DB上のキーは文字列）
+        return {
+            int(uid) if str(uid).isdigit() else uid: cls._record_from_db(data)
+            for uid, data in user_flags.items()
+        }
 
     @classmethod
-    def _save_user_flags_to_db(cls, guild_id, user_flags):
-        """DBに該当ギルドのユーザーフラグ情報を書き込む（既存データとマージ）"""
-        data = get_guild_data(guild_id)
-        existing_flags = data.get("user_flags", {})
-        # ユーザーごとにマージ
-        merged_flags = existing_flags.copy()
-        for user_id, new_flag_list in user_flags.items():
-            if user_id in merged_flags and isinstance(merged_flags[user_id], list) and isinstance(new_flag_list, list):
-                # 各フラグ情報をマージ
-                for new_flag in new_flag_list:
-                    # violationsリストは結合し重複を除去
-                    old_flag = next((f for f in merged_flags[user_id] if f.get("type") == new_flag.get("type")), None)
-                    if old_flag:
-                        old_violations = old_flag.get("violations", [])
-                        new_violations = new_flag.get("violations", [])
-                        # message_idで重複除去
-                        seen = set()
-                        merged_violations = []
-                        for v in old_violations + new_violations:
-                            mid = v.get("message_id")
-                            if mid is None or mid not in seen:
-                                merged_violations.append(v)
-                                if mid is not None:
-                                    seen.add(mid)
-                        old_flag["violations"] = merged_violations
-                    else:
-                        merged_flags[user_id].append(new_flag)
+    def _ensure_user_flags_loaded(cls, guild_id) -> Dict[int, Dict]:
+        """DBからメモリにロード（初回のみ）して、ギルドの台帳を返す"""
+        ledger = cls._user_flags.get(guild_id)
+        if ledger is None:
+            ledger = cls._user_flags[guild_id] = cls._load_user_flags_from_db(guild_id)
+        return ledger
+
+    # --- 書き戻し ---
+    @staticmethod
+    def _write_user_flags(guild_id, records: Dict[int, Optional[Dict]]):
+        """変更のあったユーザー分だけDBに書き込む（Noneは削除）。書き込みスレッドで実行される"""
+        for user_id, record in records.items():
+            path = ("guild", guild_id, "user_flags", str(user_id))
+            if record is None:
+                remove_path(path)
             else:
-                merged_flags[user_id] = new_flag_list
-        data["user_flags"] = merged_flags
-        set_guild_data(guild_id, data)
+                patch(path, record)
+
+    @classmethod
+    def _take_dirty(cls) -> Dict[int, Dict[int, Optional[Dict]]]:
+        """書き戻し待ちのユーザーのレコードを書き込む形式で取り出す"""
+        dirty, cls._dirty = cls._dirty, {}
+        snapshot = {}
+        for guild_id, user_ids in dirty.items():
+            ledger = cls._user_flags.get(guild_id, {})
+            snapshot[guild_id] = {
+                user_id: cls._record_to_db(ledger[user_id]) if user_id in ledger else None
+                for user_id in user_ids
+            }
+        return snapshot
+
+    @classmethod
+    def _mark_dirty(cls, guild_id: int, user_id: int):
+        """ユーザーのレコードを書き戻し待ちにし、まだなら書き戻しを予約する"""
+        cls._dirty.setdefault(guild_id, set()).add(user_id)
+        cls._schedule_flush()
+
+    @classmethod
+    def _restore_dirty(cls, guild_id: int, user_ids: Iterable[int]):
+        """書き込みに失敗したユーザーを書き戻し待ちに戻す（次の書き戻しで台帳の最新の値を書き込み直す）"""
+        cls._dirty.setdefault(guild_id, set()).update(user_ids)
+
+    @classmethod
+    def _schedule_flush(cls):
+        """書き戻しがまだ予約されていなければ予約する"""
+        if cls._flush_task is not None and not cls._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # イベントループ外（スクリプト等）ではその場で書き込む
+            cls._flush_sync()
+            return
+        cls._flush_task = loop.create_task(cls._delayed_flush())
+
+    @classmethod
+    async def _delayed_flush(cls):
+        await asyncio.sleep(cls.FLUSH_DELAY)
+        # 書き込みを待っている間の変更は、このタスクに含めず次の書き戻しとして予約させる
+        cls._flush_task = None
+        await cls.flush()
 
     @classmethod
-    def _ensure_user_flags_loaded(cls, guild_id):
-        """DBからメモリにロード（初回のみ）"""
-        if guild_id not in cls._user_flags:
-            cls._user_flags[guild_id] = cls._load_user_flags_from_db(guild_id)
+    async def flush(cls):
+        """書き戻し待ちのフラグ情報をDBに書き込む"""
+        failed = False
+        for guild_id, records in cls._take_dirty().items():
+            try:
+                await aiodb.run(cls._write_user_flags, guild_id, records)
+            except Exception as e:
+                print(f"[FlagSystem] Failed to save user flags for guild {guild_id}: {e}")
+                cls._restore_dirty(guild_id, records)
+                failed = True
+        if failed:
+            cls._schedule_flush()
+
+    @classmethod
+    def _flush_sync(cls):
+        """書き戻し待ちのフラグ情報を同期的に書き込む（終了時用）"""
+        for guild_id, records in cls._take_dirty().items():
+            try:
+                cls._write_user_flags(guild_id, records)
+            except Exception as e:
+                print(f"[FlagSystem] Failed to save user flags for guild {guild_id}: {e}")
+                cls._restore_dirty(guild_id, records)
 
     @classmethod
     async def add_flag(cls, message: discord.Message, alert_type: str) -> bool:
@@ -126,77 +282,80 @@ class FlagSystem:
         if not message.guild or message.author.bot:
             return False
         
-        config = await cls.get_flag_config(message.guild)
+        config = (await AntiCheatConfig.get_compiled(message.guild)).flag_config
         if not config.get("enabled", True):
             return False
         
         guild_id = message.guild.id
         user_id = message.author.id
-        cls._ensure_user_flags_loaded(guild_id)
-        
-        # ギルドデータを初期化
-        if guild_id not in cls._user_flags:
-            cls._user_flags[guild_id] = {}
-        
-        # ユーザーデータを初期化
-        if user_id not in cls._user_flags[guild_id]:
-            cls._user_flags[guild_id][user_id] = []
-        
-        user_flags = cls._user_flags[guild_id][user_id]
+        ledger = cls._ensure_user_flags_loaded(guild_id)
+        now = datetime.now().timestamp()
+        record = ledger.get(user_id)
+        if record is None:
+            record = ledger[user_id] = cls._new_record(now)
         
-        # フラグの自動減衰処理
-        for user_data in user_flags:
-            await cls._apply_flag_decay(user_data, config)
+        # ここまでの減衰を反映してから加算する
+        cls._fold_decay(record, now, config)
         
-        # フラグを追加
+        # フラグを追加（合計は台帳に持っているので履歴を数え直さない）
         flag_weight = config["flag_weights"].get(alert_type, 1)
-        new_flag = {
+        record["flags"] += flag_weight
+        record["violations"].append({
             "type": alert_type,
-            "timestamp": datetime.now().timestamp(),
+            "timestamp": now,
             "flags_added": flag_weight,
             "channel_id": message.channel.id,
             "message_id": message.id,
-            "violations": []  # 新しいフラグには空のviolationsリストを追加
-        }
-        user_flags.append(new_flag)
+        })
         
-        # DBに保存
-        cls._save_user_flags_to_db(guild_id, cls._user_flags[guild_id])
-        print(f"[FlagSystem] User {user_id} in guild {guild_id}: +{flag_weight} flags ({alert_type}), total: {sum(f['flags_added'] for f in user_flags)}")
+        # DBへの保存は少し待ってまとめて行う
+        cls._mark_dirty(guild_id, user_id)
+        cls._update_leaderboard(guild_id, user_id, record, now)
+        print(f"[FlagSystem] User {user_id} in guild {guild_id}: +{flag_weight} flags ({alert_type}), total: {record['flags']}")
         
         # アクションを実行
-        return await cls._execute_action(message, sum(f['flags_added'] for f in user_flags), config)
+        return await cls._execute_action(message, record["flags"], config)
     
+    @staticmethod
+    def _decay_period(config) -> float:
+        """1フラグ減衰するまでの秒数（0以下なら減衰しない）"""
+        return config.get("decay_hours", 24) * 3600
+
     @classmethod
-    async def _apply_flag_decay(cls, user_data: Dict, config: Dict):
-        """フラグの自動減衰を適用"""
-        now = datetime.now().timestamp()
-        last_decay = user_data["last_decay"]
-        decay_hours = config.get("decay_hours", 24)
-        
-        hours_passed = (now - last_decay) / 3600
-        if hours_passed >= decay_hours:
-            # 1日経過するごとに1フラグ減少
-            decay_amount = int(hours_passed / decay_hours)
-            user_data["flags"] = max(0, user_data["flags"] - decay_amount)
-            user_data["last_decay"] = now
-            
-            if decay_amount > 0:
-                print(f"[FlagSystem] Applied flag decay: -{decay_amount} flags")
+    def effective_flags(cls, record: Dict, now: float, config) -> int:
+        """
+        時刻nowでのフラグ数（減衰後）。レコードは変更しない
+        last_decay時点のflagsから、decay_hours経過するごとに1フラグ減る（0未満にはならない）
+        """
+        flags = record["flags"]
+        period = cls._decay_period(config)
+        if flags <= 0 or period <= 0:
+            return max(0, flags)
+        steps = int((now - record["last_decay"]) // period)
+        return max(0, flags - max(0, steps))
+
+    @classmethod
+    def _fold_decay(cls, record: Dict, now: float, config):
+        """書き込みの前に、nowまでの減衰をレコードに反映する（次の減衰までの経過時間は引き継ぐ）"""
+        period = cls._decay_period(config)
+        steps = int((now - record["last_decay"]) // period) if period > 0 else 0
+        if steps <= 0:
+            return
+        if steps >= record["flags"]:
+            record["flags"] = 0
+            record["last_decay"] = now
+        else:
+            record["flags"] -= steps
+            record["last_decay"] += steps * period
     
     @classmethod
-    async def _execute_action(cls, message: discord.Message, flag_count: int, config: Dict) -> bool:
-        """フラグ数に応じてアクションを実行"""
-        actions = config.get("actions", [])
-        
-        # フラグ数の多い順にソートして、該当するアクションを見つける
-        applicable_actions = [action for action in actions if flag_count >= action["flag_count"]]
-        if not applicable_actions:
+    async def _execute_action(cls, message: discord.Message, flag_count: int, config) -> bool:
+        """フラグ数に応じてアクションを実行（config["actions"]はコンパイル時にフラグ数の多い順にソート済み）"""
+        # 該当する中で最も高いフラグ数のアクションを実行
+        action = next((a for a in config.get("actions", ()) if flag_count >= a["flag_count"]), None)
+        if action is None:
             return False
         
-        # 最も高いフラグ数のアクションを実行
-        action = max(applicable_actions, key=lambda x: x["flag_count"])
-        
         try:
             # message.authorがMemberかどうかを確認
             if not isinstance(message.author, discord.Member):
@@ -211,13 +370,10 @@ class FlagSystem:
             if action_type == "timeout":
                 duration = action.get("duration", 300)
                 until = discord.utils.utcnow() + timedelta(seconds=duration)
-                await member.timeout(until, reason=f"フラグシステム: {flag_count}フラグ")
+                await moderation_scheduler.timeout(member, until, f"フラグシステム: {flag_count}フラグ")
                 
-                # DMで通知
-                try:
-                    await member.send(f"🚨 **{guild_name}**\n{action_message}")
-                except:
-                    pass
+                # DMで通知（通知はスケジューラーに任せて結果は待たない）
+                moderation_scheduler.notify(member.id, lambda: member.send(f"🚨 **{guild_name}**\n{action_message}"))
                 
                 # チャンネルに通知
                 embed = discord.Embed(
@@ -225,16 +381,15 @@ class FlagSystem:
                     description=f"{member.mention} が {flag_count} フラグに達したため、{duration}秒間のタイムアウトが実行されました。",
                     color=0xff6b00
                 )
-                await message.channel.send(embed=embed)
+                moderation_scheduler.notify(message.channel.id, lambda: message.channel.send(embed=embed))
                 
             elif action_type == "kick":
-                await member.kick(reason=f"フラグシステム: {flag_count}フラグ")
+                await moderation_scheduler.moderate(
+                    member, "kick", lambda: member.kick(reason=f"フラグシステム: {flag_count}フラグ")
+                )
                 
-                # DMで通知
-                try:
-                    await member.send(f"🚨 **{guild_name}**\n{action_message}")
-                except:
-                    pass
+                # DMで通知（通知はスケジューラーに任せて結果は待たない）
+                moderation_scheduler.notify(member.id, lambda: member.send(f"🚨 **{guild_name}**\n{action_message}"))
                 
                 # チャンネルに通知
                 embed = discord.Embed(
@@ -242,16 +397,15 @@ class FlagSystem:
                     description=f"{member.mention} が {flag_count} フラグに達したため、サーバーからキックされました。",
                     color=0xff3333
                 )
-                await message.channel.send(embed=embed)
+                moderation_scheduler.notify(message.channel.id, lambda: message.channel.send(embed=embed))
                 
             elif action_type == "ban":
-                await member.ban(reason=f"フラグシステム: {flag_count}フラグ", delete_message_days=1)
+                await moderation_scheduler.moderate(
+                    member, "ban", lambda: member.ban(reason=f"フラグシステム: {flag_count}フラグ", delete_message_days=1)
+                )
                 
                 # DMで通知（BANの場合は送信できない可能性が高い）
-                try:
-                    await member.send(f"🚨 **{guild_name}**\n{action_message}")
-                except:
-                    pass
+                moderation_scheduler.notify(member.id, lambda: member.send(f"🚨 **{guild_name}**\n{action_message}"))
                 
                 # チャンネルに通知
                 embed = discord.Embed(
@@ -259,7 +413,7 @@ class FlagSystem:
                     description=f"{member.mention} が {flag_count} フラグに達したため、サーバーからBANされました。",
                     color=0x8b0000
                 )
-                await message.channel.send(embed=embed)
+                moderation_scheduler.notify(message.channel.id, lambda: message.channel.send(embed=embed))
             
             print(f"[FlagSystem] Executed {action_type} for user {member.id} with {flag_count} flags")
             return True
@@ -271,63 +425,75 @@ class FlagSystem:
     
     @classmethod
     async def get_user_flags(cls, guild: discord.Guild, user_id: int) -> Dict:
-        """ユーザーのフラグ情報を取得"""
-        guild_id = guild.id
-        cls._ensure_user_flags_loaded(guild_id)
-        if guild_id not in cls._user_flags or user_id not in cls._user_flags[guild_id]:
+        """ユーザーのフラグ情報を取得（減衰は読み込み時に計算し、台帳もDBも変更しない）"""
+        record = cls._ensure_user_flags_loaded(guild.id).get(user_id)
+        if record is None:
             return {"flags": 0, "violations": []}
         
-        user_flags = cls._user_flags[guild_id][user_id]
-        config = await cls.get_flag_config(guild)
-        
-        # 減衰を適用
-        for user_data in user_flags:
-            await cls._apply_flag_decay(user_data, config)
-        # DBに保存（減衰反映）
-        cls._save_user_flags_to_db(guild_id, cls._user_flags[guild_id])
-        
+        config = (await AntiCheatConfig.get_compiled(guild)).flag_config
         return {
-            "flags": sum(f["flags_added"] for f in user_flags),
-            "violations": [v for f in user_flags for v in f["violations"]][-10:]  # 最新10件のみ
+            "flags": cls.effective_flags(record, datetime.now().timestamp(), config),
+            "violations": list(record["violations"])[-10:]  # 最新10件のみ
         }
     
     @classmethod
     async def reset_user_flags(cls, guild: discord.Guild, user_id: int) -> bool:
         """ユーザーのフラグをリセット"""
-        guild_id = guild.id
-        cls._ensure_user_flags_loaded(guild_id)
-        if guild_id in cls._user_flags and user_id in cls._user_flags[guild_id]:
-            cls._user_flags[guild_id][user_id] = []
-            cls._save_user_flags_to_db(guild_id, cls._user_flags[guild_id])
-            return True
-        return False
+        ledger = cls._ensure_user_flags_loaded(guild.id)
+        if user_id not in ledger:
+            return False
+        del ledger[user_id]
+        cls._mark_dirty(guild.id, user_id)
+        leaderboard = cls._leaderboards.get(guild.id)
+        if leaderboard is not None:
+            leaderboard.remove(user_id)
+        return True
+    
+    @classmethod
+    async def set_user_flags(cls, guild: discord.Guild, user_id: int, flags: int):
+        """ユーザーのフラグ数を直接設定する（違反履歴はそのまま。0以下ならリセット）"""
+        if flags <= 0:
+            await cls.reset_user_flags(guild, user_id)
+            return
+        ledger = cls._ensure_user_flags_loaded(guild.id)
+        now = datetime.now().timestamp()
+        record = ledger.get(user_id)
+        if record is None:
+            record = ledger[user_id] = cls._new_record(now)
+        record["flags"] = flags
+        record["last_decay"] = now
+        cls._mark_dirty(guild.id, user_id)
+        cls._update_leaderboard(guild.id, user_id, record, now)
     
+    @classmethod
+    def _update_leaderboard(cls, guild_id: int, user_id: int, record: Dict, now: float):
+        """書き込み直後（減衰を反映済み）のレコードでランキングを更新する"""
+        leaderboard = cls._leaderboards.get(guild_id)
+        if leaderboard is not None:
+            leaderboard.update(user_id, record, record["flags"], now)
+
+    @classmethod
+    def _get_leaderboard(cls, guild_id: int, ledger: Dict[int, Dict], now: float, config) -> FlagLeaderboard:
+        """ギルドのランキング（未作成か減衰時間の設定が変わった場合は台帳から作り直す）"""
+        period = cls._decay_period(config)
+        leaderboard = cls._leaderboards.get(guild_id)
+        if leaderboard is None or leaderboard.period != period:
+            leaderboard = cls._leaderboards[guild_id] = FlagLeaderboard(period)
+            for user_id, record in ledger.items():
+                leaderboard.update(user_id, record, cls.effective_flags(record, now, config), now)
+        return leaderboard
+
     @classmethod
     async def get_top_flagged_users(cls, guild: discord.Guild, limit: int = 10) -> List[Dict]:
-        """フラグの多いユーザー上位を取得"""
-        guild_id = guild.id
-        cls._ensure_user_flags_loaded(guild_id)
-        if guild_id not in cls._user_flags:
-            return []
-        
-        config = await cls.get_flag_config(guild)
-        users_with_flags = []
-        
-        for user_id, user_flags in cls._user_flags[guild_id].items():
-            # 減衰を適用
-            for user_data in user_flags:
-                await cls._apply_flag_decay(user_data, config)
-            
-            total_flags = sum(f["flags_added"] for f in user_flags)
-            if total_flags > 0:
-                users_with_flags.append({
-                    "user_id": user_id,
-                    "flags": total_flags,
-                    "violations": sum(len(f["violations"]) for f in user_flags)
-                })
-        
-        # DBに保存（減衰反映）
-        cls._save_user_flags_to_db(guild_id, cls._user_flags[guild_id])
-        # フラグ数でソート
-        users_with_flags.sort(key=lambda x: x["flags"], reverse=True)
-        return users_with_flags[:limit]
+        """フラグの多いユーザー上位を取得（ランキングから上位limit人だけ読む）"""
+        ledger = cls._ensure_user_flags_loaded(guild.id)
+        config = (await AntiCheatConfig.get_compiled(guild)).flag_config
+        now = datetime.now().timestamp()
+        leaderboard = cls._get_leaderboard(guild.id, ledger, now, config)
+        return [
+            {"user_id": user_id, "flags": flags, "violations": len(ledger[user_id]["violations"])}
+            for user_id, flags in leaderboard.top(limit, now, ledger, config)
+        ]
+
+# 終了時に書き戻し待ちのフラグ情報を書き込む（DataBaseの終了時フラッシュより先に実行される）
+atexit.register(FlagSystem._flush_sync)
@@ -0,0 +1,112 @@
+# チャンネル毎の直近メッセージのキャッシュ
+# 受信したメッセージのID・投稿者・時刻をチャンネル毎のリングバッファに記録し、
+# 荒らしのメッセージ削除対象を channel.history を取得せずに求める
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CHANNEL_CAPACITY = 500    # チャンネル毎に保持するメッセージ数
+MAX_CHANNELS = 5000       # 保持するチャンネル数（超えたら最も長く使われていないものから捨てる）
+
+
+class ChannelRing:
+    """1チャンネル分のリングバッファ（全体の順序と投稿者毎の索引）"""
+    __slots__ = ("entries", "by_author", "covered_from", "capacity")
+
+    def __init__(self, capacity: int, now: float):
+        self.capacity = capacity
+        self.entries = deque()   # (message_id, author_id, created_ts)（古い順）
+        self.by_author: Dict[int, deque] = {}  # author_id -> deque[(message_id, created_ts)]（古い順）
+        # この時刻以降のメッセージは漏れなく記録されている（記録開始時刻・追い出した最新の時刻）
+        self.covered_from = now
+
+    def add(self, message_id: int, author_id: int, created_ts: float):
+        if len(self.entries) >= self.capacity:
+            old_id, old_author, old_ts = self.entries.popleft()
+            # 投稿者毎の索引でも同じメッセージが先頭にある
+            ids = self.by_author.get(old_author)
+            if ids and ids[0][0] == old_id:
+                ids.popleft()
+                if not ids:
+                    del self.by_author[old_author]
+            self.covered_from = max(self.covered_from, old_ts)
+        self.entries.append((message_id, author_id, created_ts))
+        self.by_author.setdefault(author_id, deque()).append((message_id, created_ts))
+
+    def recent(self, author_id: int, since: float) -> List[int]:
+        """投稿者のsince以降のメッセージID（新しい順）"""
+        result = []
+        for message_id, created_ts in reversed(self.by_author.get(author_id, ())):
+            if created_ts < since:
+                break
+            result.append(message_id)
+        return result
+
+    def forget(self, author_id: int, message_ids: Iterable[int]):
+        """削除済みのメッセージを投稿者の索引から外す（全体のリングからは追い出し時に消える）"""
+        ids = self.by_author.get(author_id)
+        if not ids:
+            return
+        targets = set(message_ids)
+        remaining = deque(entry for entry in ids if entry[0] not in targets)
+        if remaining:
+            self.by_author[author_id] = remaining
+        else:
+            del self.by_author[author_id]
+
+
+class RecentMessageCache:
+    def __init__(self, capacity: int = CHANNEL_CAPACITY, max_channels: int = MAX_CHANNELS):
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self._channels: "OrderedDict[int, ChannelRing]" = OrderedDict()
+        self.stats = {"recorded": 0, "hits": 0, "partial": 0, "misses": 0, "evicted_channels": 0}
+
+    def record(self, message, now: Optional[float] = None):
+        """受信したメッセージを記録する"""
+        channel_id = message.channel.id
+        created = getattr(message, "created_at", None)
+        created_ts = created.timestamp() if created is not None else (time.time() if now is None else now)
+        ring = self._channels.get(channel_id)
+        if ring is None:
+            ring = self._channels[channel_id] = ChannelRing(self.capacity, created_ts)
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+                self.stats["evicted_channels"] += 1
+        else:
+            self._channels.move_to_end(channel_id)
+        ring.add(message.id, message.author.id, created_ts)
+        self.stats["recorded"] += 1
+
+    def lookup(self, channel_id: int, user_ids: Iterable[int], window_sec: float,
+               now: Optional[float] = None) -> Tuple[Dict[int, List[int]], Optional[float]]:
+        """
+        各ユーザーの直近window_sec秒のメッセージID {user_id: [message_id, ...]} と、
+        キャッシュが記録していない期間の終わりの時刻（期間全体を記録していればNone）を返す
+        起動直後・リングが溢れた場合はキャッシュにある分だけを返すので、呼び出し側はそれより前の期間だけ履歴から補う
+        """
+        now = time.time() if now is None else now
+        since = now - window_sec
+        ring = self._channels.get(channel_id)
+        if ring is None:
+            self.stats["misses"] += 1
+            return {}, now
+        targets = {user_id: ring.recent(user_id, since) for user_id in user_ids}
+        if ring.covered_from >= since:
+            self.stats["partial"] += 1
+            return targets, ring.covered_from
+        self.stats["hits"] += 1
+        return targets, None
+
+    def forget(self, channel_id: int, author_id: int, message_ids: Iterable[int]):
+        ring = self._channels.get(channel_id)
+        if ring is not None:
+            ring.forget(author_id, message_ids)
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, channels=len(self._channels),
+                    messages=sum(len(ring.entries) for ring in self._channels.values()))
+
+
+# 共有のキャッシュ
+recent_messages = RecentMessageCache()
@@ -1,6 +1,153 @@
+import time
 import discord
 import asyncio
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional
 from plugins.antiModule.types import DetectionTypeManager, DetectionType
+from plugins.antiModule.scheduler import moderation_scheduler
+
+DIGEST_WINDOW = 5.0       # まとめる期間（秒）。最初にバッファしたアラートからこの時間後にまとめて送る
+QUIET_PERIOD = 10.0       # 最後の送信からこの時間アラートがなければ、次のアラートはすぐに送る
+MAX_BUFFERED = 200        # ギルド毎にバッファするアラートの上限（超えた分は件数だけ数える）
+MAX_LISTED = 20           # まとめのEmbedに列挙するユーザー・チャンネルの上限
+
+
+class AlertEntry(NamedTuple):
+    alert_type: str
+    user_id: int
+    user_mention: str
+    channel_id: int
+    channel_mention: str
+    deleted_count: int
+
+
+class AlertDigest:
+    """
+    ギルド毎のアラートのまとめ
+    静かな状態での最初のアラートはすぐ送り、続くアラートはDIGEST_WINDOWの間バッファして1つのEmbedにまとめて送る
+    （荒らし中にアラートのEmbedがslowmode・タイムアウト等と同じレート制限を取り合わないようにする）
+    """
+
+    def __init__(self, window: float = DIGEST_WINDOW, quiet_period: float = QUIET_PERIOD,
+                 max_buffered: int = MAX_BUFFERED):
+        self.window = window
+        self.quiet_period = quiet_period
+        self.max_buffered = max_buffered
+        self._last_sent: Dict[int, float] = {}          # guild_id -> 最後にアラートを送った時刻
+        self._buffers: Dict[int, List[AlertEntry]] = {}  # guild_id -> バッファ中のアラート
+        self._channels: Dict[int, Any] = {}              # guild_id -> 送信先のチャンネル
+        self._dropped: Dict[int, int] = {}               # guild_id -> バッファが満杯で捨てた件数
+        self._tasks = set()
+        # immediate: すぐ送った数 / digests: まとめて送ったEmbedの数 / merged: まとめに含めたアラートの数
+        # dropped: バッファが満杯で捨てた数 / failed: 送信に失敗した数
+        self.stats = {"received": 0, "immediate": 0, "digests": 0, "merged": 0, "dropped": 0, "failed": 0}
+
+    def should_buffer(self, guild_id: int) -> bool:
+        """バッファ中、または直前にアラートを送ったばかりならTrue"""
+        if guild_id in self._buffers:
+            return True
+        last_sent = self._last_sent.get(guild_id)
+        return last_sent is not None and time.monotonic() - last_sent < self.quiet_period
+
+    def mark_sent(self, guild_id: int) -> Optional[float]:
+        """
+        アラートをすぐ送ることを記録し、直前の送信時刻を返す（送信前に呼ぶ。送信中に来たアラートはバッファされる）
+        送信に失敗した場合は戻り値をunmark_sentに渡して元に戻す
+        """
+        self.stats["received"] += 1
+        self.stats["immediate"] += 1
+        previous = self._last_sent.get(guild_id)
+        self._last_sent[guild_id] = time.monotonic()
+        return previous
+
+    def unmark_sent(self, guild_id: int, previous: Optional[float]):
+        """mark_sentを取り消す（送信に失敗した場合）"""
+        self.stats["immediate"] -= 1
+        self.stats["failed"] += 1
+        if previous is None:
+            self._last_sent.pop(guild_id, None)
+        else:
+            self._last_sent[guild_id] = previous
+
+    def add(self, guild_id: int, channel, entry: AlertEntry):
+        """アラートをバッファに入れる（バッファの最初のアラートならDIGEST_WINDOW後の送信を予約する）"""
+        self.stats["received"] += 1
+        self._channels[guild_id] = channel
+        buffer = self._buffers.get(guild_id)
+        if buffer is None:
+            buffer = self._buffers[guild_id] = []
+            task = asyncio.get_running_loop().create_task(self._flush_later(guild_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if len(buffer) >= self.max_buffered:
+            self._dropped[guild_id] = self._dropped.get(guild_id, 0) + 1
+            self.stats["dropped"] += 1
+            return
+        buffer.append(entry)
+
+    async def _flush_later(self, guild_id: int):
+        await asyncio.sleep(self.window)
+        entries = self._buffers.pop(guild_id, [])
+        dropped = self._dropped.pop(guild_id, 0)
+        channel = self._channels.pop(guild_id, None)
+        if not entries or channel is None:
+            return
+        self._last_sent[guild_id] = time.monotonic()
+        embed = self.build_embed(entries, dropped)
+        try:
+            await moderation_scheduler.notify(channel.id, lambda: channel.send(embed=embed))
+            self.stats["digests"] += 1
+            self.stats["merged"] += len(entries)
+            print(f"[miniAnti] Alert digest sent to #{channel.name}: {len(entries)} alerts, dropped={dropped}")
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"[miniAnti] Failed to send alert digest: {e}")
+
+    def build_embed(self, entries: List[AlertEntry], dropped: int = 0) -> discord.Embed:
+        """バッファしたアラートをまとめたEmbed（ユーザー・検知タイプ・削除件数・チャンネル）"""
+        types = Counter(entry.alert_type for entry in entries)
+        main_type = types.most_common(1)[0][0]
+        embed = discord.Embed(
+            title=f"🚨 アラートまとめ（{len(entries) + dropped}件）",
+            description=f"直近{self.window:g}秒間の検知をまとめて表示しています",
+            color=DetectionTypeManager.get_info(main_type).color,
+            timestamp=discord.utils.utcnow()
+        )
+
+        users = list(dict.fromkeys(entry.user_mention for entry in entries))
+        embed.add_field(name=f"ユーザー（{len(users)}人）", value=self._listing(users), inline=False)
+
+        type_lines = [
+            f"{DetectionTypeManager.get_display_name(alert_type)}: {count}件"
+            for alert_type, count in types.most_common()
+        ]
+        embed.add_field(name="検知タイプ", value=self._listing(type_lines), inline=True)
+
+        deleted = sum(entry.deleted_count for entry in entries)
+        embed.add_field(name="削除されたメッセージ数", value=f"{deleted}件", inline=True)
+
+        channels = list(dict.fromkeys(entry.channel_mention for entry in entries))
+        embed.add_field(name="チャンネル", value=self._listing(channels), inline=False)
+
+        if dropped:
+            embed.add_field(name="省略", value=f"バッファ上限のため{dropped}件の詳細を省略しました", inline=False)
+        return embed
+
+    @staticmethod
+    def _listing(items: List[str], separator: str = "\n") -> str:
+        """Embedのフィールドに収まるよう先頭MAX_LISTED件まで並べる"""
+        text = separator.join(items[:MAX_LISTED])
+        if len(items) > MAX_LISTED:
+            text += f"{separator}…他{len(items) - MAX_LISTED}件"
+        return text[:1024]
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, buffered=sum(len(buffer) for buffer in self._buffers.values()))
+
+
+# 共有のまとめ
+alert_digest = AlertDigest()
+
 
 class Notifier:
     def __init__(self, message):
@@ -15,7 +162,7 @@ class Notifier:
             from .config import AntiCheatConfig
             
             # Alert通知チャンネル設定を取得
-            alert_channel_id = await AntiCheatConfig.get_setting(self.message.guild, "alert_channel")
+            alert_channel_id = (await AntiCheatConfig.get_compiled(self.message.guild)).alert_channel_id
             if not alert_channel_id:
                 # 設定されていない場合は何もしない
                 return
@@ -26,6 +173,24 @@ class Notifier:
                 # チャンネルが見つからない場合は何もしない
                 print(f"[miniAnti] Alert channel {alert_channel_id} not found")
                 return
+            
+            # 大人数スパム用の特別な処理
+            is_mass_spam = alert_type.startswith("mass_") or alert_type == "mass_spam"
+            
+            # 直前にアラートを送ったばかりならバッファしてまとめて送る（大人数スパムのアラートは既にまとめなのですぐ送る）
+            guild_id = self.message.guild.id
+            if not is_mass_spam and alert_digest.should_buffer(guild_id):
+                alert_digest.add(guild_id, alert_channel, AlertEntry(
+                    alert_type,
+                    self.message.author.id,
+                    self.message.author.mention,
+                    self.message.channel.id,
+                    self.message.channel.mention,
+                    deleted_count,
+                ))
+                return
+            # 送信中に来たアラートがまとめられるよう、送信を待つ前に記録する
+            previous_sent = alert_digest.mark_sent(guild_id)
               # アラート種別に応じた色とアイコンを設定
             # types.pyで定義された情報を使用
             info = DetectionTypeManager.get_info(alert_type)
@@ -35,9 +200,6 @@ class Notifier:
                 "title": f"{info.name}検知"
             }
             
-            # 大人数スパム用の特別な処理
-            is_mass_spam = alert_type.startswith("mass_") or alert_type == "mass_spam"
-            
             # アラートEmbed作成
             embed = discord.Embed(
                 title=f"{config['icon']} {config['title']}",
@@ -109,8 +271,17 @@ class Notifier:
                 
                 embed.set_footer(text=f"User ID: {self.message.author.id}")
             
-            # アラート送信
-            await alert_channel.send(embed=embed)
+            # アラート送信（レート制限はスケジューラーに任せる）
+            try:
+                sent = await moderation_scheduler.notify(alert_channel.id, lambda: alert_channel.send(embed=embed))
+            except Exception:
+                alert_digest.unmark_sent(guild_id, previous_sent)
+                raise
+            if sent is None:
+                # キューが満杯で捨てられた
+                alert_digest.unmark_sent(guild_id, previous_sent)
+                print(f"[miniAnti] Alert dropped by scheduler: type={alert_type}")
+                return
             
             if is_mass_spam:
                 print(f"[miniAnti] MASS SPAM Alert sent to #{alert_channel.name}: type={alert_type}, processed={deleted_count}")
@@ -0,0 +1,157 @@
+# 検知パイプライン
+# 1メッセージにつき設定の取得・バイパス判定・特徴量の計算を1回だけ行い、各検知ステージをその上で評価する
+# タイムアウト・削除・slowmode等の処理は判定が出たステージについてのみ実行する
+import time
+from typing import Any, Dict, List, Optional
+
+from plugins.antiModule.config import AntiCheatConfig
+from plugins.antiModule.bypass import MiniAntiBypass
+from plugins.antiModule.features import Verdict, extract_features
+from plugins.antiModule.state import ensure_sweeper
+from plugins.antiModule.scheduler import moderation_scheduler
+from plugins.antiModule.message_cache import recent_messages
+from plugins.antiModule.shadow import ShadowMode
+from plugins.antiModule.spam import Block, Griefing, _now, user_blocked_until, BLOCK_DURATION
+from plugins.antiModule.types import DetectionType, DetectionTypeManager
+from plugins.antiModule.SpamList.TokenSpam import TokenSpam
+from plugins.antiModule.SpamList.MediaSpam import MediaSpam
+from plugins.antiModule.SpamList.MentionSpam import MentionSpam
+from plugins.antiModule.SpamList.TimebaseSpam import TimebaseSpam
+from plugins.antiModule.SpamList.TypingBypass import TypingBypass
+from plugins.antiModule.SpamList.ForwardSpam import ForwardSpam
+from plugins.antiModule.SpamList.TextSpam import TextSpam
+
+BLOCKED_STAGE = "blocked"
+
+
+class DetectionPipeline:
+    """
+    各ステージは evaluate(features) -> Optional[Verdict] と apply(message, features, verdict) -> bool を持つ
+    先頭から順に評価し、applyがTrueを返したステージで終了する（Falseなら次のステージへ進む）
+    """
+
+    # (ステージ名, 検知クラス)。Noneはブロック中ユーザーの判定（設定・バイパスに関係なく行う）
+    STAGES = [
+        (DetectionType.TOKEN, TokenSpam),
+        (BLOCKED_STAGE, None),
+        (DetectionType.IMAGE, MediaSpam),
+        (DetectionType.MENTION, MentionSpam),
+        (DetectionType.TIMEBASE, TimebaseSpam),
+        (DetectionType.TYPING_BYPASS, TypingBypass),
+        (DetectionType.FORWARD, ForwardSpam),
+        (DetectionType.TEXT, TextSpam),
+    ]
+
+    # ステージ毎のレイテンシ統計 {名前: {"calls", "hits", "total_ms", "max_ms", "last_ms"}}
+    _stats: Dict[str, Dict[str, float]] = {}
+    # 辞書を設定すると呼び出し毎のレイテンシ（ms）も記録する（リプレイでのパーセンタイル計算用）
+    _samples: Optional[Dict[str, List[float]]] = None
+
+    @classmethod
+    def _record(cls, name: str, started: float, hit: bool = False):
+        elapsed = (time.perf_counter() - started) * 1000
+        stat = cls._stats.get(name)
+        if stat is None:
+            stat = cls._stats[name] = {"calls": 0, "hits": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+        stat["calls"] += 1
+        stat["hits"] += int(hit)
+        stat["total_ms"] += elapsed
+        stat["max_ms"] = max(stat["max_ms"], elapsed)
+        stat["last_ms"] = elapsed
+        if cls._samples is not None:
+            cls._samples.setdefault(name, []).append(elapsed)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """ステージ毎の呼び出し回数・判定数・平均/最大レイテンシ（ms）"""
+        return {
+            name: {
+                "calls": stat["calls"],
+                "hits": stat["hits"],
+                "avg_ms": round(stat["total_ms"] / stat["calls"], 3) if stat["calls"] else 0.0,
+                "max_ms": round(stat["max_ms"], 3),
+                "last_ms": round(stat["last_ms"], 3),
+            }
+            for name, stat in cls._stats.items()
+        }
+
+    @classmethod
+    def reset_stats(cls):
+        cls._stats.clear()
+
+    @staticmethod
+    async def _delete(message):
+        if await moderation_scheduler.delete_message(message):
+            recent_messages.forget(message.channel.id, message.author.id, [message.id])
+
+    @staticmethod
+    def _simulate_block(features, verdict: Verdict):
+        """dry_run用: タイムアウト等は行わず、block_and_notifyと同じブロック状態だけを記録する"""
+        until = features.now + BLOCK_DURATION
+        user_blocked_until[features.author_id] = until
+        # Tokenスパムは同じ内容を送信したユーザー全員をブロックする
+        for _, uid in getattr(verdict.detail, "entries", ()):
+            user_blocked_until[uid] = until
+
+    @classmethod
+    async def run(cls, message, dry_run: bool = False) -> Optional[Verdict]:
+        """
+        メッセージを検知し、最終的な判定（なければNone）を返す
+        dry_run=Trueなら判定のみ行い、タイムアウト・削除・通知は行わない
+        """
+        if message.author.bot or not message.guild:
+            return None
+        ensure_sweeper()
+        # 削除対象を求めるため、受信したメッセージを全て記録しておく
+        recent_messages.record(message)
+        started = time.perf_counter()
+        compiled = await AntiCheatConfig.get_compiled(message.guild)
+        active = compiled.enabled and not await MiniAntiBypass.should_bypass(message)
+        features = extract_features(message, _now()) if active else None
+        if active:
+            cls._record("features", started)
+
+        pending_delete = None
+        try:
+            for name, detector in cls.STAGES:
+                if detector is None:
+                    # ブロック中なら削除
+                    if await Block.is_user_blocked(message):
+                        if not dry_run:
+                            await cls._delete(message)
+                        return Verdict(BLOCKED_STAGE, 0, action="delete")
+                    continue
+                if not active or not compiled.is_detection_enabled(DetectionTypeManager.get_config_key(name)):
+                    continue
+
+                stage_started = time.perf_counter()
+                verdict = detector.evaluate(features)
+                cls._record(name, stage_started, verdict is not None)
+                # シャドウモード: 同じ特徴量・状態を候補の閾値でも判定して記録する（処罰はしない）
+                overrides = compiled.shadow_rules.get(name) if compiled.shadow_rules else None
+                if overrides is not None and ShadowMode.supports(detector):
+                    ShadowMode.observe(name, detector, features, verdict, overrides)
+                if verdict is None:
+                    continue
+                if verdict.action == "delete":
+                    # 削除のみの判定は後続のステージも評価する
+                    pending_delete = verdict
+                    continue
+
+                if dry_run:
+                    cls._simulate_block(features, verdict)
+                    return verdict
+
+                action_started = time.perf_counter()
+                blocked = await detector.apply(message, features, verdict)
+                cls._record(f"{name}.apply", action_started, blocked)
+                if blocked:
+                    await Griefing.handle_griefing(message, alert_type=name)
+                    await cls._delete(message)
+                    return verdict
+
+            if pending_delete is not None and not dry_run:
+                await cls._delete(message)
+            return pending_delete
+        finally:
+            cls._record("total", started)
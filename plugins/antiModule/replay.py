@@ -0,0 +1,580 @@
+"""
+replay.py - 検知パイプラインのオフラインリプレイ・ベンチマーク
+
+記録した（または合成した）メッセージ列を、軽量な偽のMessage/Member/Guildと仮想時計を使って
+DetectionPipeline に dry_run で流し、以下を出力する（Discordには一切接続しない）
+- 処理速度（messages/sec）
+- ステージ毎のレイテンシ（p50/p99, ms）
+- メモリ確保（tracemalloc のピーク・残存量と、確保ブロック数の増分）
+- 期待ラベルと判定結果の混同行列
+
+入力はJSONL（1行1イベント）:
+    {"type": "message", "t": 0.5, "guild": 1, "channel": 10, "author": 100, "content": "...",
+     "mentions": [101], "role_mentions": [], "mention_everyone": false, "attachments": 0,
+     "forwarded": false, "roles": [], "expect": "token"}
+    {"type": "typing", "t": 0.2, "author": 100}
+- t は開始からの秒数（仮想時計）。id は省略すると連番
+- expect は期待する検知ステージ（DetectionType）、"none"（検知されてはいけない）、省略（評価対象外）
+
+Tokenスパムの索引は組み込みのhash()を使うため、プロセス間で結果を完全に一致させるには PYTHONHASHSEED を固定する
+
+使い方:
+    PYTHONHASHSEED=0 python -m plugins.antiModule.replay --scenario all --check
+    python -m plugins.antiModule.replay --input stream.jsonl --json
+    python -m plugins.antiModule.replay --scenario token_raid --dump token_raid.jsonl
+"""
+
+import sys
+import copy
+import json
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import discord
+
+from plugins.antiModule import spam, features as features_module, state
+from plugins.antiModule.config import AntiCheatConfig
+from plugins.antiModule.message_cache import recent_messages
+from plugins.antiModule.pipeline import DetectionPipeline
+from plugins.antiModule.shadow import ShadowMode
+from plugins.antiModule.SpamList import TypingBypass as typing_module
+from plugins.antiModule.SpamList.TypingBypass import TypingBypass
+
+# 仮想時計の開始時刻（UNIX時刻）
+EPOCH = 1_700_000_000.0
+NONE_LABEL = "none"
+
+
+# === 仮想時計 ===
+
+class VirtualClock:
+    """time.time() / time.monotonic() の代わりに使う時計。advance() でのみ進む"""
+
+    def __init__(self, start: float = EPOCH):
+        self.now = start
+
+    def advance(self, to: float):
+        # 入力の時刻が前後しても時計は戻さない
+        self.now = max(self.now, to)
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class _ClockedTime:
+    """検知モジュールの `time` を差し替えるためのオブジェクト（時刻以外は本物のtimeに委譲）"""
+
+    def __init__(self, clock: VirtualClock):
+        self._clock = clock
+
+    def time(self) -> float:
+        return self._clock.time()
+
+    def monotonic(self) -> float:
+        return self._clock.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+# 時刻を参照する検知モジュール（pipelineはレイテンシ計測に本物のperf_counterを使うので含めない）
+_CLOCKED_MODULES = (spam, features_module, state, typing_module)
+
+
+class virtual_time:
+    """with virtual_time(clock): の間、検知モジュールの時刻を仮想時計にする"""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self._saved = []
+
+    def __enter__(self):
+        proxy = _ClockedTime(self.clock)
+        for module in _CLOCKED_MODULES:
+            self._saved.append((module, module.time))
+            module.time = proxy
+        return self.clock
+
+    def __exit__(self, *exc):
+        for module, original in self._saved:
+            module.time = original
+        self._saved.clear()
+
+
+# === 偽のDiscordオブジェクト ===
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: FakeGuild):
+        self.id = channel_id
+        self.guild = guild
+        self.slowmode_delay = 0
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class FakeMember:
+    def __init__(self, user_id: int, name: Optional[str] = None, roles: Iterable[int] = (), bot: bool = False):
+        self.id = user_id
+        self.name = name or f"user-{user_id}"
+        self.roles = [FakeRole(r) for r in roles]
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+
+class FakeMentionedUser(discord.User):
+    """メンション先（特徴量の計算で discord.User として扱われる必要がある）"""
+
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user-{user_id}"
+
+
+class FakeReference:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+
+
+class FakeMessage:
+    def __init__(self, message_id, content, author, channel, created_at, mentions=(), role_mentions=(),
+                 mention_everyone=False, attachments=0, forwarded=False):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.created_at = created_at
+        self.mentions = [FakeMentionedUser(m) for m in mentions]
+        self.role_mentions = [FakeRole(r) for r in role_mentions]
+        self.mention_everyone = mention_everyone
+        self.attachments = [object()] * attachments
+        self.embeds = []
+        # 転送は返信以外のreferenceとして表現する
+        self.reference = FakeReference(message_id - 1) if forwarded else None
+        self.type = discord.MessageType.default
+
+
+class FakeWorld:
+    """イベントの辞書から偽オブジェクトを作る（同じIDには同じオブジェクトを返す）"""
+
+    def __init__(self):
+        self.guilds: Dict[int, FakeGuild] = {}
+        self.channels: Dict[int, FakeChannel] = {}
+        self.members: Dict[int, FakeMember] = {}
+        self._next_id = 1
+
+    def guild(self, guild_id: int) -> FakeGuild:
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = FakeGuild(guild_id)
+        return self.guilds[guild_id]
+
+    def channel(self, channel_id: int, guild_id: int) -> FakeChannel:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(channel_id, self.guild(guild_id))
+        return self.channels[channel_id]
+
+    def member(self, event: Dict[str, Any]) -> FakeMember:
+        user_id = int(event["author"])
+        if user_id not in self.members:
+            self.members[user_id] = FakeMember(user_id, event.get("author_name"), event.get("roles", ()),
+                                               bool(event.get("bot", False)))
+        return self.members[user_id]
+
+    def message(self, event: Dict[str, Any], timestamp: float) -> FakeMessage:
+        message_id = int(event.get("id") or self._next_id)
+        self._next_id = max(self._next_id, message_id) + 1
+        return FakeMessage(
+            message_id,
+            event.get("content", ""),
+            self.member(event),
+            self.channel(int(event.get("channel", 1)), int(event.get("guild", 1))),
+            datetime.fromtimestamp(timestamp, timezone.utc),
+            mentions=event.get("mentions", ()),
+            role_mentions=event.get("role_mentions", ()),
+            mention_everyone=bool(event.get("mention_everyone", False)),
+            attachments=int(event.get("attachments", 0)),
+            forwarded=bool(event.get("forwarded", False)),
+        )
+
+
+# === リプレイ ===
+
+def reset_detector_state():
+    """検知器の状態（ユーザー毎の履歴・Token索引・ブロック・キャッシュ）を空にする"""
+    for store in list(state._stores.values()):
+        store.clear()
+    spam.token_spam_index.clear()
+    recent_messages._channels.clear()
+
+
+def _prime_config(guild_ids: Iterable[int], overrides: Optional[Dict[str, Any]] = None):
+    """DBを読まずに済むよう、全検知を有効にした設定をコンパイル済みキャッシュに入れる"""
+    config = copy.deepcopy(AntiCheatConfig.DEFAULT_CONFIG)
+    config["enabled"] = True
+    for key in config.get("detection_settings", {}):
+        config["detection_settings"][key] = True
+    AntiCheatConfig._deep_merge(config, copy.deepcopy(overrides or {}))
+    compiled = AntiCheatConfig.compile(config)
+    for guild_id in guild_ids:
+        AntiCheatConfig._compiled[guild_id] = compiled
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def _replay_once(events: List[Dict[str, Any]], config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    reset_detector_state()
+    world = FakeWorld()
+    clock = VirtualClock()
+    _prime_config({int(e.get("guild", 1)) for e in events if e.get("type", "message") == "message"}, config)
+    results = []
+    elapsed = 0.0
+    with virtual_time(clock):
+        for event in events:
+            clock.advance(EPOCH + float(event.get("t", 0)))
+            kind = event.get("type", "message")
+            if kind == "typing":
+                await TypingBypass.record_typing_start(int(event["author"]))
+                continue
+            if kind != "message":
+                continue
+            message = world.message(event, clock.now)
+            started = time.perf_counter()
+            verdict = await DetectionPipeline.run(message, dry_run=True)
+            elapsed += time.perf_counter() - started
+            results.append((event.get("expect"), verdict.stage if verdict is not None else NONE_LABEL,
+                            verdict.action if verdict is not None else None))
+    return {"results": results, "elapsed": elapsed}
+
+
+def replay(events: List[Dict[str, Any]], config: Optional[Dict[str, Any]] = None,
+           trace_alloc: bool = True) -> Dict[str, Any]:
+    """
+    イベント列をリプレイして統計を返す
+    計測への影響を避けるため、時間の計測とメモリの計測は別々に（同じ初期状態から）実行する
+    """
+    DetectionPipeline.reset_stats()
+    ShadowMode.reset_stats()
+    DetectionPipeline._samples = {}
+    try:
+        run = asyncio.run(_replay_once(events, config))
+        samples = DetectionPipeline._samples
+    finally:
+        DetectionPipeline._samples = None
+    guild_ids = sorted({int(e.get("guild", 1)) for e in events if e.get("type", "message") == "message"})
+    shadow = {guild_id: ShadowMode.get_stats(guild_id) for guild_id in guild_ids}
+    shadow = {guild_id: stats for guild_id, stats in shadow.items() if stats}
+    # シャドウ評価にかかった時間の、本番の判定時間に対する割合
+    shadow_ms = sum(stat["total_ms"] for stats in shadow.values() for stat in stats.values())
+    live_ms = sum(samples.get("total", ())) - shadow_ms
+
+    alloc = None
+    if trace_alloc:
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        try:
+            asyncio.run(_replay_once(events, config))
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        alloc = {"peak_bytes": peak, "retained_bytes": current,
+                 "allocated_blocks": sys.getallocatedblocks() - blocks_before}
+
+    results = run["results"]
+    count = len(results)
+    latency = {
+        name: {"calls": len(values), "p50_ms": round(_percentile(values, 50), 4),
+               "p99_ms": round(_percentile(values, 99), 4), "max_ms": round(max(values), 4)}
+        for name, values in samples.items()
+    }
+    matrix: Dict[str, Counter] = {}
+    for expect, actual, _ in results:
+        matrix.setdefault(expect if expect is not None else "-", Counter())[actual] += 1
+    return {
+        "messages": count,
+        "elapsed_s": round(run["elapsed"], 4),
+        "messages_per_sec": round(count / run["elapsed"], 1) if run["elapsed"] else 0.0,
+        "latency": latency,
+        "alloc": alloc,
+        "confusion": {expect: dict(actuals) for expect, actuals in sorted(matrix.items())},
+        "detection": _detection_summary(results),
+        "shadow": shadow,
+        "shadow_overhead": round(shadow_ms / live_ms, 4) if shadow and live_ms > 0 else None,
+    }
+
+
+def _detection_summary(results) -> Dict[str, Any]:
+    """期待ラベルのあるメッセージについての検知/非検知の集計（ブロック中による削除も検知に含める）"""
+    tp = fp = fn = tn = 0
+    for expect, actual, _ in results:
+        if expect is None:
+            continue
+        detected = actual != NONE_LABEL
+        if expect == NONE_LABEL:
+            fp += detected
+            tn += not detected
+        else:
+            tp += detected
+            fn += not detected
+    return {
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "recall": round(tp / (tp + fn), 3) if tp + fn else None,
+        "false_positive_rate": round(fp / (fp + tn), 3) if fp + tn else None,
+    }
+
+
+# === 既定のシナリオ（回帰テスト用） ===
+# 各シナリオは (イベント列, 最低限の検知率) を返す。すべて乱数の種を固定して生成する
+
+_WORDS = ["今日", "ゲーム", "やる", "楽しい", "眠い", "昼ごはん", "ラーメン", "イベント", "参加", "募集",
+          "hello", "nice", "gg", "lol", "thanks", "ok", "了解", "おつかれ", "明日", "何時から"]
+
+
+def _chat_line(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def _benign_chat(rng: random.Random, start: float, duration: float, users: Iterable[int],
+                 channel: int = 10, guild: int = 1) -> List[Dict[str, Any]]:
+    """入力中イベントのある、人間らしい間隔の雑談"""
+    events = []
+    for user in users:
+        t = start + rng.uniform(0, 5)
+        while t < start + duration:
+            events.append({"type": "typing", "t": round(t, 3), "author": user})
+            t += rng.uniform(1.5, 6)
+            events.append({"type": "message", "t": round(t, 3), "guild": guild, "channel": channel,
+                           "author": user, "content": _chat_line(rng), "expect": NONE_LABEL})
+            t += rng.uniform(8, 40)
+    return events
+
+
+def _scenario_benign(rng):
+    return _benign_chat(rng, 0, 600, range(100, 120)), None
+
+
+def _scenario_token_raid(rng):
+    """同じ招待文（末尾だけ違う）を複数アカウントが一斉に投稿"""
+    events = _benign_chat(rng, 0, 120, range(100, 110))
+    base = "無料でNitroを配布中！今すぐ参加 discord.gg/freenitro"
+    for round_no in range(5):
+        t = 30 + round_no * 15
+        for i, user in enumerate(range(900, 908)):
+            events.append({"type": "message", "t": round(t + i * 0.2 + rng.uniform(0, 0.1), 3), "guild": 1,
+                           "channel": 10, "author": user, "content": f"{base} {rng.randint(1000, 9999)}",
+                           # 最初の2人分は同じ内容の投稿者数が閾値に届かない
+                           "expect": "token" if round_no or i >= 2 else None})
+    return events, 0.9
+
+
+def _scenario_text_flood(rng):
+    """1人が入力しながらほぼ同じ文を連投"""
+    events = _benign_chat(rng, 0, 120, range(100, 110))
+    line = "このサーバーは終わりだ！みんな見ろ！！！"
+    t = 20.0
+    for i in range(12):
+        events.append({"type": "typing", "t": round(t - 0.3, 3), "author": 950})
+        events.append({"type": "message", "t": round(t, 3), "guild": 1, "channel": 10, "author": 950,
+                       "content": line + "！" * (i % 3), "expect": "text" if i >= 1 else None})
+        t += rng.uniform(0.3, 0.9)
+    return events, 0.8
+
+
+def _scenario_mention_raid(rng):
+    """@everyoneとロールメンションの連投"""
+    events = _benign_chat(rng, 0, 120, range(100, 110))
+    for user in range(960, 965):
+        t = 40 + rng.uniform(0, 2)
+        for i in range(4):
+            events.append({"type": "typing", "t": round(t - 0.5, 3), "author": user})
+            events.append({"type": "message", "t": round(t, 3), "guild": 1, "channel": 10, "author": user,
+                           "content": f"@everyone {_chat_line(rng)}", "mention_everyone": True,
+                           "role_mentions": [5000],
+                           "expect": "mention" if i >= 1 else None})
+            t += rng.uniform(1, 3)
+    return events, 0.9
+
+
+def _scenario_image_flood(rng):
+    events = _benign_chat(rng, 0, 120, range(100, 110))
+    t = 30.0
+    for i in range(8):
+        events.append({"type": "message", "t": round(t, 3), "guild": 1, "channel": 10, "author": 970,
+                       "content": "", "attachments": 1, "expect": "image" if i >= 2 else None})
+        t += rng.uniform(1, 3)
+    return events, 0.9
+
+
+def _scenario_forward_flood(rng):
+    events = _benign_chat(rng, 0, 120, range(100, 110))
+    t = 30.0
+    for i in range(10):
+        events.append({"type": "message", "t": round(t, 3), "guild": 1, "channel": 10, "author": 980,
+                       "content": "", "forwarded": True, "expect": "forward" if i >= 4 else None})
+        t += rng.uniform(0.5, 1.5)
+    return events, 0.9
+
+
+def _scenario_interval_bot(rng):
+    """一定間隔で投稿し続けるセルフボット"""
+    events = _benign_chat(rng, 0, 300, range(100, 110))
+    for i in range(20):
+        t = 20.0 + i * 7
+        events.append({"type": "typing", "t": t - 1, "author": 990})
+        events.append({"type": "message", "t": t, "guild": 1, "channel": 10, "author": 990,
+                       "content": f"定期投稿 {rng.choice(_WORDS)} {rng.choice(_WORDS)}",
+                       "expect": "timebase" if i >= 8 else None})
+    return events, 0.9
+
+
+def _scenario_mass_raid(rng):
+    """雑談中の複数チャンネルに多数のアカウントが別々の手口で一斉に荒らす"""
+    events = _benign_chat(rng, 0, 300, range(100, 140), channel=10)
+    events += _benign_chat(rng, 0, 300, range(140, 160), channel=11)
+    base = "【緊急】このリンクから認証してください https://example.invalid/verify"
+    for i, user in enumerate(range(2000, 2030)):
+        t = 60 + i * 0.15
+        channel = 10 if i % 2 else 11
+        for k in range(3):
+            events.append({"type": "message", "t": round(t + k * 0.8, 3), "guild": 1, "channel": channel,
+                           "author": user, "content": f"{base}?id={rng.randint(0, 99)}",
+                           "expect": "token" if i >= 2 or k else None})
+    return events, 0.9
+
+
+SCENARIOS = {
+    "benign": _scenario_benign,
+    "token_raid": _scenario_token_raid,
+    "text_flood": _scenario_text_flood,
+    "mention_raid": _scenario_mention_raid,
+    "image_flood": _scenario_image_flood,
+    "forward_flood": _scenario_forward_flood,
+    "interval_bot": _scenario_interval_bot,
+    "mass_raid": _scenario_mass_raid,
+}
+
+
+def build_scenario(name: str, seed: int = 0):
+    events, min_recall = SCENARIOS[name](random.Random(seed))
+    events.sort(key=lambda e: e.get("t", 0))
+    return events, min_recall
+
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    # 時刻順に並べる（同じ時刻は記録順）
+    events.sort(key=lambda e: e.get("t", 0))
+    return events
+
+
+def check(report: Dict[str, Any], min_recall: Optional[float]) -> List[str]:
+    """回帰判定: 誤検知が無く、検知率が最低値以上か"""
+    failures = []
+    summary = report["detection"]
+    if summary["fp"]:
+        failures.append(f"誤検知 {summary['fp']} 件")
+    if min_recall is not None and (summary["recall"] or 0.0) < min_recall:
+        failures.append(f"検知率 {summary['recall']} < {min_recall}")
+    return failures
+
+
+def _print_report(name: str, report: Dict[str, Any]):
+    print(f"=== {name} ===")
+    print(f"messages: {report['messages']}  elapsed: {report['elapsed_s']}s  "
+          f"throughput: {report['messages_per_sec']} msg/s")
+    print(f"{'stage':<22} {'calls':>7} {'p50(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    for stage, stat in report["latency"].items():
+        print(f"{stage:<22} {stat['calls']:>7} {stat['p50_ms']:>9} {stat['p99_ms']:>9} {stat['max_ms']:>9}")
+    if report["alloc"]:
+        alloc = report["alloc"]
+        print(f"alloc: peak={alloc['peak_bytes']}B retained={alloc['retained_bytes']}B "
+              f"blocks={alloc['allocated_blocks']:+d}")
+    labels = sorted({actual for actuals in report["confusion"].values() for actual in actuals})
+    print("confusion (行: 期待, 列: 判定)")
+    print(f"{'':<14}" + "".join(f"{label:>14}" for label in labels))
+    for expect, actuals in report["confusion"].items():
+        print(f"{expect:<14}" + "".join(f"{actuals.get(label, 0):>14}" for label in labels))
+    print(f"detection: {report['detection']}")
+    for guild_id, stats in report["shadow"].items():
+        print(f"shadow (guild {guild_id}, overhead {report['shadow_overhead']:.1%}):")
+        print(f"{'stage':<14} {'evaluated':>9} {'live':>6} {'shadow':>7} {'live_only':>10} {'shadow_only':>12} {'avg(ms)':>9}")
+        for stage, stat in stats.items():
+            print(f"{stage:<14} {stat['evaluated']:>9} {stat['live_hits']:>6} {stat['shadow_hits']:>7} "
+                  f"{stat['live_only']:>10} {stat['shadow_only']:>12} {stat['avg_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="検知パイプラインのオフラインリプレイ")
+    parser.add_argument("--input", help="リプレイするJSONLファイル")
+    parser.add_argument("--scenario", help=f"既定のシナリオ（{', '.join(SCENARIOS)}, all）")
+    parser.add_argument("--seed", type=int, default=0, help="シナリオ生成の乱数の種")
+    parser.add_argument("--config", help="AntiCheat設定の上書き（JSON文字列）")
+    parser.add_argument("--dump", help="シナリオをJSONLとして書き出して終了する")
+    parser.add_argument("--no-alloc", action="store_true", help="メモリ計測を行わない")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--check", action="store_true", help="誤検知・検知率の回帰判定を行い、失敗時は終了コード1")
+    args = parser.parse_args()
+
+    runs = []
+    if args.input:
+        runs.append((args.input, load_events(args.input), None))
+    if args.scenario:
+        names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+        for name in names:
+            events, min_recall = build_scenario(name, args.seed)
+            runs.append((name, events, min_recall))
+    if not runs:
+        parser.error("--input または --scenario を指定してください")
+
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            for _, events, _ in runs:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        print(f"[INFO] {sum(len(events) for _, events, _ in runs)} 件のイベントを書き出しました: {args.dump}")
+        return
+
+    config = json.loads(args.config) if args.config else None
+    reports = {}
+    failed = False
+    for name, events, min_recall in runs:
+        report = replay(events, config, trace_alloc=not args.no_alloc)
+        failures = check(report, min_recall) if args.check else []
+        report["failures"] = failures
+        failed = failed or bool(failures)
+        reports[name] = report
+        if not args.json:
+            _print_report(name, report)
+            for failure in failures:
+                print(f"[FAIL] {name}: {failure}")
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# モデレーション操作（slowmode・タイムアウト・削除・通知）のスケジューラー
+# - ルート（操作の種類 × チャンネル/ギルド）ごとのトークンバケットで送信ペースを制御し、429を受けたらそのルートを止める
+# - 同じ操作（同じチャンネルのslowmode、同じメンバーのタイムアウト、同じメッセージの削除）は1回にまとめる
+# - 優先度の高い順（slowmode > タイムアウト > 削除 > 通知）に実行する
+# - キューには上限があり、満杯のときは優先度の低い操作から捨てる
+import time
+import heapq
+import asyncio
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import discord
+
+PRIORITY_SLOWMODE = 0
+PRIORITY_TIMEOUT = 1
+PRIORITY_DELETE = 2
+PRIORITY_NOTIFY = 3
+LANE_NAMES = {
+    PRIORITY_SLOWMODE: "slowmode",
+    PRIORITY_TIMEOUT: "timeout",
+    PRIORITY_DELETE: "delete",
+    PRIORITY_NOTIFY: "notify",
+}
+
+# ルートの種類 → (1秒あたりの回数, バースト)
+ROUTE_LIMITS = {
+    "channel_edit": (0.5, 2),     # チャンネル毎
+    "member_edit": (5.0, 5),      # ギルド毎（タイムアウト・キック・BAN）
+    "fetch_member": (10.0, 10),   # ギルド毎
+    "delete": (1.0, 5),           # チャンネル毎
+    "bulk_delete": (1.0, 1),      # チャンネル毎
+    "send": (1.0, 5),             # チャンネル・ユーザー毎
+}
+DEFAULT_ROUTE_LIMIT = (1.0, 1)
+
+MAX_QUEUE = 500
+WORKERS = 4
+MAX_ATTEMPTS = 3               # 429時の最大試行回数
+SLOWMODE_COALESCE_WINDOW = 10  # 同じ値のslowmode設定をまとめる時間（秒）
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        """トークンを1つ取得できるまでの待ち時間（0なら取得済み。0より大きければ取得しない）"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def penalize(self, retry_after: float):
+        """429を受けたとき、retry_after秒このルートを止める"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.tokens = 0.0
+
+
+class _Action:
+    __slots__ = ("priority", "seq", "route", "key", "factory", "future", "enqueued_at", "attempts")
+
+    def __init__(self, priority, seq, route, key, factory, future):
+        self.priority = priority
+        self.seq = seq
+        self.route = route
+        self.key = key
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ModerationScheduler:
+    def __init__(self, max_queue: int = MAX_QUEUE, workers: int = WORKERS):
+        self.max_queue = max_queue
+        self.workers = workers
+        self._heap = []
+        # トークンが尽きたルートの操作はルート毎に取り置き、取得できる時刻になったら_heapに戻す
+        # （1つのルートの待ちで他のルート・優先度の高い操作が止まらないようにする）
+        self._deferred: Dict[str, list] = {}   # route -> 待機中の操作（ヒープ）
+        self._route_ready = []                 # (トークンを取得できる時刻, route) のヒープ
+        self._pending: Dict[Hashable, _Action] = {}  # まとめる対象のキー → 待機中の操作
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._seq = count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._recent_slowmode: Dict[int, tuple] = {}  # channel_id -> (値, 設定時刻)
+        self.stats = {"submitted": 0, "executed": 0, "failed": 0, "coalesced": 0,
+                      "dropped": 0, "rejected": 0, "retried": 0, "rate_limited": 0}
+        self._lane_wait = {lane: {"count": 0, "total_ms": 0.0, "max_ms": 0.0} for lane in LANE_NAMES}
+
+    # --- キュー ---
+    def _ensure_workers(self):
+        self._tasks = [task for task in self._tasks if not task.done()]
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    def _bucket(self, route: str) -> TokenBucket:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            rate, burst = ROUTE_LIMITS.get(route.split(":", 1)[0], DEFAULT_ROUTE_LIMIT)
+            bucket = self._buckets[route] = TokenBucket(rate, burst)
+        return bucket
+
+    def _queued(self):
+        """待機中の全ての操作（取り置き中を含む）"""
+        yield from self._heap
+        for actions in self._deferred.values():
+            yield from actions
+
+    def _queue_size(self) -> int:
+        return len(self._heap) + sum(len(actions) for actions in self._deferred.values())
+
+    def _drop_worst(self, priority: int) -> bool:
+        """priorityより優先度の低い待機中の操作を1つ捨てる。捨てられればTrue"""
+        worst = max(self._queued(), default=None)
+        if worst is None or worst.priority <= priority:
+            return False
+        queue = self._heap if worst in self._heap else self._deferred[worst.route]
+        queue.remove(worst)
+        heapq.heapify(queue)
+        if worst.key is not None:
+            self._pending.pop(worst.key, None)
+        if not worst.future.done():
+            worst.future.set_result(None)
+        self.stats["dropped"] += 1
+        return True
+
+    def submit(self, route: str, factory: Callable[[], Awaitable[Any]], priority: int,
+               key: Optional[Hashable] = None, replace: bool = False) -> "asyncio.Future":
+        """
+        操作をキューに入れ、結果を受け取るFutureを返す（実行中のイベントループ上で呼ぶこと）
+        keyが同じ操作が待機中ならそれにまとめる（replace=Trueなら後から来た内容で置き換える）
+        キューが満杯で捨てられた・受け付けられなかった操作の結果はNone
+        """
+        self._ensure_workers()
+        self.stats["submitted"] += 1
+        if key is not None and key in self._pending:
+            action = self._pending[key]
+            if replace:
+                action.factory = factory
+            self.stats["coalesced"] += 1
+            return action.future
+        future = asyncio.get_running_loop().create_future()
+        if self._queue_size() >= self.max_queue and not self._drop_worst(priority):
+            self.stats["rejected"] += 1
+            future.set_result(None)
+            return future
+        action = _Action(priority, next(self._seq), route, key, factory, future)
+        heapq.heappush(self._heap, action)
+        if key is not None:
+            self._pending[key] = action
+        self._wakeup.set()
+        return future
+
+    async def run(self, route: str, factory: Callable[[], Awaitable[Any]], priority: int,
+                  key: Optional[Hashable] = None, replace: bool = False):
+        """submitして結果を待つ"""
+        return await self.submit(route, factory, priority, key, replace)
+
+    def _defer(self, action: _Action, wait: float):
+        """ルートのトークンが取得できるまで操作を取り置く"""
+        actions = self._deferred.get(action.route)
+        if actions is None:
+            actions = self._deferred[action.route] = []
+            heapq.heappush(self._route_ready, (time.monotonic() + wait, action.route))
+        heapq.heappush(actions, action)
+
+    def _promote_ready(self):
+        """トークンを取得できる時刻になったルートの操作を_heapに戻す"""
+        now = time.monotonic()
+        while self._route_ready and self._route_ready[0][0] <= now:
+            _, route = heapq.heappop(self._route_ready)
+            for action in self._deferred.pop(route, ()):
+                heapq.heappush(self._heap, action)
+
+    async def _worker(self):
+        while True:
+            self._promote_ready()
+            if not self._heap:
+                # 取り置き中のルートがあれば、最も早く取得できる時刻まで待つ
+                timeout = self._route_ready[0][0] - time.monotonic() if self._route_ready else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            action = heapq.heappop(self._heap)
+            if action.future.done():
+                if action.key is not None and self._pending.get(action.key) is action:
+                    del self._pending[action.key]
+                continue
+            bucket = self._bucket(action.route)
+            if action.route in self._deferred:
+                # 同じルートの操作が取り置き中なら、その後ろに並ぶ
+                heapq.heappush(self._deferred[action.route], action)
+                continue
+            wait = bucket.delay()
+            if wait > 0:
+                self._defer(action, wait)
+                continue
+            # 実行を始めた操作にはまとめない
+            if action.key is not None and self._pending.get(action.key) is action:
+                del self._pending[action.key]
+            if action.attempts == 0:
+                self._record_wait(action)
+            action.attempts += 1
+            try:
+                result = await action.factory()
+            except discord.errors.HTTPException as e:
+                if e.status == 429 and action.attempts < MAX_ATTEMPTS:
+                    retry_after = getattr(e, "retry_after", None) or 5
+                    print(f"[Scheduler] 429 on {action.route}, retrying after {retry_after}s")
+                    bucket.penalize(retry_after)
+                    self.stats["rate_limited"] += 1
+                    self.stats["retried"] += 1
+                    heapq.heappush(self._heap, action)
+                    self._wakeup.set()
+                    continue
+                self._fail(action, e)
+            except Exception as e:
+                self._fail(action, e)
+            else:
+                self.stats["executed"] += 1
+                if not action.future.done():
+                    action.future.set_result(result)
+
+    def _fail(self, action: _Action, error: Exception):
+        self.stats["failed"] += 1
+        if not action.future.done():
+            action.future.set_exception(error)
+            # 結果を待たない呼び出し元でも「例外が取得されなかった」警告を出さない
+            action.future.exception()
+
+    def _record_wait(self, action: _Action):
+        waited = (time.monotonic() - action.enqueued_at) * 1000
+        lane = self._lane_wait[action.priority]
+        lane["count"] += 1
+        lane["total_ms"] += waited
+        lane["max_ms"] = max(lane["max_ms"], waited)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """キューの深さ（レーン毎）・待ち時間・実行/まとめ/破棄の回数"""
+        depth = {name: 0 for name in LANE_NAMES.values()}
+        for action in self._queued():
+            depth[LANE_NAMES[action.priority]] += 1
+        waits = {
+            LANE_NAMES[priority]: {
+                "count": w["count"],
+                "avg_ms": round(w["total_ms"] / w["count"], 2) if w["count"] else 0.0,
+                "max_ms": round(w["max_ms"], 2),
+            }
+            for priority, w in self._lane_wait.items()
+        }
+        return dict(self.stats, depth=depth, capacity=self.max_queue, wait=waits,
+                    routes_blocked=sum(1 for b in self._buckets.values() if b.blocked_until > time.monotonic()))
+
+    # --- 操作 ---
+    async def edit_slowmode(self, channel, seconds: int, reason: Optional[str] = None) -> bool:
+        """チャンネルのslowmodeを設定する。直前に同じ値を設定済みならまとめて成功扱いにする"""
+        recent = self._recent_slowmode.get(channel.id)
+        if recent and recent[0] == seconds and time.monotonic() - recent[1] < SLOWMODE_COALESCE_WINDOW:
+            self.stats["coalesced"] += 1
+            return True
+
+        async def apply():
+            await channel.edit(slowmode_delay=seconds, reason=reason)
+            self._recent_slowmode[channel.id] = (seconds, time.monotonic())
+            return True
+
+        try:
+            result = await self.run(f"channel_edit:{channel.id}", apply, PRIORITY_SLOWMODE,
+                                    key=("slowmode", channel.id), replace=True)
+            return bool(result)
+        except Exception as e:
+            print(f"[ERROR] Failed to set slowmode: {e}")
+            return False
+
+    async def fetch_member(self, guild, user_id: int):
+        """メンバーを取得する（同じユーザーの取得はまとめる）"""
+        return await self.run(f"fetch_member:{guild.id}", lambda: guild.fetch_member(int(user_id)),
+                              PRIORITY_TIMEOUT, key=("fetch_member", guild.id, int(user_id)))
+
+    async def timeout(self, member, until, reason: Optional[str] = None) -> bool:
+        """メンバーをタイムアウトする（同じメンバーへのタイムアウトはまとめる）"""
+        async def apply():
+            await member.timeout(until, reason=reason)
+            return True
+
+        result = await self.run(f"member_edit:{member.guild.id}", apply, PRIORITY_TIMEOUT,
+                                key=("timeout", member.guild.id, member.id), replace=True)
+        return bool(result)
+
+    async def moderate(self, member, action: str, factory: Callable[[], Awaitable[Any]]):
+        """キック・BAN等のメンバーへの操作（同じメンバーへの同じ操作はまとめる）"""
+        return await self.run(f"member_edit:{member.guild.id}", factory, PRIORITY_TIMEOUT,
+                              key=(action, member.guild.id, member.id))
+
+    async def delete_message(self, message) -> bool:
+        """メッセージを削除する（削除済み・権限なし等の失敗はFalse）"""
+        async def apply():
+            await message.delete()
+            return True
+
+        try:
+            return bool(await self.run(f"delete:{message.channel.id}", apply, PRIORITY_DELETE,
+                                       key=("delete", message.id)))
+        except Exception:
+            return False
+
+    async def delete_messages(self, channel, messages) -> int:
+        """複数のメッセージを一括削除する。削除した件数を返す"""
+        async def apply():
+            await channel.delete_messages(messages)
+            return len(messages)
+
+        try:
+            return await self.run(f"bulk_delete:{channel.id}", apply, PRIORITY_DELETE) or 0
+        except Exception as e:
+            print(f"[ERROR] Bulk delete failed: {e}")
+            return 0
+
+    def notify(self, scope_id: int, factory: Callable[[], Awaitable[Any]]) -> "asyncio.Future":
+        """通知を送る（結果は待たなくてよい。満杯時は最初に捨てられる）"""
+        return self.submit(f"send:{scope_id}", factory, PRIORITY_NOTIFY)
+
+
+# 共有のスケジューラー
+moderation_scheduler = ModerationScheduler()
@@ -0,0 +1,113 @@
+# シャドウモード（候補の閾値による並行判定と統計）
+# 本番の判定と同じ特徴量・同じ状態に対して、ギルド毎に設定した候補の閾値で判定し直し、
+# 「その閾値なら検知していたか」を記録するだけ（タイムアウト・削除・通知は行わない）
+# 本番のステージが評価したメッセージだけが対象（前のステージで処罰されたメッセージは後続のステージで評価されない）
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+SCORE_BUCKET_WIDTH = 0.1
+MAX_SCORE_BUCKET = 100       # これより大きいスコアは最後のビンに入れる
+
+
+class ShadowStats:
+    """1ギルド・1ステージ分の統計"""
+    __slots__ = ("evaluated", "live_hits", "shadow_hits", "live_only", "shadow_only",
+                 "scores", "latency", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.evaluated = 0
+        self.live_hits = 0
+        self.shadow_hits = 0
+        self.live_only = 0       # 本番だけが検知
+        self.shadow_only = 0     # 候補だけが検知
+        self.scores: Dict[int, int] = {}   # スコアのビン（SCORE_BUCKET_WIDTH刻み）→ 件数
+        self.latency: Dict[int, int] = {}  # 判定時間のビン（µsのビット長、2^(k-1)〜2^k µs）→ 件数
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, live_hit: bool, shadow_hit: bool, score: Optional[float], elapsed_ms: float):
+        self.evaluated += 1
+        self.live_hits += live_hit
+        self.shadow_hits += shadow_hit
+        self.live_only += live_hit and not shadow_hit
+        self.shadow_only += shadow_hit and not live_hit
+        if score is not None:
+            bucket = min(int(score / SCORE_BUCKET_WIDTH), MAX_SCORE_BUCKET)
+            self.scores[bucket] = self.scores.get(bucket, 0) + 1
+        bucket = int(elapsed_ms * 1000).bit_length()
+        self.latency[bucket] = self.latency.get(bucket, 0) + 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        n = self.evaluated
+        return {
+            "evaluated": n,
+            "live_hits": self.live_hits,
+            "shadow_hits": self.shadow_hits,
+            "live_rate": round(self.live_hits / n, 4) if n else 0.0,
+            "shadow_rate": round(self.shadow_hits / n, 4) if n else 0.0,
+            "live_only": self.live_only,
+            "shadow_only": self.shadow_only,
+            "scores": {round(bucket * SCORE_BUCKET_WIDTH, 2): count for bucket, count in sorted(self.scores.items())},
+            # {上限(µs): 件数}
+            "latency_us": {1 << bucket: count for bucket, count in sorted(self.latency.items())},
+            "avg_ms": round(self.total_ms / n, 4) if n else 0.0,
+            "max_ms": round(self.max_ms, 4),
+            "total_ms": round(self.total_ms, 3),
+        }
+
+
+class ShadowMode:
+    # {(guild_id, ステージ名): ShadowStats}
+    _stats: Dict[Tuple[int, str], ShadowStats] = {}
+    # 上書き設定（コンパイル済み設定の一部）毎の、本番の閾値とマージした閾値 {id: (上書き設定, マージ結果)}
+    _params: Dict[int, Tuple[Mapping[str, float], Dict[str, Any]]] = {}
+
+    @staticmethod
+    def supports(detector) -> bool:
+        """シャドウ評価できる検知器か（状態を変更しない judge(features, params) を持つもの）"""
+        return detector is not None and hasattr(detector, "judge")
+
+    @classmethod
+    def _candidate_params(cls, detector, overrides: Mapping[str, float]) -> Dict[str, Any]:
+        """本番の閾値をoverridesで上書きした閾値（設定がコンパイルし直されるまで使い回す）"""
+        cached = cls._params.get(id(overrides))
+        if cached is not None and cached[0] is overrides:
+            return cached[1]
+        if len(cls._params) >= 1024:
+            cls._params.clear()
+        params = dict(detector.PARAMS)
+        params.update(overrides)
+        cls._params[id(overrides)] = (overrides, params)
+        return params
+
+    @classmethod
+    def observe(cls, stage: str, detector, features, live_verdict, overrides: Mapping[str, float]):
+        """本番の評価直後に呼ぶ。候補の閾値（本番の閾値をoverridesで上書き）で判定して記録する"""
+        started = time.perf_counter()
+        try:
+            score, verdict = detector.judge(features, cls._candidate_params(detector, overrides))
+        except Exception as e:
+            print(f"[Shadow] {stage} judge failed: {e}")
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        key = (features.guild_id, stage)
+        stats = cls._stats.get(key)
+        if stats is None:
+            stats = cls._stats[key] = ShadowStats()
+        stats.record(live_verdict is not None, verdict is not None, score, elapsed)
+
+    @classmethod
+    def get_stats(cls, guild_id: int) -> Dict[str, Dict[str, Any]]:
+        """ステージ毎の本番/候補の検知数・検知率・不一致数・スコア分布・判定時間"""
+        return {stage: stats.to_dict() for (gid, stage), stats in sorted(cls._stats.items()) if gid == guild_id}
+
+    @classmethod
+    def reset_stats(cls, guild_id: Optional[int] = None):
+        if guild_id is None:
+            cls._stats.clear()
+            return
+        for key in [key for key in cls._stats if key[0] == guild_id]:
+            del cls._stats[key]
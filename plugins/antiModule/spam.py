@@ -6,6 +6,9 @@ from datetime import datetime, timezone, timedelta
 
 import discord
 from plugins.antiModule.notifier import Notifier
+from plugins.antiModule.state import ExpiringStateStore
+from plugins.antiModule.scheduler import moderation_scheduler
+from plugins.antiModule.message_cache import recent_messages
 from plugins.antiModule.bypass import MiniAntiBypass
 
 # スパム検知用定数・グローバル変数
@@ -48,25 +51,29 @@ TEXT_SPAM_CONFIG = {
     "kana_symbol_run_length": 10,  # ひらがな・カタカナ・記号連続の最小長
     "kana_symbol_run_score": 0.3,  # そのスコア
 }
-user_recent_messages = {}
-user_blocked_until = {}
+# ユーザー毎の状態は最後の使用からTTL秒で破棄する（メッセージ履歴系は長め、時間窓系は窓の長さ）
+USER_STATE_TTL = 600
+user_recent_messages = ExpiringStateStore("text.recent_messages", USER_STATE_TTL)
+user_blocked_until = ExpiringStateStore("blocked_until", BLOCK_DURATION, touch_on_read=False)
 IMAGE_SPAM_THRESHOLD = 3
 IMAGE_SPAM_WINDOW = 30
-user_image_timestamps = {}
+user_image_timestamps = ExpiringStateStore("image.timestamps", IMAGE_SPAM_WINDOW)
 MENTION_SPAM_THRESHOLD = 3
 MENTION_SPAM_WINDOW = 30
-user_mention_timestamps = {}
-user_time_intervals = {}
+user_mention_timestamps = ExpiringStateStore("mention.timestamps", MENTION_SPAM_WINDOW)
+user_time_intervals = ExpiringStateStore("timebase.intervals", USER_STATE_TTL)
 TOKEN_SPAM_WINDOW = 5
 TOKEN_SPAM_THRESHOLD = 3
-content_token_spam_map = {}
+token_spam_index = {}  # {guild_id: NearDuplicateIndex}（TOKEN_SPAM_WINDOW秒で期限切れ）
 TOKEN_SPAM_SIMILARITY_THRESHOLD = 0.85  # 類似度しきい値
 
 # 大人数スパム対応用の定数
-MASS_SPAM_USER_THRESHOLD = 3  # 1分間に5人以上が検知されたら大人数スパムとみなす
+MASS_SPAM_USER_THRESHOLD = 3  # ウィンドウ内に3人以上が検知されたら大人数スパムとみなす
 MASS_SPAM_DETECTION_WINDOW = 10  # 検知ウィンドウ（秒）
 MASS_SPAM_ENHANCED_SLOWMODE = 60  # 大人数スパム時のslowmode（1分）
 MASS_SPAM_LOG_BUFFER_SIZE = 100  # ログバッファサイズ
+BULK_DELETE_LIMIT = 100  # 一括削除1回あたりの最大件数（Discordの上限）
+PURGE_HISTORY_LIMIT = 200  # キャッシュが記録していない期間を履歴から取得するときの最大件数
 
 
 def _now():
@@ -81,7 +88,7 @@ class BaseSpam:
     _slowmode_apply_history = {}
     _slowmode_reset_tasks = {}
     _original_slowmode = {}
-    _timeout_apply_history = {}
+    _timeout_apply_history = ExpiringStateStore("timeout_history", 3600, touch_on_read=False)
     _channel_history_cache = {}
 
     @staticmethod
@@ -102,8 +109,8 @@ class BaseSpam:
                     BaseSpam._original_slowmode[key] = orig_value
         except Exception:
             pass
-        await message.channel.edit(slowmode_delay=seconds, reason=reason)
-        BaseSpam._slowmode_apply_history[key] = int(datetime.now(timezone.utc).timestamp())
+        if await moderation_scheduler.edit_slowmode(message.channel, seconds, reason):
+            BaseSpam._slowmode_apply_history[key] = int(datetime.now(timezone.utc).timestamp())
 
     @staticmethod
     async def reset_slowmode_if_no_spam(channel, author_id, guild_id, reset_delay=60):
@@ -114,10 +121,8 @@ class BaseSpam:
         original_delay = 0
         if hasattr(BaseSpam, "_original_slowmode"):
             original_delay = BaseSpam._original_slowmode.get(key, 0)
-        try:
-            await channel.edit(slowmode_delay=original_delay)
-        except Exception as e:
-            print(f"[ERROR] Failed to reset slowmode: {e}")
+        if not await moderation_scheduler.edit_slowmode(channel, original_delay):
+            print(f"[ERROR] Failed to reset slowmode: {channel.id}")
         # --- 一度戻したら記録を削除 ---
         if hasattr(BaseSpam, "_original_slowmode"):
             BaseSpam._original_slowmode.pop(key, None)
@@ -126,8 +131,7 @@ class BaseSpam:
     async def timeout_member(member, until, reason):
         try:
             if isinstance(member, discord.Member) and hasattr(member, "timeout"):
-                await member.timeout(until, reason=reason)
-                return True
+                return await moderation_scheduler.timeout(member, until, reason)
         except Exception as e:
             print(f"[ERROR] Timeout failed: {e}")
         return False
@@ -135,51 +139,51 @@ class BaseSpam:
     @staticmethod
     async def purge_user_messages(channel, user_id, window_sec=1800):
         """指定ユーザーの直近window_sec秒のメッセージを削除"""
-        now_aware = datetime.now(timezone.utc)
-        now_ts = now_aware.timestamp()
-        messages = []
-        async for msg in channel.history(limit=100, oldest_first=False):
-            if msg.author.id == user_id and (now_ts - msg.created_at.timestamp()) <= window_sec:
-                messages.append(msg)
-        deleted_count = 0
-        consecutive_429 = 0
-        if len(messages) >= 2:
-            try:
-                await channel.delete_messages(messages)
-                deleted_count = len(messages)
-                print(f"[DEBUG] Bulk deleted {deleted_count} messages.")
-            except discord.errors.HTTPException as e:
-                if e.status == 429:
-                    consecutive_429 += 1
-                    print(f"[WARN] 429 detected on bulk delete, aborting and sleeping 30s.")
-                    await asyncio.sleep(30)
-                else:
-                    print(f"[ERROR] HTTPException on bulk delete: {e}")
-            except Exception as e:
-                print(f"[ERROR] Bulk delete failed: {e}")
-        else:
-            for msg in messages:
-                try:
-                    await msg.delete()
-                    deleted_count += 1
-                    print(f"[DEBUG] Deleted message: {msg.id}")
-                    await asyncio.sleep(5.0)
-                except discord.errors.HTTPException as e:
-                    if e.status == 429:
-                        consecutive_429 += 1
-                        print(f"[WARN] 429 detected, aborting further deletes and sleeping 30s.")
-                        await asyncio.sleep(30)
-                        break
-                    else:
-                        print(f"[ERROR] HTTPException deleting message {msg.id}: {e}")
-                        break
-                except Exception as e:
-                    print(f"[ERROR] Failed to delete message {msg.id}: {e}")
-                    break
-                if consecutive_429 >= 2:
-                    print("[WARN] Consecutive 429s, stopping delete loop.")
-                    break
-        print(f"[DEBUG] purge_user_messages (30min) complete. Deleted: {deleted_count}")
+        return await BaseSpam.purge_users_messages(channel, [user_id], window_sec)
+
+    @staticmethod
+    async def purge_users_messages(channel, user_ids, window_sec=1800):
+        """
+        複数ユーザーの直近window_sec秒のメッセージをまとめて削除し、削除した件数を返す
+        削除対象は受信時に記録したキャッシュから求め、キャッシュが記録していない古い期間の分だけ履歴から取得する
+        """
+        user_ids = [int(user_id) for user_id in user_ids]
+        now_ts = datetime.now(timezone.utc).timestamp()
+        by_user = {}
+        uncovered_until = now_ts
+        if hasattr(channel, "get_partial_message"):
+            targets, uncovered_until = recent_messages.lookup(channel.id, user_ids, window_sec, now_ts)
+            by_user = {
+                user_id: [channel.get_partial_message(message_id) for message_id in ids]
+                for user_id, ids in targets.items()
+                if ids
+            }
+        if uncovered_until is not None:
+            # キャッシュより前の期間（境界の同時刻のメッセージを含める）
+            wanted = set(user_ids)
+            seen = {msg.id for msgs in by_user.values() for msg in msgs}
+            async for msg in channel.history(
+                limit=PURGE_HISTORY_LIMIT,
+                before=datetime.fromtimestamp(uncovered_until + 1, timezone.utc),
+                after=datetime.fromtimestamp(now_ts - window_sec, timezone.utc),
+                oldest_first=False,
+            ):
+                if msg.author.id in wanted and msg.id not in seen:
+                    by_user.setdefault(msg.author.id, []).append(msg)
+
+        # 全ユーザー分を100件ずつ一括削除（削除はスケジューラー経由。レート制限・429の待機はスケジューラーが行う）
+        messages = [msg for msgs in by_user.values() for msg in msgs]
+        chunks = [messages[i:i + BULK_DELETE_LIMIT] for i in range(0, len(messages), BULK_DELETE_LIMIT)]
+
+        async def delete_chunk(chunk):
+            if len(chunk) >= 2:
+                return await moderation_scheduler.delete_messages(channel, chunk)
+            return int(await moderation_scheduler.delete_message(chunk[0]))
+
+        deleted_count = sum(await asyncio.gather(*(delete_chunk(chunk) for chunk in chunks)))
+        for user_id, msgs in by_user.items():
+            recent_messages.forget(channel.id, user_id, [msg.id for msg in msgs])
+        print(f"[DEBUG] purge_users_messages complete. Users: {len(user_ids)}, Deleted: {deleted_count}")
         return deleted_count
 
     @staticmethod
@@ -197,17 +201,13 @@ class BaseSpam:
             channel = message.channel
             slowmode_success = False
             if hasattr(channel, "edit"):
-                try:
-                    await channel.edit(
-                        slowmode_delay=MASS_SPAM_ENHANCED_SLOWMODE,
-                        reason="大人数スパム検知による緊急slowmode",
-                    )
+                slowmode_success = await moderation_scheduler.edit_slowmode(
+                    channel, MASS_SPAM_ENHANCED_SLOWMODE, "大人数スパム検知による緊急slowmode"
+                )
+                if slowmode_success:
                     print(f"[MASS SPAM] Enhanced slowmode applied to {channel.id}")
-                    slowmode_success = True
-                except Exception as e:
-                    print(
-                        f"[MASS SPAM] Failed to apply enhanced slowmode to {channel.id}: {e}"
-                    )
+                else:
+                    print(f"[MASS SPAM] Failed to apply enhanced slowmode to {channel.id}")
             if not slowmode_success:
                 print(
                     "[MASS SPAM] Slowmode適用に失敗したため、以降の一括処理をスキップします。"
@@ -218,11 +218,10 @@ class BaseSpam:
             try:
                 # 直近の荒らしユーザー一覧を取得
                 user_ids = list(summary.get("user_counts", {}).keys())
-                now_aware = datetime.now(timezone.utc)
-                now_ts = now_aware.timestamp()
-                for user_id in user_ids:
+
+                async def process_user(user_id):
                     try:
-                        member = await guild.fetch_member(int(user_id))
+                        member = await moderation_scheduler.fetch_member(guild, int(user_id))
                         # タイムアウト（5分）
                         until = datetime.now(timezone.utc) + timedelta(
                             seconds=BLOCK_DURATION
@@ -232,13 +231,21 @@ class BaseSpam:
                         # Kick（必要なら）
                         # await guild.kick(member, reason="大人数スパム検知による自動キック")
                         # print(f"[MASS SPAM] Kicked user {user_id}")
-                        # メッセージ削除（アラート時刻から30分前まで）
-                        deleted = await BaseSpam.purge_user_messages(channel, int(user_id), 1800)
-                        print(
-                            f"[MASS SPAM] Deleted {deleted} messages for user {user_id}"
-                        )
                     except Exception as e:
                         print(f"[MASS SPAM] Failed to process user {user_id}: {e}")
+
+                # 全ユーザー分をまとめて投入し、実行順序・ペースはスケジューラーに任せる
+                # （タイムアウトは削除より優先されるため、全員のタイムアウトが先に処理される）
+                purge = asyncio.ensure_future(
+                    # メッセージ削除（アラート時刻から30分前まで、全ユーザー分をまとめて）
+                    BaseSpam.purge_users_messages(channel, user_ids, 1800)
+                )
+                await asyncio.gather(*(process_user(user_id) for user_id in user_ids))
+                try:
+                    deleted = await purge
+                    print(f"[MASS SPAM] Deleted {deleted} messages for {len(user_ids)} users")
+                except Exception as e:
+                    print(f"[MASS SPAM] Failed to purge messages: {e}")
             except Exception as e:
                 print(f"[MASS SPAM] Error in mass spam batch processing: {e}")            # 管理者への緊急通知
             try:
@@ -246,7 +253,7 @@ class BaseSpam:
                 # 大人数スパム時の通知：関与ユーザー数と削除メッセージ数を含める
                 total_deleted = sum(summary.get("user_counts", {}).values())
                 
-                # 大人数スパム用の特別なalert_typeを送信
+                # 大人数スパム用の特別なalert_typeを送信（送信はNotifierがスケジューラー経由で行う）
                 await notifier.send_alert_notification("mass_spam", total_deleted)
                 print(
                     f"[MASS SPAM] Mass spam alert sent: {summary['unique_users']} users involved, {total_deleted} messages processed"
@@ -313,45 +320,23 @@ class BaseSpam:
                     else 60
                 )
 
-                # --- slowmodeを設定 ---
-                retry_count = 0
-                while True:
-                    try:
-                        print(
-                            f"[INFO] [PRIORITY] Setting slowmode to {target_slowmode}s for channel: {channel_id} (guild: {guild_id}) [retry {retry_count}]"
-                        )
-                        await message.channel.edit(
-                            slowmode_delay=target_slowmode,
-                            reason=(
-                                "荒らし検知による自動低速モード"
-                                if target_slowmode == 60
-                                else "大人数スパム検知による緊急低速モード"
-                            ),
-                        )
-                        BaseSpam._slowmode_apply_history[key] = int(
-                            datetime.now(timezone.utc).timestamp()
-                        )
-                        slowmode_applied = True
-                        break
-                    except discord.errors.HTTPException as e:
-                        if e.status == 429:
-                            wait = getattr(e, "retry_after", None)
-                            if wait is None:
-                                wait = 5
-                            print(
-                                f"[WARN] 429 on slowmode, sleeping for {wait} seconds..."
-                            )
-                            await asyncio.sleep(wait)
-                            retry_count += 1
-                            continue
-                        else:
-                            print(
-                                f"[ERROR] HTTPException (status={e.status}) slowmode: {e}"
-                            )
-                            break
-                    except Exception as e:
-                        print(f"[ERROR] Failed to set slowmode: {e}")
-                        break
+                # --- slowmodeを設定（レート制限の待機・再試行はスケジューラーが行う） ---
+                print(
+                    f"[INFO] [PRIORITY] Setting slowmode to {target_slowmode}s for channel: {channel_id} (guild: {guild_id})"
+                )
+                slowmode_applied = await moderation_scheduler.edit_slowmode(
+                    message.channel,
+                    target_slowmode,
+                    (
+                        "荒らし検知による自動低速モード"
+                        if target_slowmode == 60
+                        else "大人数スパム検知による緊急低速モード"
+                    ),
+                )
+                if slowmode_applied:
+                    BaseSpam._slowmode_apply_history[key] = int(
+                        datetime.now(timezone.utc).timestamp()
+                    )
                 # 既存のslowmode解除タスクがあればキャンセル
                 task = BaseSpam._slowmode_reset_tasks.get(key)
                 if task and not task.done():
@@ -385,7 +370,7 @@ class BaseSpam:
                 now_ts = int(datetime.now(timezone.utc).timestamp())
                 last_timeout = BaseSpam._timeout_apply_history.get(timeout_key, 0)
                 if now_ts - last_timeout > timeout_duration:
-                    member = await message.guild.fetch_member(int(message.author.id))
+                    member = await moderation_scheduler.fetch_member(message.guild, int(message.author.id))
                     timeout_success = await BaseSpam.timeout_member(member, until, reason)
                     if timeout_success:
                         BaseSpam._timeout_apply_history[timeout_key] = int(
@@ -401,74 +386,20 @@ class BaseSpam:
         if slowmode_applied and timeout_success:
 
             async def safe_purge_user_messages():
-                deleted_count = 0
                 try:
-                    channel = message.channel
-                    now_aware = datetime.now(timezone.utc)
-                    now_ts = now_aware.timestamp()
                     # アラート時刻(now)から30分前までのメッセージを全て削除対象に
-                    messages = []
-                    async for msg in channel.history(limit=100, oldest_first=False):
-                        if (
-                            msg.author.id == message.author.id
-                            and (now_ts - msg.created_at.timestamp()) <= 1800
-                        ):
-                            messages.append(msg)
-                    
-                    consecutive_429 = 0
-                    # --- 一括削除を優先 ---
-                    if len(messages) >= 2:
-                        try:
-                            await channel.delete_messages(messages)
-                            deleted_count = len(messages)
-                            print(f"[DEBUG] Bulk deleted {deleted_count} messages.")
-                        except discord.errors.HTTPException as e:
-                            if e.status == 429:
-                                consecutive_429 += 1
-                                print(
-                                    f"[WARN] 429 detected on bulk delete, aborting and sleeping 30s."
-                                )
-                                await asyncio.sleep(30)
-                            else:
-                                print(
-                                    f"[ERROR] HTTPException on bulk delete: {e}"
-                                )
-                        except Exception as e:
-                            print(f"[ERROR] Bulk delete failed: {e}")
-                    else:
-                        for msg in messages:
-                            try:
-                                await msg.delete()
-                                deleted_count += 1
-                                print(f"[DEBUG] Deleted message: {msg.id}")
-                                await asyncio.sleep(5.0)
-                            except discord.errors.HTTPException as e:
-                                if e.status == 429:
-                                    consecutive_429 += 1
-                                    print(
-                                        f"[WARN] 429 detected, aborting further deletes and sleeping 30s."
-                                    )
-                                    await asyncio.sleep(30)
-                                    break
-                                else:
-                                    print(
-                                        f"[ERROR] HTTPException deleting message {msg.id}: {e}"
-                                    )
-                                    break
-                            except Exception as e:
-                                print(f"[ERROR] Failed to delete message {msg.id}: {e}")
-                                break
-                            if consecutive_429 >= 2:
-                                print("[WARN] Consecutive 429s, stopping delete loop.")
-                                break
+                    deleted_count = await BaseSpam.purge_user_messages(
+                        message.channel, message.author.id, 1800
+                    )
                     print(
                         f"[DEBUG] purge_user_messages (30min) complete. Deleted: {deleted_count}"
                     )
-                    
+
                     # 個人スパム時の通知処理（大人数スパム時以外）
                     if not spam_log_aggregator.is_mass_spam_active(guild_id):
                         try:
                             notifier = Notifier(message)
+                            # 直前にアラートを送ったばかりならNotifierがまとめて送る
                             await notifier.send_alert_notification(alert_type, deleted_count)
                             print(f"[DEBUG] Individual spam alert sent: type={alert_type}, deleted={deleted_count}")
                         except Exception as e:
@@ -483,7 +414,6 @@ class BaseSpam:
             print(
                 "[INFO] メッセージ削除処理は、slowmode適用かつtimeout時のみ実行されます。条件を満たさないためスキップします。"
             )
-        await asyncio.sleep(1.0)
         return True
 
 
@@ -505,13 +435,14 @@ class Block:
         # タイムアウト解除（ギルドが指定されていれば解除を試みる）
         if guild is not None:
             try:
-                member = await guild.fetch_member(int(user_id))
+                member = await moderation_scheduler.fetch_member(guild, int(user_id))
                 if hasattr(member, "timeout"):
                     from discord.utils import utcnow
 
-                    await member.timeout(
+                    await moderation_scheduler.timeout(
+                        member,
                         utcnow(),
-                        reason="アンチチート解除コマンドによるタイムアウト解除",
+                        "アンチチート解除コマンドによるタイムアウト解除",
                     )
             except Exception as e:
                 print(f"[ERROR] Timeout解除失敗: {user_id} {e}")
@@ -530,7 +461,7 @@ class Griefing:
             from plugins.antiModule.config import AntiCheatConfig
             
             # フラグシステムが有効かチェック
-            flag_config = await FlagSystem.get_flag_config(message.guild)
+            flag_config = (await AntiCheatConfig.get_compiled(message.guild)).flag_config
             if flag_config.get("enabled", True):
                 # フラグを追加し、必要に応じてアクションを実行
                 action_executed = await FlagSystem.add_flag(message, alert_type)
@@ -548,21 +479,45 @@ class Griefing:
 class GuildConfig:
     @staticmethod
     async def save_guild_json(guild, key, value):
-        import json
-        from DataBase import set_guild_data, get_guild_data
+        import aiodb
 
         guild_id = guild.id if hasattr(guild, "id") else guild
-        data = get_guild_data(guild_id)
-        data[key] = value
-        set_guild_data(guild_id, data)
+        await aiodb.patch(("guild", guild_id, key), value)
 
     @staticmethod
     async def load_guild_json(guild, key):
-        from DataBase import get_guild_data
+        import aiodb
 
         guild_id = guild.id if hasattr(guild, "id") else guild
-        data = get_guild_data(guild_id)
-        return data.get(key)
+        return await aiodb.get(("guild", guild_id, key))
+
+
+class GuildSpamWindow:
+    """ギルドの直近MASS_SPAM_DETECTION_WINDOW秒のスパムログ（ユーザー毎の件数を差分で管理する）"""
+
+    __slots__ = ("entries", "user_counts", "latest")
+
+    def __init__(self):
+        self.entries = deque()  # (timestamp, user_id, alert_type)（追加順）
+        self.user_counts = {}   # {user_id: 窓内の件数}
+        self.latest = 0
+
+    def add(self, log_entry):
+        self.entries.append(log_entry)
+        user_id = log_entry[1]
+        self.user_counts[user_id] = self.user_counts.get(user_id, 0) + 1
+        self.latest = max(self.latest, log_entry[0])
+        self.evict(self.latest)
+
+    def evict(self, now):
+        """窓から外れた古いログを取り除く"""
+        while self.entries and now - self.entries[0][0] > MASS_SPAM_DETECTION_WINDOW:
+            _, user_id, _ = self.entries.popleft()
+            count = self.user_counts[user_id] - 1
+            if count:
+                self.user_counts[user_id] = count
+            else:
+                del self.user_counts[user_id]
 
 
 class SpamLogAggregator:
@@ -570,10 +525,21 @@ class SpamLogAggregator:
 
     def __init__(self):
         self.log_buffer = deque(maxlen=MASS_SPAM_LOG_BUFFER_SIZE)
-        self.guild_spam_counts = {}  # {guild_id: [(timestamp, user_id, alert_type), ...]}
+        self.guild_spam_counts = {}  # {guild_id: GuildSpamWindow}
         self.mass_spam_active = {}  # {guild_id: timestamp}
         self.processed_logs = set()  # 処理済みログのハッシュ
 
+    def _window(self, guild_id, now=None):
+        """ギルドの窓を期限切れのログを除いた状態で返す（空になったギルドは破棄する）"""
+        window = self.guild_spam_counts.get(guild_id)
+        if window is None:
+            return None
+        window.evict(_now() if now is None else max(now, window.latest))
+        if not window.entries:
+            del self.guild_spam_counts[guild_id]
+            return None
+        return window
+
     def add_spam_log(self, guild_id, user_id, alert_type, timestamp):
         # ギルドIDが無効な場合は無視
         if guild_id is None:
@@ -587,27 +553,16 @@ class SpamLogAggregator:
 
         # ギルドごとのスパムログに追加
         if guild_id not in self.guild_spam_counts:
-            self.guild_spam_counts[guild_id] = []
-        self.guild_spam_counts[guild_id].append(log_entry)
+            self.guild_spam_counts[guild_id] = GuildSpamWindow()
+        self.guild_spam_counts[guild_id].add(log_entry)
 
         # 大人数スパム判定のための処理
         self.process_mass_spam(guild_id, log_entry)
 
     def process_mass_spam(self, guild_id, log_entry):
-        # 現在のギルドのスパムログを取得
-        guild_logs = self.guild_spam_counts.get(guild_id, [])
-
-        # 一定数以上のスパムログがある場合に判定
-        if len(guild_logs) >= MASS_SPAM_USER_THRESHOLD:
-            # タイムスタンプでソート
-            sorted_logs = sorted(guild_logs, key=lambda x: x[0])
-
-            # 最初のログと最後のログの時間差を計算
-            time_diff = sorted_logs[-1][0] - sorted_logs[0][0]
-
-            # 時間差が閾値以下であれば大人数スパムとみなす
-            if time_diff <= MASS_SPAM_DETECTION_WINDOW:
-                self.activate_mass_spam_mode(guild_id)
+        # 窓内の検知ユーザー数が閾値以上であれば大人数スパムとみなす
+        if self.check_mass_spam(guild_id, log_entry[0]):
+            self.activate_mass_spam_mode(guild_id)
 
     def activate_mass_spam_mode(self, guild_id):
         # 既にアクティブな場合は何もしない
@@ -628,32 +583,19 @@ class SpamLogAggregator:
     def is_mass_spam_active(self, guild_id):
         return guild_id in self.mass_spam_active
 
-    def check_mass_spam(self, guild_id):
-        # ギルドに関連するスパムログを取得
-        guild_logs = self.guild_spam_counts.get(guild_id, [])
-
-        # 一定数以上のスパムログがあり、かつ最初のログからの時間差が閾値以下であればスパムとみなす
-        if len(guild_logs) >= MASS_SPAM_USER_THRESHOLD:
-            sorted_logs = sorted(guild_logs, key=lambda x: x[0])
-            time_diff = sorted_logs[-1][0] - sorted_logs[0][0]
-            if time_diff <= MASS_SPAM_DETECTION_WINDOW:
-                return True
-        return False
+    def check_mass_spam(self, guild_id, now=None):
+        # 直近MASS_SPAM_DETECTION_WINDOW秒に検知されたユーザーが閾値以上ならスパムとみなす
+        window = self._window(guild_id, now)
+        return window is not None and len(window.user_counts) >= MASS_SPAM_USER_THRESHOLD
 
     def get_recent_spam_summary(self, guild_id):
-        # ギルドに関連するスパムログを取得
-        guild_logs = self.guild_spam_counts.get(guild_id, [])
-
-        # ユーザーごとのスパム回数をカウント
-        user_counts = {}
-        for _, user_id, _ in guild_logs:
-            if user_id not in user_counts:
-                user_counts[user_id] = 0
-            user_counts[user_id] += 1
+        # 窓内のスパムログを集計
+        window = self._window(guild_id)
+        user_counts = dict(window.user_counts) if window is not None else {}
 
         # 結果を返す
         return {
-            "total_logs": len(guild_logs),
+            "total_logs": len(window.entries) if window is not None else 0,
             "unique_users": len(user_counts),
             "user_counts": user_counts,
         }
@@ -0,0 +1,143 @@
+# 検知用のユーザー毎の状態を保持するストア（期限切れ・件数上限つき）
+import sys
+import time
+import asyncio
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Hashable, Optional
+
+DEFAULT_MAX_ENTRIES = 50000
+SWEEP_INTERVAL = 5.0      # 掃除の間隔（秒）
+SWEEP_BUDGET = 1000       # 1回の掃除で調べる最大件数（ストア毎）
+
+# 名前 → ストア（統計と掃除用）
+_stores: Dict[str, "ExpiringStateStore"] = {}
+_sweeper_task: Optional[asyncio.Task] = None
+
+
+class ExpiringStateStore(MutableMapping):
+    """
+    dictと同じように使えるストア。各エントリは最後の書き込み（touch_on_read=Trueなら読み込みも）から
+    ttl秒で期限切れになり、max_entriesを超えた場合は最も長く使われていないものから追い出す。
+    期限切れのエントリは参照時に取り除かれるほか、sweep()で少しずつ掃除される。
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = DEFAULT_MAX_ENTRIES, touch_on_read: bool = True):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_on_read = touch_on_read
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [value, expires_at]（先頭が最も古い）
+        self.stats = {"expired": 0, "evicted": 0}
+        _stores[name] = self
+
+    # --- dictとしての操作 ---
+    def _live(self, key, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[key]
+            self.stats["expired"] += 1
+            return None
+        return entry
+
+    def __getitem__(self, key):
+        now = time.monotonic()
+        entry = self._live(key, now)
+        if entry is None:
+            raise KeyError(key)
+        if self.touch_on_read:
+            entry[1] = now + self.ttl
+            self._data.move_to_end(key)
+        return entry[0]
+
+    def __contains__(self, key) -> bool:
+        return self._live(key, time.monotonic()) is not None
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """値を保存する。ttlを指定するとこのエントリだけ期限を変える"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = [value, expires_at]
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        now = time.monotonic()
+        return iter([key for key, entry in self._data.items() if entry[1] > now])
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+    # --- 掃除・統計 ---
+    def sweep(self, budget: int = SWEEP_BUDGET) -> int:
+        """
+        古い順に最大budget件を調べて期限切れを取り除く。期限の切れていないエントリに当たったら終了する
+        （個別にttlを指定したエントリが残る場合があるが、それらは参照時に取り除かれる）
+        """
+        now = time.monotonic()
+        removed = 0
+        for _ in range(budget):
+            if not self._data:
+                break
+            key, entry = next(iter(self._data.items()))
+            if entry[1] > now:
+                break
+            del self._data[key]
+            removed += 1
+        self.stats["expired"] += removed
+        return removed
+
+    def approx_bytes(self) -> int:
+        """おおよそのメモリ使用量（キー・値と、値がコンテナなら1段目の要素まで）"""
+        total = sys.getsizeof(self._data)
+        for key, (value, _) in self._data.items():
+            total += sys.getsizeof(key) + sys.getsizeof(value)
+            if isinstance(value, (list, tuple, set, frozenset)) or hasattr(value, "maxlen"):
+                total += sum(sys.getsizeof(item) for item in value)
+            elif isinstance(value, dict):
+                total += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, entries=len(self._data), max_entries=self.max_entries,
+                    ttl=self.ttl, bytes=self.approx_bytes())
+
+
+def get_state_stats() -> Dict[str, Dict[str, Any]]:
+    """ストア毎のエントリ数・おおよそのバイト数・期限切れ/追い出し数"""
+    return {name: store.get_stats() for name, store in _stores.items()}
+
+
+async def _sweep_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        for store in list(_stores.values()):
+            try:
+                store.sweep()
+            except Exception as e:
+                print(f"[AntiCheat] State sweep failed ({store.name}): {e}")
+
+
+def ensure_sweeper(interval: float = SWEEP_INTERVAL):
+    """掃除タスクを開始する（実行中のイベントループ上で呼ぶこと。開始済みなら何もしない）"""
+    global _sweeper_task
+    if _sweeper_task is not None and not _sweeper_task.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _sweeper_task = loop.create_task(_sweep_loop(interval))
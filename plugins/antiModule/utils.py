@@ -2,15 +2,15 @@
 
 import time
 import re
-import difflib
+from lib import similarity as _similarity
 
 def now():
     """現在のUNIXタイムスタンプ（int秒）"""
     return int(time.time())
 
 def similarity(a, b):
-    """2つの文字列の類似度（0.0〜1.0）"""
-    return difflib.SequenceMatcher(None, a, b).ratio()
+    """2つの文字列の類似度（0.0〜1.0。lib.similarity.ratio）"""
+    return _similarity.ratio(a, b)
 
 def is_japanese(text):
     """日本語文字が含まれているか判定"""
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta, timezone
 import re
 from plugins import register_command
 from DataBase import get_guild_value, update_guild_data
+import aiodb
 from plugins.common_ui import ModalInputView
 from lib.youtubeRSS import YoutubeRssApi, YoutubeLiveStatus, YoutubeVideoType
 from lib.op import OP_GUILD_ADMIN
@@ -237,7 +238,7 @@ class VideoNotificationModal(discord.ui.Modal, title="動画通知設定"):
                 }
             )
 
-        update_guild_data(guild_id, "youtube_channels", channels)
+        await aiodb.update_guild_data(guild_id, "youtube_channels", channels)
 
 
 class VideoNotificationView(discord.ui.View):
@@ -514,7 +515,7 @@ class DeleteNotificationView(discord.ui.View):
                 channel_name = ch.get("channel_name") or channel_id
                 break
         channels = [ch for ch in channels if ch.get("channel_id") != channel_id]
-        update_guild_data(self.guild_id, "youtube_channels", channels)
+        await aiodb.update_guild_data(self.guild_id, "youtube_channels", channels)
 
         embed = discord.Embed(
             title="✅ 設定削除完了",
@@ -649,7 +650,7 @@ class VideoNotificationHandler:
             if ch.get("channel_id") == channel_info.get("channel_id"):
                 channels[i] = channel_info
                 break
-        update_guild_data(guild.id, "youtube_channels", channels)
+        await aiodb.update_guild_data(guild.id, "youtube_channels", channels)
         if debug:
             print(f"[DEBUG] 通知チェック完了: {channel_id}")
 
@@ -1116,7 +1117,7 @@ class NotificationModeChoiceView(discord.ui.View):
                         del ch["role_mention"]
                     channels[i] = ch
                     break
-            update_guild_data(self.guild_id, "youtube_channels", channels)
+            await aiodb.update_guild_data(self.guild_id, "youtube_channels", channels)
             mode_text = "Embedモード（詳細）" if mode == "embed" else "URLモード（軽量）"
             embed = discord.Embed(
                 title="✅ 通知モードを保存しました",
@@ -1223,7 +1224,7 @@ class RoleMentionView(discord.ui.View):
                 channels[i] = ch
                 break
         
-        update_guild_data(self.guild_id, "youtube_channels", channels)
+        await aiodb.update_guild_data(self.guild_id, "youtube_channels", channels)
         
         embed = discord.Embed(
             title="✅ URLモード設定完了",
@@ -5,7 +5,6 @@ Discord Botプロジェクトで使用される共通のユーティリティ関
 """
 
 import os
-import json
 import platform
 import random
 import psutil
@@ -15,6 +14,8 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
 import subprocess
 import re
+from lib.fileio import atomic_write_json
+from lib import jsoncodec
 
 # グローバルIP取得のキャッシュ
 _global_ip_cache = {
@@ -273,8 +274,7 @@ def load_config_file(filename: str) -> Dict[str, Any]:
         return {}
     
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return jsoncodec.load_file(filename)
     except Exception as e:
         print(f"❌ 設定ファイル読み込みエラー: {e}")
         return {}
@@ -282,8 +282,8 @@ def load_config_file(filename: str) -> Dict[str, Any]:
 def save_config_file(filename: str, config: Dict[str, Any]) -> bool:
     """設定ファイルを保存"""
     try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        # 書き込み途中で落ちても設定ファイルが壊れないようアトミックに置き換える
+        atomic_write_json(filename, config)
         return True
     except Exception as e:
         print(f"❌ 設定ファイル保存エラー: {e}")